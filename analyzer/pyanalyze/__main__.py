@@ -1,6 +1,8 @@
 import argparse
 from pyanalyze.manager import VandalManager
 from pyanalyze.heuristics.load_heuristics import get_heuristics
+from pyanalyze.metrics import sink_from_spec
+from pyanalyze.budget import Budget
 from logging import getLogger, basicConfig, INFO
 
 basicConfig(level=INFO)
@@ -12,7 +14,7 @@ parser = argparse.ArgumentParser(description="Vandal Python Analyzer")
 parser.add_argument(
     "action",
     help="Whether to run once and output to file or run continuously",
-    choices=["cli", "file"],
+    choices=["cli", "file", "backfill"],
 )
 parser.add_argument("--config", help="Config file")
 parser.add_argument("--ipc", help="Path to Geth IPC socket", default="/tmp/geth.ipc")
@@ -20,9 +22,107 @@ parser.add_argument(
     "--heuristics", help="Heuristics to run. If not specified, all heuristics will be run. Separate multiple heuristics with a comma"
 )
 parser.add_argument("--heuristic-dir", help="Directory to load custom heuristics from")
+parser.add_argument(
+    "--trace-cache",
+    help="Directory to cache binary traces in. Cached transactions are not traced again",
+)
+parser.add_argument(
+    "--metrics",
+    help="Record per-stage latencies and counters, exporting them to stdout, "
+    "jsonl:<path> or http:[<host>:]<port>",
+)
+parser.add_argument(
+    "--metrics-interval",
+    help="Seconds between metrics exports",
+    type=float,
+    default=60.0,
+)
+
+budget_group = parser.add_argument_group(
+    "Budget Options",
+    "Per-transaction limits. Transactions over the op or variable limit are "
+    "only analyzed at call depth 1. Transactions out of time or links are "
+    "deferred and rerun that way once no new transactions are waiting",
+)
+budget_group.add_argument("--max-tx-seconds", help="Wall time per transaction", type=float)
+budget_group.add_argument("--max-tx-ops", help="Ops per transaction trace", type=int)
+budget_group.add_argument("--max-tx-variables", help="Variables loaded per transaction", type=int)
+budget_group.add_argument("--max-tx-links", help="Links made per transaction", type=int)
+budget_group.add_argument(
+    "--defer-queue-size",
+    help="Deferred transactions kept. Over budget transactions are cut short instead of deferred when 0",
+    type=int,
+    default=256,
+)
 
 cli_group = parser.add_argument_group("Continuous Options")
 cli_group.add_argument("--block", help="Block to start from", default="latest")
+cli_group.add_argument(
+    "--checkpoint",
+    help="SQLite file recording progress. When it has progress recorded, "
+    "analysis resumes where it left off instead of starting from --block",
+)
+cli_group.add_argument(
+    "--workers",
+    help="Analyze transactions in this many worker processes",
+    type=int,
+)
+cli_group.add_argument(
+    "--queue-size",
+    help="Maximum transactions buffered between pipeline stages",
+    type=int,
+    default=1024,
+)
+cli_group.add_argument(
+    "--ipc-concurrency",
+    help="Trace transactions asynchronously with up to this many IPC requests in flight",
+    type=int,
+)
+cli_group.add_argument(
+    "--ipc-batch-size",
+    help="Transactions per JSON-RPC batch request when --ipc-concurrency is set",
+    type=int,
+    default=1,
+)
+cli_group.add_argument(
+    "--ipc-connections",
+    help="IPC sockets to spread requests over when --ipc-concurrency is set",
+    type=int,
+    default=1,
+)
+cli_group.add_argument(
+    "--block-traces",
+    help="Trace all transactions of a block with one debug_traceVandalBlockByNumber "
+    "call, falling back to tracing them one by one if the node does not offer it",
+    action="store_true",
+)
+backfill_group = parser.add_argument_group(
+    "Backfill Options",
+    "Analyze a historical block range, split into shards that are fetched and "
+    "traced concurrently. Progress is kept in --checkpoint, and a rerun over "
+    "the same range resumes it. --workers, --ipc-* and --queue-size apply as well",
+)
+backfill_group.add_argument("--from", help="First block", type=int, dest="from_block")
+backfill_group.add_argument("--to", help="Last block, inclusive", type=int, dest="to_block")
+backfill_group.add_argument(
+    "--shard-size",
+    help="Blocks per shard",
+    type=int,
+    default=1000,
+)
+backfill_group.add_argument(
+    "--shard-workers",
+    help="Shards fetched and traced at once",
+    type=int,
+    default=4,
+)
+backfill_group.add_argument(
+    "--owner",
+    help="Name for the shards claimed by this process, when several share a "
+    "checkpoint. A restart with the same name takes its unfinished shards back "
+    "straight away. Defaults to <host>:<pid>",
+)
+
 file_group = parser.add_argument_group("One-shot Options")
 file_group.add_argument(
     "--output",
@@ -42,13 +142,49 @@ else:
 if args.action == "file" and not args.tx:
     parser.error("--tx is required when running in file mode")
 
+if args.action == "backfill":
+    if args.from_block is None or args.to_block is None:
+        parser.error("--from and --to are required when running in backfill mode")
+    if args.to_block < args.from_block:
+        parser.error("--to must not be before --from")
+    if not args.checkpoint:
+        args.checkpoint = f"backfill-{args.from_block}-{args.to_block}.db"
+
+budget = Budget(
+    args.max_tx_seconds, args.max_tx_ops, args.max_tx_variables, args.max_tx_links
+)
+if not budget.is_limited():
+    budget = None
+
+metrics_sink = None
+if args.metrics:
+    try:
+        metrics_sink = sink_from_spec(args.metrics)
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+
 if args.action == "cli":
     logger.info("Starting Vandal Analyzer in CLI mode")
 
     if args.block != 'latest':
         args.block = int(args.block)
 
-    manager = VandalManager(args.ipc, args.block)
+    manager = VandalManager(
+        args.ipc,
+        args.block,
+        ipc_concurrency=args.ipc_concurrency,
+        ipc_batch_size=args.ipc_batch_size,
+        ipc_connections=args.ipc_connections,
+        queue_size=args.queue_size,
+        workers=args.workers,
+        trace_cache=args.trace_cache,
+        metrics_sink=metrics_sink,
+        metrics_interval=args.metrics_interval,
+        budget=budget,
+        defer_queue_size=args.defer_queue_size,
+        checkpoint=args.checkpoint,
+        block_traces=args.block_traces,
+    )
 
     for heuristic in heuristics:
         h = heuristic()
@@ -60,9 +196,53 @@ if args.action == "cli":
         logger.info("Exiting...")
         manager.stop()
        
+if args.action == "backfill":
+    logger.info(f"Starting Vandal Analyzer in backfill mode, checkpointing to {args.checkpoint}")
+
+    manager = VandalManager(
+        args.ipc,
+        output_dir=args.output,
+        ipc_concurrency=args.ipc_concurrency,
+        ipc_batch_size=args.ipc_batch_size,
+        ipc_connections=args.ipc_connections,
+        queue_size=args.queue_size,
+        workers=args.workers,
+        trace_cache=args.trace_cache,
+        metrics_sink=metrics_sink,
+        metrics_interval=args.metrics_interval,
+        budget=budget,
+        defer_queue_size=args.defer_queue_size,
+        checkpoint=args.checkpoint,
+        block_traces=args.block_traces,
+    )
+
+    for heuristic in heuristics:
+        h = heuristic()
+        manager.register_heuristic(h)
+
+    try:
+        manager.run_backfill(
+            args.from_block,
+            args.to_block,
+            args.shard_size,
+            args.shard_workers,
+            args.owner,
+        )
+    except KeyboardInterrupt:
+        logger.info("Exiting...")
+        manager.stop()
+
 if args.action == "file" and args.tx:
     logger.info("Starting Vandal Analyzer in file mode")
-    manager = VandalManager(args.ipc, args.block, args.output)
+    manager = VandalManager(
+        args.ipc,
+        args.block,
+        args.output,
+        trace_cache=args.trace_cache,
+        metrics_sink=metrics_sink,
+        metrics_interval=args.metrics_interval,
+        budget=budget,
+    )
 
     for heuristic in heuristics:
         h = heuristic()
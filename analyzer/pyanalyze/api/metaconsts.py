@@ -30,3 +30,10 @@ OP_INDEX = 0
 CALL_INDEX = 1
 PC = 2
 DEPTH = 3
+
+attribute_columns = {
+    "op_index": OP_INDEX,
+    "call_index": CALL_INDEX,
+    "pc": PC,
+    "depth": DEPTH,
+}
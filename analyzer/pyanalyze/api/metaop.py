@@ -1,4 +1,5 @@
 from pyanalyze.api.metavariable import MetaVariable
+import copy
 
 
 class MetaOp:
@@ -13,6 +14,17 @@ class MetaOp:
         self.address = None
         self._op_ws_index = None
 
+    def detached(self) -> "MetaOp":
+        """Copy of this op whose variables are detached from the def-use
+        graph, so it can be pickled without the rest of the transaction"""
+        op = copy.copy(self)
+
+        for key, value in op.__dict__.items():
+            if isinstance(value, MetaVariable):
+                setattr(op, key, value.detached())
+
+        return op
+
     def to_np(self):
         return [self.op_index, self.call_index, self.pc, self.depth]
 
@@ -0,0 +1,131 @@
+import operator
+import numpy as np
+from pyanalyze.api.metaop import MetaOp
+from pyanalyze.api.metaconsts import attribute_columns
+from pyanalyze.api.metaopfilter import OpFilter
+from pyanalyze.api.metaopstore import MetaOpStore
+
+RANGE_OPERATORS = (operator.lt, operator.le, operator.gt, operator.ge)
+
+
+class MetaOpJoin:
+    """Joins ops against a list of link ops under a list of link filters.
+
+    Filters on the integer op attributes (op_index, call_index, pc, depth) are
+    planned instead of being evaluated per pair: equality filters become a hash
+    join, the first range filter becomes a searchsorted range scan over the
+    hash bucket, and any other comparison becomes a vectorized mask. Filters
+    with a custom operator or a non-integer attribute are opaque and are
+    evaluated per candidate pair, as MetaOpView.link used to do for every pair.
+
+    Ops are passed in as attribute rows (see MetaOpStore.rows). Matches are
+    always returned in the order of link_ops.
+    """
+
+    def __init__(self, link_ops: MetaOpStore, filters: list[OpFilter]):
+        self.link_ops = link_ops
+        self.columns = link_ops.columns
+
+        self.eq_filters: list[OpFilter] = []
+        self.range_filter: OpFilter = None
+        self.mask_filters: list[OpFilter] = []
+        self.opaque_filters: list[OpFilter] = []
+
+        self._plan(filters)
+
+        self.buckets = {}
+        self._build_buckets()
+
+    @staticmethod
+    def is_planned(filter: OpFilter) -> bool:
+        return filter.attribute in attribute_columns and filter.operator in (
+            operator.eq,
+            operator.ne,
+        ) + RANGE_OPERATORS
+
+    def _plan(self, filters: list[OpFilter]):
+        for filter in filters:
+            if not MetaOpJoin.is_planned(filter):
+                self.opaque_filters.append(filter)
+            elif filter.operator is operator.eq:
+                self.eq_filters.append(filter)
+            elif filter.operator in RANGE_OPERATORS and self.range_filter is None:
+                self.range_filter = filter
+            else:
+                self.mask_filters.append(filter)
+
+        self.eq_columns = [attribute_columns[f.attribute] for f in self.eq_filters]
+
+    def _build_buckets(self):
+        groups = {}
+
+        if self.eq_columns:
+            keys = zip(*(self.columns[f.attribute].tolist() for f in self.eq_filters))
+            for i, key in enumerate(keys):
+                groups.setdefault(key, []).append(i)
+        elif len(self.link_ops) > 0:
+            groups[()] = list(range(len(self.link_ops)))
+
+        for key, indices in groups.items():
+            indices = np.array(indices, dtype=np.int64)
+
+            if self.range_filter is not None:
+                values = self.columns[self.range_filter.attribute][indices]
+                order = np.argsort(values, kind="stable")
+                self.buckets[key] = (indices[order], values[order])
+            else:
+                self.buckets[key] = (indices, None)
+
+    def _range(self, value: int, indices: np.ndarray, values: np.ndarray) -> np.ndarray:
+        # filters compare (op, link_op), so op < link_op selects link ops
+        # sorted strictly above value, and so on
+        op = self.range_filter.operator
+
+        if op is operator.lt:
+            indices = indices[np.searchsorted(values, value, side="right") :]
+        elif op is operator.le:
+            indices = indices[np.searchsorted(values, value, side="left") :]
+        elif op is operator.gt:
+            indices = indices[: np.searchsorted(values, value, side="left")]
+        else:
+            indices = indices[: np.searchsorted(values, value, side="right")]
+
+        return np.sort(indices)
+
+    def match_indices(self, row: tuple) -> np.ndarray:
+        key = tuple(row[col] for col in self.eq_columns)
+
+        if key not in self.buckets:
+            return np.empty((0,), dtype=np.int64)
+
+        indices, values = self.buckets[key]
+
+        if self.range_filter is not None:
+            value = row[attribute_columns[self.range_filter.attribute]]
+            indices = self._range(value, indices, values)
+
+        for filter in self.mask_filters:
+            if len(indices) == 0:
+                break
+
+            value = row[attribute_columns[filter.attribute]]
+            indices = indices[filter.operator(value, self.columns[filter.attribute][indices])]
+
+        return indices
+
+    def match(self, row: tuple, op: MetaOp = None) -> list[MetaOp]:
+        """Return the link ops matching row. op is only needed, and only
+        built by the caller, when opaque filters are present"""
+        link_ops = [self.link_ops[i] for i in self.match_indices(row).tolist()]
+
+        if not self.opaque_filters:
+            return link_ops
+
+        return [
+            link_op
+            for link_op in link_ops
+            if all(
+                filter.operator(getattr(op, filter.attribute), getattr(link_op, filter.attribute))
+                for filter in self.opaque_filters
+            )
+        ]
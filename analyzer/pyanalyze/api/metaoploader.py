@@ -1,101 +1,255 @@
 from pyanalyze.vandal.tac_cfg import TACGraph, TACAssignOp
 import pyanalyze.vandal.opcodes as opcodes
-from pyanalyze.api.metaop import MetaOp, op_name_to_metaop, metaop_to_op_name
+import pyanalyze.vandal.destack as destack
+from pyanalyze.vandal.memtypes import TraceMemory, StorageIndex
+from pyanalyze.api.metaop import MetaOp, metaop_to_op_name
 from pyanalyze.api.metaopview import *
 from pyanalyze.api.metavariable import MetaVariable
+from pyanalyze.api.metaopstore import MetaOpStore
+from pyanalyze.api.reachability import ReachabilityIndex
+from pyanalyze.api.querycache import QueryCache
+from pyanalyze.budget import BudgetMeter, BudgetExceeded
+from pyanalyze import metrics
 
 
 class MetaOpLoader:
-    def __init__(self, cfg: TACGraph, possible_ops : list[MetaOp]):
+    def __init__(
+        self,
+        cfg: TACGraph,
+        possible_ops : list[MetaOp],
+        max_depth: int = None,
+        meter: BudgetMeter = None,
+    ):
+        """
+        Args:
+          cfg: graph to load the ops of
+          possible_ops: the MetaOps to load
+          max_depth: only load ops up to this call depth if set
+          meter: budget checked while loading and by every query on the
+            loaded ops, which raise BudgetExceeded once it is used up
+        """
         self.ops: dict[str, MetaOpView] = {}
-
-        self._load(cfg, possible_ops)
-
+        self.reachability: ReachabilityIndex = None
+        self.query_cache = QueryCache()
+        self.meter = meter
+
+        # memory of every call frame, which can be read as of any op (see
+        # TraceMemory.word)
+        self.memory = cfg.memory if cfg is not None else TraceMemory()
+
+        # every SLOAD and SSTORE by address and slot (see StorageIndex)
+        self.storage = cfg.storage if cfg is not None else StorageIndex()
+
+        if cfg is not None:
+            records, addresses = MetaOpLoader._tac_records(cfg)
+            self._load(records, addresses, possible_ops, MetaOpLoader._lhs_value, max_depth)
+
+    @classmethod
+    def from_trace(
+        cls,
+        trace: dict,
+        possible_ops : list[MetaOp],
+        max_depth: int = None,
+        meter: BudgetMeter = None,
+    ) -> "MetaOpLoader":
+        """Load the ops of a trace directly, without building a TACGraph (see
+        destack.destackify). Equivalent to
+        MetaOpLoader(TACGraph.from_geth(trace), possible_ops, ...)"""
+        memory = TraceMemory()
+        storage = StorageIndex(trace["To"])
+
+        try:
+            with metrics.timer("loader.destackify"):
+                records, addresses = destack.destackify(trace, memory, storage, meter)
+        except BudgetExceeded:
+            raise
+        except Exception:
+            # traces the TACGraph cannot be built for either. Rerun them
+            # through it so the error raised is the same
+            metrics.count("loader.tac_fallbacks")
+            return cls(TACGraph.from_geth(trace), possible_ops, max_depth, meter)
+
+        loader = cls(None, possible_ops, meter=meter)
+        loader.memory = memory
+        loader.storage = storage
+
+        with metrics.timer("loader.build"):
+            loader._load(records, addresses, possible_ops, max_depth=max_depth)
+
+        return loader
+
+    @metrics.timed("loader.get_ops")
     def get_ops(self, op_name: str, **kwargs) -> MetaOpView:
         if op_name not in self.ops:
             return None
 
-        return self.ops[op_name].filter(**kwargs)
+        # every query gets its own snapshot, so heuristics sharing this
+        # loader never see each other's filters and links. The filtered view
+        # is computed once per distinct filter list
+        filters_key = QueryCache.filters_key(kwargs.get("filters"))
+        plan = ("get_ops", op_name, filters_key) if filters_key is not None else None
 
-    def _load(self, cfg: TACGraph, possible_ops : list[MetaOp]):
-        vars = {}
-        ops = {}
-        addresses: dict[int, str] = {1: cfg.sc_addr.lower()}
+        view = self.query_cache.get(plan)
+        if view is None:
+            view = self.ops[op_name].snapshot().filter(**kwargs)
+            if view is None:
+                return None
 
-        supported_ops = []
-        for op_cls in possible_ops:
-            supported_ops.append(metaop_to_op_name[op_cls])
+            view.plan = plan
+            self.query_cache.put(plan, view)
 
-        for block in cfg.blocks:
-            for op in block.tac_ops:
-                used_var_names = []
-                def_var_name = None
-                value = None
-                meta_op = None
-
-                if op.opcode.name not in self.ops:
-                    self.ops[op.opcode.name] = []
+        return view.snapshot()
 
-                if op.opcode != opcodes.CONST:
-                    used_var_names = [var.value.name for var in op.args]
+    @staticmethod
+    def _tac_records(cfg: TACGraph) -> tuple[list[destack.Record], dict[int, str]]:
+        """The ops of cfg as destack records. The value of each record is the
+        lhs Variable, resolved by _lhs_value only if it is loaded"""
+        records = []
+        addresses: dict[int, str] = {1: cfg.sc_addr.lower()}
 
+        for block in cfg.blocks:
+            for op in block.tac_ops:
                 if op.opcode.is_call():
                     addresses[op.depth + 1] = hex(
                         next(iter(op.args[1].value.value))
                     ).lower()
 
-                if isinstance(op, TACAssignOp):
-                    def_var_name = op.lhs.name
-
-                    if op.lhs.is_finite:
-                        value = op.lhs.values.const_value
-
-                meta_op_type = op_name_to_metaop[op.opcode.name]
-
-                if op.opcode.name not in supported_ops:
-                    if def_var_name is not None:
-                        used_vars = [vars[used_var] for used_var in used_var_names]
-                        def_var = MetaVariable(def_var_name, value, used_vars)
-                        vars[def_var_name] = def_var
-
-                        for used_var in used_vars:
-                            used_var._children.append(def_var)
-            
-                    continue
-
-                if def_var_name is not None:
-                    used_vars = [vars[used_var] for used_var in used_var_names]
-                    def_var = MetaVariable(def_var_name, value, used_vars)
-                    vars[def_var_name] = def_var
-
-                    for used_var in used_vars:
-                        used_var._children.append(def_var)
-
-                    meta_op = meta_op_type(
-                        op.op_index,
-                        op.call_index,
-                        op.pc,
+                lhs = op.lhs if isinstance(op, TACAssignOp) else None
+                records.append(
+                    (
                         op.opcode.name,
-                        op.depth,
-                        used_vars,
-                        def_var,
-                    )
-                else:
-                    used_vars = [vars[used_var] for used_var in used_var_names]
-                    meta_op = meta_op_type(
+                        MetaOpLoader._used_var_names(op),
+                        lhs.name if lhs is not None else None,
+                        lhs,
                         op.op_index,
                         op.call_index,
                         op.pc,
-                        op.opcode.name,
                         op.depth,
-                        used_vars,
                     )
+                )
+
+        return records, addresses
+
+    @staticmethod
+    def _lhs_value(lhs) -> int:
+        return lhs.values.const_value if lhs.is_finite else None
+
+    def _load(
+        self,
+        records: list[destack.Record],
+        addresses: dict[int, str],
+        possible_ops : list[MetaOp],
+        resolve_value=None,
+        max_depth: int = None,
+    ):
+        vars = {}
+        ops = {}
 
-                if op.opcode.name not in ops:
-                    ops[op.opcode.name] = []
-                ops[op.opcode.name].append(meta_op)
-
-                meta_op._op_ws_index = len(ops[op.opcode.name]) - 1
+        supported_ops = []
+        for op_cls in possible_ops:
+            supported_ops.append(metaop_to_op_name[op_cls])
 
-        for op_name, meta_ops in ops.items():
-            self.ops[op_name] = op_name_to_opview[op_name](op_name, meta_ops, addresses)
+        # first pass: record where every variable is defined and which ops
+        # are loaded, without building any MetaVariables
+        assigns = []
+        defs = {}
+        required = []
+
+        for record in records:
+            op_name, used_var_names, def_name = record[0], record[1], record[2]
+
+            if op_name not in self.ops:
+                self.ops[op_name] = []
+
+            if def_name is not None:
+                assigns.append(record)
+                defs.setdefault(def_name, []).append(used_var_names)
+
+            if op_name in supported_ops and (max_depth is None or record[7] <= max_depth):
+                required.append(record)
+
+        # only variables the loaded ops depend on are materialized. Any
+        # def-use path between two of them runs through their ancestors, so
+        # descendant / ancestor queries between loaded ops are unaffected.
+        live = self._backward_slice(defs, required, self.meter)
+
+        if self.meter is not None:
+            self.meter.check_variables(len(live))
+            self.meter.check()
+
+        for _, used_var_names, def_name, value, *_ in assigns:
+            if def_name not in live:
+                continue
+
+            if resolve_value is not None:
+                value = resolve_value(value)
+            used_vars = [vars[name] for name in used_var_names]
+
+            def_var = MetaVariable(def_name, value, used_vars)
+            vars[def_name] = def_var
+
+            for used_var in used_vars:
+                used_var._children.append(def_var)
+
+        for op_name, used_var_names, def_name, _, op_index, call_index, pc, depth in required:
+            used_vars = [vars[name] for name in used_var_names]
+            def_var = vars[def_name] if def_name is not None else None
+
+            # MetaOps are built lazily by the store, only columns and
+            # variables are recorded here
+            if op_name not in ops:
+                ops[op_name] = MetaOpStore(op_name)
+            ops[op_name].append(op_index, call_index, pc, depth, used_vars, def_var)
+
+        # ops that only occur below max_depth are loaded as empty views
+        for op_name in supported_ops if max_depth is not None else []:
+            if op_name in self.ops and op_name not in ops:
+                ops[op_name] = MetaOpStore(op_name)
+
+        metrics.observe("loader.records", len(records), metrics.SIZE_BUCKETS)
+        metrics.observe("loader.ops", len(required), metrics.SIZE_BUCKETS)
+        metrics.observe("loader.variables", len(vars), metrics.SIZE_BUCKETS)
+
+        # variables are defined after all of their parents, so vars is in
+        # topological order
+        self.reachability = ReachabilityIndex(list(vars.values()))
+
+        for op_name, store in ops.items():
+            self.ops[op_name] = op_name_to_opview[op_name](
+                op_name, store.finalize(), addresses, self.reachability
+            )
+            self.ops[op_name].query_cache = self.query_cache
+            self.ops[op_name].meter = self.meter
+
+    @staticmethod
+    def _used_var_names(op) -> list[str]:
+        if op.opcode == opcodes.CONST:
+            return []
+        return [var.value.name for var in op.args]
+
+    @staticmethod
+    def _backward_slice(defs: dict, required: list, meter: BudgetMeter = None) -> set[str]:
+        """Names of the variables defined or used by the required ops, and of
+        all their ancestors. defs maps each variable to the used variable
+        names of every op defining it. meter is ticked once per variable"""
+        live = set()
+        stack = []
+
+        for _, used_var_names, def_name, *_ in required:
+            stack.extend(used_var_names)
+            if def_name is not None:
+                stack.append(def_name)
+
+        while stack:
+            name = stack.pop()
+            if name in live:
+                continue
+
+            if meter is not None:
+                meter.tick()
+
+            live.add(name)
+            for used_var_names in defs.get(name, ()):
+                stack.extend(used_var_names)
+
+        return live
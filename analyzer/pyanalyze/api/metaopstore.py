@@ -0,0 +1,110 @@
+import numpy as np
+from pyanalyze.api.metaop import MetaOp, op_name_to_metaop
+from pyanalyze.api.metaconsts import attribute_columns
+from pyanalyze.api.metavariable import MetaVariable
+
+
+class MetaOpStore:
+    """Struct-of-arrays storage for all ops of a single opcode.
+
+    The integer attributes of every op are kept as contiguous int64 columns
+    (see metaconsts.attribute_columns), alongside the variables each op uses
+    and defines. MetaOp objects are only built the first time an op is
+    indexed, so filtering over the columns never allocates them.
+    """
+
+    def __init__(self, op_name: str):
+        self.op_name = op_name
+        self.op_cls = op_name_to_metaop[op_name]
+
+        self.columns: dict[str, np.ndarray] = {
+            attr: np.empty((0,), dtype=np.int64) for attr in attribute_columns
+        }
+        self.used_vars: list[list[MetaVariable]] = []
+        self.def_vars: list[MetaVariable] = []
+
+        self._rows: list[tuple] = []
+        self._ops: list[MetaOp] = []
+
+    @classmethod
+    def from_ops(cls, op_name: str, ops: list[MetaOp]) -> "MetaOpStore":
+        """Wrap already built MetaOps, e.g. when a view is created by hand"""
+        store = cls(op_name)
+
+        for i, op in enumerate(ops):
+            op._op_ws_index = i
+            store._rows.append(tuple(op.to_np()))
+            store.used_vars.append(None)
+            store.def_vars.append(None)
+
+        store.finalize()
+        store._ops = list(ops)
+
+        return store
+
+    def append(
+        self,
+        op_index: int,
+        call_index: int,
+        pc: int,
+        depth: int,
+        used_vars: list[MetaVariable],
+        def_var: MetaVariable = None,
+    ):
+        self._rows.append((op_index, call_index, pc, depth))
+        self.used_vars.append(used_vars)
+        self.def_vars.append(def_var)
+
+    def finalize(self) -> "MetaOpStore":
+        """Move appended rows into the int64 columns"""
+        data = np.array(self._rows, dtype=np.int64).reshape(-1, len(attribute_columns))
+
+        for attr, col in attribute_columns.items():
+            self.columns[attr] = np.ascontiguousarray(data[:, col])
+
+        self._ops = [None] * len(self._rows)
+        self._rows = []
+
+        return self
+
+    def __len__(self):
+        return len(self._ops)
+
+    def __getitem__(self, index: int) -> MetaOp:
+        op = self._ops[index]
+
+        if op is None:
+            op = self._build(index)
+            self._ops[index] = op
+
+        return op
+
+    def peek(self, index: int) -> MetaOp:
+        """Return the op at index if it has been built, otherwise None"""
+        return self._ops[index]
+
+    def __iter__(self):
+        for i in range(len(self._ops)):
+            yield self[i]
+
+    def _build(self, index: int) -> MetaOp:
+        args = [
+            int(self.columns["op_index"][index]),
+            int(self.columns["call_index"][index]),
+            int(self.columns["pc"][index]),
+            self.op_name,
+            int(self.columns["depth"][index]),
+            self.used_vars[index],
+        ]
+
+        if self.def_vars[index] is not None:
+            args.append(self.def_vars[index])
+
+        op = self.op_cls(*args)
+        op._op_ws_index = index
+
+        return op
+
+    def rows(self, indices: np.ndarray) -> list[tuple]:
+        """Return attribute tuples, ordered as attribute_columns, for indices"""
+        return list(zip(*(self.columns[attr][indices].tolist() for attr in attribute_columns)))
@@ -5,7 +5,15 @@ from pyanalyze.api.metaconsts import *
 from pyanalyze.api.metavariable import MetaVariable
 import pprint
 from pyanalyze.api.metaopfilter import OpFilter
+from pyanalyze.api.metaopjoin import MetaOpJoin
+from pyanalyze.api.metaopstore import MetaOpStore
+from pyanalyze.api.reachability import ReachabilityIndex
+from pyanalyze.api.querycache import QueryCache
+from pyanalyze.budget import BudgetMeter
+from pyanalyze import metrics
+from collections import defaultdict
 import itertools
+import copy
 
 class MetaOpLink:
     def __init__(self, op: MetaOp):
@@ -20,15 +28,20 @@ class MetaOpLink:
 
     def is_empty(self):
         return len(self.links) == 0
+
+    def detached(self) -> "MetaOpLink":
+        link = MetaOpLink(self.op.detached())
+        link.links = [op.detached() for op in self.links]
+        return link
+
+    def to_dict(self):
+        return {"op": self.op.to_dict(), "links": [op.to_dict() for op in self.links]}
     
 class MetaOpDict:
-    def __init__(self, ops):
-        self._dict = {}
-        self._init_dict(ops)
-
-    def _init_dict(self, ops):
-        for op in ops:
-            self._dict[op] = {}
+    def __init__(self, ops=None):
+        # entries are created on first access, so ops never linked are never
+        # materialized from their MetaOpStore
+        self._dict = defaultdict(dict)
 
     def add_link(self, op, link_op, link):
         if link_op not in self._dict[op]:
@@ -36,6 +49,19 @@ class MetaOpDict:
             
         self._dict[op][link_op].add_link(link)
 
+    def add_links(self, op, link_op, links):
+        if link_op not in self._dict[op]:
+            self._dict[op][link_op] = MetaOpLink(op)
+
+        self._dict[op][link_op].links.extend(links)
+
+    def has_links(self, op, link_op):
+        return (
+            op in self._dict
+            and link_op in self._dict[op]
+            and not self._dict[op][link_op].is_empty()
+        )
+
     def get_link(self, op, link_op):
         return self._dict[op][link_op]
     
@@ -50,6 +76,17 @@ class MetaOpResult:
     def add_row(self, row):
         self.rows.append(row)
 
+    def detached(self) -> "MetaOpResult":
+        result = MetaOpResult(self.op.detached())
+        result.rows = [tuple(item.detached() for item in row) for row in self.rows]
+        return result
+
+    def to_dict(self):
+        return {
+            "op": self.op.to_dict(),
+            "rows": [[item.to_dict() for item in row] for row in self.rows],
+        }
+
     def print(self):
         print(self.op)
 
@@ -76,6 +113,16 @@ class MetaOpResults:
 
     def __len__(self):
         return len(self.results)
+
+    def detached(self) -> "MetaOpResults":
+        """Copy of the results holding only the matched ops and their
+        variable values, e.g. to return them from a worker process"""
+        results = MetaOpResults(self.keys)
+        results.results = [result.detached() for result in self.results]
+        return results
+
+    def to_dict(self):
+        return {"keys": self.keys, "results": [result.to_dict() for result in self.results]}
     
     def print(self):
         for result in self.results:
@@ -88,17 +135,68 @@ class MetaOpResults:
 
 class MetaOpView:
     def __init__(
-        self, op_name, ops: list[MetaOp] = None, addresses: dict[int, str] = None
+        self,
+        op_name,
+        ops: Union[MetaOpStore, list[MetaOp]] = None,
+        addresses: dict[int, str] = None,
+        reachability: ReachabilityIndex = None,
     ):
         self.op_name = op_name
         self.addresses: dict[int, str] = addresses if addresses is not None else {}
+        self.reachability = reachability
+
+        if not isinstance(ops, MetaOpStore):
+            ops = MetaOpStore.from_ops(op_name, ops if ops is not None else [])
 
         self.working_set = np.ones((len(ops),), dtype=bool)
         self.ops = ops
+        self.columns: dict[str, np.ndarray] = ops.columns
 
         self.links : MetaOpDict = MetaOpDict(ops)
         self.current_link = None
 
+        # False while working_set is shared with the view this one was
+        # snapshotted from
+        self._owns_working_set = True
+
+        # the steps this view's state results from, if it can be shared
+        # through query_cache (see QueryCache). Reset by any other change
+        self.plan: tuple = None
+        self.query_cache: QueryCache = None
+
+        # ticked once per op by every query, which raises BudgetExceeded
+        # once the transaction's budget is used up
+        self.meter: BudgetMeter = None
+
+    def snapshot(self) -> "MetaOpView":
+        """Return an independent view of the same ops, e.g. for one query of
+        a loader shared by several heuristics. The store, columns and
+        addresses are shared. The working set is only copied once the
+        snapshot narrows it, and the snapshot starts with no links"""
+        view = copy.copy(self)
+        view.links = MetaOpDict(self.ops)
+        view.current_link = None
+
+        # whichever of the two writes first copies the working set
+        view._owns_working_set = False
+        self._owns_working_set = False
+
+        return view
+
+    def _restrict(self, mask: np.ndarray):
+        # a new array, so a shared working set is never written
+        self.working_set = self.working_set & mask
+        self._owns_working_set = True
+        self.plan = None
+
+    def _discard(self, index: int):
+        if not self._owns_working_set:
+            self.working_set = self.working_set.copy()
+            self._owns_working_set = True
+
+        self.working_set[index] = False
+        self.plan = None
+
     def merge(self, other: "MetaOpView", inclusive: bool = False):
         if self.working_set.shape[0] != other.working_set.shape[0]:
             raise ValueError(
@@ -107,12 +205,15 @@ class MetaOpView:
             )
 
         if inclusive:
-            self.working_set |= other.working_set
+            self.working_set = self.working_set | other.working_set
+            self._owns_working_set = True
+            self.plan = None
         else:
-            self.working_set &= other.working_set
+            self._restrict(other.working_set)
 
         return self
 
+    @metrics.timed("view.filter")
     def filter(self, filters: Union[list[OpFilter], OpFilter] = None):
         if filters is None:
             return self
@@ -123,16 +224,33 @@ class MetaOpView:
         if len(filters) == 0:
             return
 
-        for op in self.ops:
+        opaque_filters = []
+
+        for filter in filters:
+            if MetaOpJoin.is_planned(filter):
+                self._restrict(filter.operator(self.columns[filter.attribute], filter.value))
+            else:
+                opaque_filters.append(filter)
+
+        meter = self.meter
+
+        for i in self._working_indices() if opaque_filters else []:
+            if meter is not None:
+                meter.tick()
+
+            op = self.ops[i]
             if not all(
                 filter.operator(
                     getattr(op, filter.attribute), filter.value
                 )
-                for filter in filters
+                for filter in opaque_filters
             ):
-                self.working_set[op._op_ws_index] = False
+                self._discard(i)
 
         return self
+
+    def _working_indices(self) -> list[int]:
+        return np.flatnonzero(self.working_set).tolist()
     
     def source_address(self, action = OpAction, address : str = None):
         if action is not None:
@@ -151,17 +269,18 @@ class MetaOpView:
             if addr == address:
                 depths_at_addr.append(depth)
 
-        for op in self.ops:
-            if self.working_set[op._op_ws_index]:
-                if op.depth not in depths_at_addr:
-                    self.working_set[op._op_ws_index] = False
+        self._restrict(np.isin(self.columns["depth"], depths_at_addr))
 
         return self
     
     def _filter_link_address(self, operator = None):
-        for op in self.ops:
-            if self.working_set[op._op_ws_index] == False:
-                continue
+        meter = self.meter
+
+        for i in self._working_indices():
+            if meter is not None:
+                meter.tick()
+
+            op = self.ops[i]
 
             link_ops = self._get_current_links(op)
 
@@ -175,7 +294,7 @@ class MetaOpView:
                 self._remove_current_link(op, link_op)
 
             if self._current_link_empty(op):
-                self.working_set[op._op_ws_index] = False
+                self._discard(op._op_ws_index)
 
         return self
     
@@ -190,6 +309,7 @@ class MetaOpView:
             raise ValueError("No current link. Must link with other MetaOpview before calling function")
         
         self.links._dict[op][self.current_link].remove_link(link)
+        self.plan = None
 
     def _current_link_empty(self, op):
         if self.current_link is None:
@@ -197,6 +317,7 @@ class MetaOpView:
         
         return self.links._dict[op][self.current_link].is_empty()
 
+    @metrics.timed("view.link")
     def link(
         self, other: "MetaOpView", filters: Union[list[OpFilter], OpFilter] = None
     ) -> "MetaOpView":
@@ -211,24 +332,79 @@ class MetaOpView:
         if len(filters) == 0:
             return self
 
-        for op in self.ops:
-            for link_op in other.ops:
-                add = True
-                for filter in filters:
-                    if not filter.operator(
-                        getattr(op, filter.attribute), getattr(link_op, filter.attribute)
-                    ):
-                        add = False
-                        break
-                if add:
-                    self.links.add_link(op, other, link_op)
-            if other not in self.links._dict[op] or self.links._dict[op][other].is_empty():
-                self.working_set[op._op_ws_index] = False
+        # the result of a link only depends on this view and on the ops
+        # (not the working set) of other. Only the first link of a view is
+        # shared, as later ones also depend on the links already made
+        plan = None
+        if self.query_cache is not None and self.plan is not None and self.plan[0] == "get_ops":
+            filters_key = QueryCache.filters_key(filters)
+            if filters_key is not None:
+                plan = ("link", self.plan, other.op_name, filters_key)
+
+        cached = self.query_cache.get(plan) if plan is not None else None
+        if cached is not None:
+            metrics.count("view.link_cache_hits")
+            return self._restore_link(other, plan, *cached)
+
+        if self.query_cache is not None:
+            join = self.query_cache.join(other.ops, filters)
+        else:
+            join = MetaOpJoin(other.ops, filters)
+
+        # ops outside of the working set can never be part of a result, so
+        # only the working set is joined, and only ops with a match are built
+        indices = np.flatnonzero(self.working_set)
+        n_links = 0
+        meter = self.meter
+
+        for i, row in zip(indices.tolist(), self.ops.rows(indices)):
+            if meter is not None:
+                meter.tick()
+
+            link_ops = join.match(row, self.ops[i] if join.opaque_filters else None)
+
+            if link_ops:
+                if meter is not None:
+                    meter.add_links(len(link_ops))
+
+                self.links.add_links(self.ops[i], other, link_ops)
+                n_links += len(link_ops)
+            elif not self.links.has_links(self.ops.peek(i), other):
+                self._discard(i)
+
+        metrics.observe("view.links", n_links, metrics.SIZE_BUCKETS)
 
         self.current_link = other
 
+        if plan is not None:
+            self.plan = plan
+            self._owns_working_set = False
+            self.query_cache.put(plan, (self.working_set, self._copy_links(other)))
+
         return self
 
+    def _copy_links(self, other: "MetaOpView") -> dict[MetaOp, list[MetaOp]]:
+        return {
+            op: list(links[other].links)
+            for op, links in self.links._dict.items()
+            if other in links
+        }
+
+    def _restore_link(
+        self, other: "MetaOpView", plan: tuple, working_set: np.ndarray, links: dict
+    ) -> "MetaOpView":
+        self.working_set = working_set
+        self._owns_working_set = False
+
+        for op, link_ops in links.items():
+            self.links.add_links(op, other, link_ops)
+
+        self.current_link = other
+        self.plan = plan
+
+        return self
+
+    @metrics.timed("view.filter_link")
     def filter_link(self, filters: Union[list[OpFilter], OpFilter]):
         if not isinstance(filters, list):
             filters = [filters]
@@ -239,7 +415,12 @@ class MetaOpView:
         if self.current_link is None:
             raise ValueError("No link to filter")
 
+        meter = self.meter
+
         for op in self.ops:
+            if meter is not None:
+                meter.tick()
+
             link_ops = self.links[op].links
 
             for link_op in link_ops:
@@ -252,10 +433,11 @@ class MetaOpView:
                     self._remove_current_link(op, link_op)
 
             if self._current_link_empty(op):
-                self.working_set[op._op_ws_index] = False
+                self._discard(op._op_ws_index)
 
         return self
 
+    @metrics.timed("view.get_results")
     def get_results(self, keys = []):
         # get working set of ops, all links for working set ops across current and previous links
         # how to determine which fields to export? - just return all, let user decide
@@ -292,19 +474,64 @@ class MetaOpView:
 
         return self._current_link_empty(self_op) == False
     
+    def _reaches(self, self_op, self_var, link_ops, link_attr, reverse):
+        removed_links = []
+        for link_op in link_ops:
+            link_var = getattr(link_op, link_attr)
+
+            if reverse:
+                found = self.reachability.reaches(link_var, self_var)
+            else:
+                found = self.reachability.reaches(self_var, link_var)
+
+            if not found:
+                removed_links.append(link_op)
+
+        for link_op in removed_links:
+            self._remove_current_link(self_op, link_op)
+
+        return self._current_link_empty(self_op) == False
+
+    @metrics.timed("view.is_reachable")
+    def is_reachable(self, self_attr, other_attr, reverse = False, invert = False):
+        meter = self.meter
+
+        for i in self._working_indices():
+            if meter is not None:
+                meter.tick()
+
+            op = self.ops[i]
+            link_ops = self._get_current_links(op)
+
+            found = self._reaches(op, getattr(op, self_attr), link_ops, other_attr, reverse)
+
+            if found == invert:
+                self._discard(i)
+
+        return self
+
+    @metrics.timed("view.is_relation")
     def is_relation(self, self_attr, other_attr, relation, invert = False):
-        for op in self.ops:
-            if self.working_set[op._op_ws_index]:
-                nodes = getattr(getattr(op, self_attr), relation)()
+        if self.reachability is not None and relation in ("descendants", "ancestors"):
+            return self.is_reachable(self_attr, other_attr, relation == "ancestors", invert)
+
+        meter = self.meter
 
-                link_ops = self._get_current_links(op)
+        for i in self._working_indices():
+            if meter is not None:
+                meter.tick()
 
-                if invert:
-                    if self._is_in(op, nodes, link_ops, other_attr):
-                        self.working_set[op._op_ws_index] = False
-                else:
-                    if not self._is_in(op, nodes, link_ops, other_attr):
-                        self.working_set[op._op_ws_index] = False
+            op = self.ops[i]
+            nodes = getattr(getattr(op, self_attr), relation)()
+
+            link_ops = self._get_current_links(op)
+
+            if invert:
+                if self._is_in(op, nodes, link_ops, other_attr):
+                    self._discard(op._op_ws_index)
+            else:
+                if not self._is_in(op, nodes, link_ops, other_attr):
+                    self._discard(op._op_ws_index)
 
         return self
 
@@ -321,35 +548,44 @@ class MetaOpView:
         return self.is_relation(self_attr, other_attr, "children", invert)
     
     def is_value_int(self, self_attr, value, operator):
-        for op in self.ops:
-            if self.working_set[op._op_ws_index]:
-                attr = getattr(op, self_attr)
-                if not isinstance(attr, int):
-                    raise ValueError("Value must be an integer")
-                if not operator(attr, value):
-                    self.working_set[op._op_ws_index] = False
+        if self_attr in self.columns:
+            self._restrict(operator(self.columns[self_attr], value))
+            return self
+
+        for i in self._working_indices():
+            op = self.ops[i]
+            attr = getattr(op, self_attr)
+            if not isinstance(attr, int):
+                raise ValueError("Value must be an integer")
+            if not operator(attr, value):
+                self._discard(op._op_ws_index)
     
+    @metrics.timed("view.is_value")
     def is_value(self, self_attr, other_attr, operator):
         if isinstance(other_attr, int):
             return self.is_value_int(self_attr, other_attr, operator)
         
         other_attr = other_attr()
+        meter = self.meter
 
-        for op in self.ops:
-            if self.working_set[op._op_ws_index]:
-                link_ops = self._get_current_links(op)
+        for i in self._working_indices():
+            if meter is not None:
+                meter.tick()
+
+            op = self.ops[i]
+            link_ops = self._get_current_links(op)
                 
-                removed_links = []
+            removed_links = []
 
-                for link_op in link_ops:
-                    if not operator(getattr(op, self_attr), getattr(link_op, other_attr)):
-                        removed_links.append(link_op)
+            for link_op in link_ops:
+                if not operator(getattr(op, self_attr), getattr(link_op, other_attr)):
+                    removed_links.append(link_op)
 
-                for link_op in removed_links:
-                    self._remove_current_link(op, link_op)
+            for link_op in removed_links:
+                self._remove_current_link(op, link_op)
 
-                if self._current_link_empty(op):
-                    self.working_set[op._op_ws_index] = False
+            if self._current_link_empty(op):
+                self._discard(op._op_ws_index)
 
         return self
 
@@ -384,7 +620,7 @@ class MetaOpView:
         return self
 
     def get_working_set(self):
-        return [op for i, op in enumerate(self.ops) if self.working_set[i]]
+        return [self.ops[i] for i in self._working_indices()]
 
 
 class UnaryMetaOpView(MetaOpView):
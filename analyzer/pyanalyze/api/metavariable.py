@@ -1,5 +1,6 @@
 # implemented as adjacency list for increased performance
 # versus maintaing preds / succs for each node
+from collections import deque
 from typing import Any, Union
 
 
@@ -9,6 +10,7 @@ class MetaVariable:
         self.value = value
         self._parents = parents
         self._children = []
+        self._id = None
 
     def __eq__(self, __value: object) -> bool:
         if not isinstance(__value, MetaVariable):
@@ -17,6 +19,10 @@ class MetaVariable:
     
     def to_dict(self):
         return {self.name: self.value}
+
+    def detached(self) -> "MetaVariable":
+        """Copy of this variable without its def-use edges"""
+        return MetaVariable(self.name, self.value, [])
     
     @staticmethod
     def value_eq(var1: "MetaVariable", var2: "MetaVariable") -> bool:
@@ -61,15 +67,10 @@ class MetaVariable:
         if not isinstance(parent_vars, list):
             parent_vars = [parent_vars]
 
-        queue = [self]
-
-        while queue:
-            current = queue.pop(0)
-
+        for current in self._bfs("_parents"):
             if current in parent_vars:
                 return True
 
-            queue.extend(current._parents)
         return False
 
     def is_predecessor(self, child_vars: Union[list["MetaVariable"], "MetaVariable"]) -> bool:
@@ -88,16 +89,10 @@ class MetaVariable:
         if not isinstance(child_vars, list):
             child_vars = [child_vars]
 
-        queue = [self]
-
-        while queue:
-            current = queue.pop(0)
-
+        for current in self._bfs("_children"):
             if current in child_vars:
                 return True
 
-            queue.extend(current._children)
-
     def descendants(self):
         """Return a list of all descendants of the Variable instance
 
@@ -105,15 +100,7 @@ class MetaVariable:
             List[Variable]: A list of all descendants of the Variable instance
         """
 
-        descendants = []
-        queue = [self]
-
-        while queue:
-            current = queue.pop(0)
-            descendants.append(current)
-            queue.extend(current._children)
-
-        return descendants
+        return list(self._bfs("_children"))
 
     def ancestors(self, end: "MetaVariable" = None):
         """Return a list of all ancestors of the Variable instance
@@ -123,19 +110,30 @@ class MetaVariable:
         """
 
         ancestors = []
-        queue = [self]
-
-        while queue:
-            current = queue.pop(0)
 
+        for current in self._bfs("_parents"):
             if end and current == end:
                 break
 
             ancestors.append(current)
-            queue.extend(current._parents)
 
         return ancestors
 
+    def _bfs(self, edges: str):
+        """Yield every Variable reachable from self over the given edge list
+        attribute, self included, each exactly once and in BFS order"""
+        seen = {id(self)}
+        queue = deque([self])
+
+        while queue:
+            current = queue.popleft()
+            yield current
+
+            for var in getattr(current, edges):
+                if id(var) not in seen:
+                    seen.add(id(var))
+                    queue.append(var)
+
     def children(self):
         return self._children
     
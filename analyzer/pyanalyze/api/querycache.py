@@ -0,0 +1,72 @@
+from pyanalyze.api.metaopfilter import OpFilter
+from pyanalyze.api.metaopjoin import MetaOpJoin
+from pyanalyze.api.metaopstore import MetaOpStore
+
+
+class QueryCache:
+    """Intermediate query results shared by every heuristic run on one loader.
+
+    Heuristics build their queries from the same few prefixes, e.g. three of
+    the built-in ones start from get_ops("JUMPI", depth == 1). A view whose
+    state is fully described by the steps that produced it carries those
+    steps as its plan (see MetaOpView.plan). The state after each cacheable
+    step (get_ops with its filters, then the first link) is stored under
+    the plan. Later queries with the same plan start from a copy of that
+    state instead of recomputing it.
+
+    Link indexes (MetaOpJoin) over a store are shared for every link with
+    the same filters, whatever the linking view.
+    """
+
+    def __init__(self):
+        self._results = {}
+        self._joins: dict[tuple, MetaOpJoin] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def filters_key(filters) -> tuple:
+        """Key identifying a filter list regardless of order, or None if a
+        filter value is not hashable"""
+        if filters is None:
+            return ()
+
+        if isinstance(filters, OpFilter):
+            filters = [filters]
+
+        try:
+            return frozenset((f.attribute, f.operator, f.value) for f in filters)
+        except TypeError:
+            return None
+
+    def get(self, plan: tuple):
+        if plan is None:
+            return None
+
+        result = self._results.get(plan)
+
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return result
+
+    def put(self, plan: tuple, result):
+        if plan is not None:
+            self._results[plan] = result
+
+    def join(self, link_ops: MetaOpStore, filters: list[OpFilter]) -> MetaOpJoin:
+        key = QueryCache.filters_key(filters)
+
+        if key is None:
+            return MetaOpJoin(link_ops, filters)
+
+        # stores live as long as the loader, and so as long as this cache
+        key = (id(link_ops), key)
+
+        if key not in self._joins:
+            self._joins[key] = MetaOpJoin(link_ops, filters)
+
+        return self._joins[key]
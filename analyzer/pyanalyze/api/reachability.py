@@ -0,0 +1,130 @@
+from array import array
+from pyanalyze.api.metavariable import MetaVariable
+
+
+class ReachabilityIndex:
+    """Reachability index over the def-use DAG of a single transaction.
+
+    Every variable gets TRAVERSALS interval labels [low, rank], where rank is
+    its post-order number in a DFS of the DAG and low is the smallest rank
+    reachable from it. If u reaches v, the label of v is contained in the
+    label of u for every traversal, so a failed containment rules v out in
+    O(1). A DFS also numbers each subtree contiguously, so a rank inside the
+    DFS subtree of u proves reachability in O(1). Only queries that pass every
+    containment check but are not tree descendants fall back to a DFS, which
+    is pruned with the same labels.
+
+    The labels are built on the first query, and take a fixed 8 * 3 *
+    TRAVERSALS bytes per variable.
+    """
+
+    TRAVERSALS = 2
+
+    def __init__(self, variables: list[MetaVariable]):
+        self.variables = variables
+
+        for i, var in enumerate(variables):
+            var._id = i
+
+        self.low: list[array] = None
+        self.rank: list[array] = None
+        self.tree_low: list[array] = None
+
+    def __len__(self):
+        return len(self.variables)
+
+    def _build(self):
+        n = len(self.variables)
+        roots = [var for var in self.variables if not var._parents]
+
+        self.low, self.rank, self.tree_low = [], [], []
+
+        for t in range(self.TRAVERSALS):
+            # alternate the child order so the traversals produce different
+            # labels and prune different pairs
+            reverse = t % 2 == 1
+            rank = array("q", [0]) * n
+            tree_low = array("q", [0]) * n
+            post_order = self._post_order(roots, reverse, rank, tree_low)
+
+            # children always finish before their parents
+            low = array("q", rank)
+            for var in post_order:
+                for child in var._children:
+                    if low[child._id] < low[var._id]:
+                        low[var._id] = low[child._id]
+
+            self.low.append(low)
+            self.rank.append(rank)
+            self.tree_low.append(tree_low)
+
+    def _post_order(self, roots, reverse, rank, tree_low) -> list[MetaVariable]:
+        visited = bytearray(len(self.variables))
+        post_order = []
+
+        for root in reversed(roots) if reverse else roots:
+            if visited[root._id]:
+                continue
+
+            visited[root._id] = 1
+            stack = [(root, self._children(root, reverse), len(post_order))]
+
+            while stack:
+                var, children, first = stack[-1]
+
+                for child in children:
+                    if not visited[child._id]:
+                        visited[child._id] = 1
+                        stack.append((child, self._children(child, reverse), len(post_order)))
+                        break
+                else:
+                    stack.pop()
+                    rank[var._id] = len(post_order)
+                    tree_low[var._id] = first
+                    post_order.append(var)
+
+        return post_order
+
+    @staticmethod
+    def _children(var, reverse):
+        return iter(reversed(var._children) if reverse else var._children)
+
+    def _may_reach(self, u: int, v: int) -> bool:
+        for low, rank in zip(self.low, self.rank):
+            if low[u] > low[v] or rank[v] > rank[u]:
+                return False
+        return True
+
+    def reaches(self, source: MetaVariable, target: MetaVariable) -> bool:
+        """Return true if target is source or one of its descendants"""
+        if source is None or target is None:
+            return False
+
+        if self.low is None:
+            self._build()
+
+        u, v = source._id, target._id
+
+        if u == v:
+            return True
+
+        if not self._may_reach(u, v):
+            return False
+
+        for tree_low, rank in zip(self.tree_low, self.rank):
+            if tree_low[u] <= rank[v] <= rank[u]:
+                return True
+
+        seen = {u}
+        stack = [source]
+
+        while stack:
+            for child in stack.pop()._children:
+                if child._id == v:
+                    return True
+
+                if child._id not in seen and self._may_reach(child._id, v):
+                    seen.add(child._id)
+                    stack.append(child)
+
+        return False
@@ -0,0 +1,218 @@
+from web3 import exceptions
+from threading import Thread
+from pyanalyze.ipc import AsyncIPCClient, IPCError
+from pyanalyze.geth import GethIPCManager
+from pyanalyze.pipeline import STOP
+from pyanalyze import metrics, pipeline
+import asyncio
+import logging
+import os
+import socket
+import time
+
+logger = logging.getLogger(__name__)
+
+# IPC requests in flight when the manager was not given a concurrency
+DEFAULT_CONCURRENCY = 16
+
+# blocks each shard worker fetches at once
+BLOCK_WINDOW = 32
+
+
+class Backfill:
+    """
+    Feeds the traces of every transaction in blocks [start, end] to the
+    output queue of a GethIPCManager, in place of its polling and tracing
+    threads.
+
+    The range is split into shards of shard_size blocks, registered in the
+    manager's checkpoint. shard_workers coroutines each claim a shard, fetch
+    its blocks BLOCK_WINDOW at a time and trace their transactions, all
+    over one AsyncIPCClient, so up to the manager's concurrency requests are
+    in flight. A shard is completed once every one of its transactions has
+    left the pipeline.
+
+    Progress lives in the checkpoint, so a backfill that is stopped resumes
+    where it left off when run again over the same range: completed shards
+    are skipped, and a claimed shard continues after its last registered
+    block, with the unfinished transactions of that shard traced again.
+    Several processes may share one checkpoint to split the range further;
+    owner names the claims of this one, and defaults to host:pid.
+    """
+
+    def __init__(
+        self,
+        geth: GethIPCManager,
+        start: int,
+        end: int,
+        shard_size: int = 1000,
+        shard_workers: int = 4,
+        owner: str = None,
+        lease: float = 120.0,
+        progress_interval: float = 30.0,
+    ):
+        if geth.checkpoint is None:
+            raise ValueError("Backfill needs a checkpoint to record its shards in")
+        if end < start or shard_size < 1 or shard_workers < 1:
+            raise ValueError(f"Invalid backfill of blocks {start}-{end}")
+
+        self.geth = geth
+        self.checkpoint = geth.checkpoint
+        self.start_block = start
+        self.end_block = end + 1
+        self.shard_size = shard_size
+        self.shard_workers = shard_workers
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease = lease
+        self.progress_interval = progress_interval
+
+        self.concurrency = geth.concurrency or DEFAULT_CONCURRENCY
+        self.thread: Thread = None
+
+        # throughput is measured over the transactions completed by this run
+        self.started: float = None
+        self.completed_before = 0
+
+    def start(self):
+        self.thread = Thread(target=self.run)
+        self.thread.start()
+
+    def join(self):
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        try:
+            asyncio.run(self._run())
+        finally:
+            pipeline.put(self.geth.output_queue, STOP, self.geth.stopping)
+
+    async def _run(self):
+        self.checkpoint.add_shards(
+            [
+                (a, min(a + self.shard_size, self.end_block))
+                for a in range(self.start_block, self.end_block, self.shard_size)
+            ]
+        )
+
+        self.started = time.monotonic()
+        self.completed_before, _ = self.checkpoint.transaction_counts(
+            self.start_block, self.end_block
+        )
+
+        done, total = self.checkpoint.shard_progress(self.start_block, self.end_block)
+        logger.info(
+            f"Backfilling blocks {self.start_block}-{self.end_block - 1}: "
+            f"{total - done} of {total} shards left, {self.shard_workers} shard workers "
+            f"and {self.concurrency} IPC requests in flight"
+        )
+
+        progress = asyncio.create_task(self._report_progress())
+
+        async with AsyncIPCClient(
+            self.geth.ipc_path, self.geth.connections, self.concurrency
+        ) as client:
+            await asyncio.gather(
+                *(
+                    self._shard_worker(client, f"{self.owner}:{i}")
+                    for i in range(self.shard_workers)
+                )
+            )
+
+        progress.cancel()
+
+    async def _shard_worker(self, client: AsyncIPCClient, owner: str):
+        loop = asyncio.get_running_loop()
+
+        while not self.geth.stopping.is_set():
+            shard = await loop.run_in_executor(
+                None, self.checkpoint.claim_shard, owner, self.lease
+            )
+            if shard is None:
+                return
+
+            start, end = shard
+
+            try:
+                await self._backfill_shard(client, owner, start, end)
+            except (ConnectionError, IPCError, exceptions.BlockNotFound) as e:
+                # the shard stays claimed, and is picked up again once the
+                # lease runs out
+                metrics.count("backfill.errors")
+                logger.error(f"Shard {start}-{end - 1} failed: {e}")
+                return
+
+    async def _backfill_shard(self, client: AsyncIPCClient, owner: str, start: int, end: int):
+        stopping = self.geth.stopping
+
+        # transactions left unfinished by an earlier run
+        pending = self.checkpoint.pending_transactions(start, end)
+        if pending:
+            logger.info(f"Resuming shard {start}-{end - 1} with {len(pending)} unfinished transactions")
+            await self.geth.trace_batch(client, pending)
+
+        block = self.checkpoint.next_block(start, end) or start
+
+        while block < end and not stopping.is_set():
+            window = range(block, min(block + BLOCK_WINDOW, end))
+
+            with metrics.timer("backfill.fetch_blocks"):
+                blocks = await asyncio.gather(
+                    *(client.request("eth_getBlockByNumber", [hex(n), False]) for n in window)
+                )
+
+            tx_hashes = {}
+            for n, res in zip(window, blocks):
+                if res is None:
+                    raise exceptions.BlockNotFound(f"Block {n} not found")
+
+                tx_hashes[n] = GethIPCManager.block_tx_hashes(res)
+
+                # registered before tracing, so a restart traces them again
+                # if they never complete
+                self.checkpoint.add_block(n, tx_hashes[n])
+
+                metrics.count("geth.blocks")
+                metrics.observe("geth.block_transactions", len(tx_hashes[n]), metrics.SIZE_BUCKETS)
+
+            await asyncio.gather(
+                *(self.geth.trace_block(client, n, hashes) for n, hashes in tx_hashes.items() if hashes)
+            )
+
+            self.checkpoint.renew_shard(start, owner)
+            block = window.stop
+
+        # the shard is only complete once its last transactions are exported
+        while not stopping.is_set():
+            completed, total = self.checkpoint.transaction_counts(start, end)
+            if completed == total:
+                self.checkpoint.complete_shard(start)
+                metrics.count("backfill.shards")
+                logger.info(f"Completed shard {start}-{end - 1} ({total} transactions)")
+                return
+
+            self.checkpoint.renew_shard(start, owner)
+            await asyncio.sleep(1)
+
+    async def _report_progress(self):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            logger.info(self.progress())
+
+    def throughput(self) -> float:
+        """Transactions completed per second by this run"""
+        if self.started is None:
+            return 0.0
+
+        completed, _ = self.checkpoint.transaction_counts(self.start_block, self.end_block)
+        elapsed = time.monotonic() - self.started
+        return (completed - self.completed_before) / elapsed if elapsed > 0 else 0.0
+
+    def progress(self) -> str:
+        shards_done, shards = self.checkpoint.shard_progress(self.start_block, self.end_block)
+        completed, total = self.checkpoint.transaction_counts(self.start_block, self.end_block)
+
+        return (
+            f"Backfill: {shards_done}/{shards} shards, {completed}/{total} transactions "
+            f"in fetched blocks, {self.throughput():.1f} tx/s"
+        )
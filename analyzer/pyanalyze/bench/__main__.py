@@ -0,0 +1,312 @@
+import argparse
+import asyncio
+from glob import glob
+import json
+import os
+import platform
+from queue import Queue
+import sys
+import tempfile
+from threading import Thread
+import time
+
+import numpy as np
+
+from pyanalyze.bench.stages import run_workload
+from pyanalyze.bench.synthetic import WORKLOADS, synthetic_trace
+from pyanalyze.heuristics.load_heuristics import get_heuristics
+from pyanalyze.geth import GethIPCManager
+from pyanalyze.ipc import AsyncIPCClient
+from pyanalyze.pipeline import STOP
+from pyanalyze.replay import ReplayIPCServer
+from logging import getLogger, basicConfig, INFO
+
+basicConfig(level=INFO)
+
+logger = getLogger(__name__)
+
+# version of the results format
+RESULTS_VERSION = 1
+
+
+def run(args) -> dict:
+    heuristic_classes = get_heuristics(args.heuristics)
+
+    workloads: dict[str, list[str]] = {}
+
+    names = args.workloads.split(",") if args.workloads else list(WORKLOADS)
+    if args.corpus and not args.workloads:
+        names = []
+
+    for name in names:
+        name = name.strip()
+        if name not in WORKLOADS:
+            raise ValueError(f"Workload {name} not found")
+        workloads[name] = [json.dumps(synthetic_trace(name, args.seed))]
+
+    if args.corpus:
+        paths = sorted(glob(os.path.join(args.corpus, "*.json")))
+        if not paths:
+            raise ValueError(f"No traces found in {args.corpus}")
+
+        texts = []
+        for path in paths:
+            with open(path) as f:
+                texts.append(f.read())
+        workloads["corpus"] = texts
+
+    results = {
+        "version": RESULTS_VERSION,
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+        },
+        "repeat": args.repeat,
+        "seed": args.seed,
+        "heuristics": [cls().name for cls in heuristic_classes],
+        "workloads": {},
+    }
+
+    for name, texts in workloads.items():
+        logger.info(f"Running workload {name} ({len(texts)} traces)")
+        results["workloads"][name] = run_workload(
+            texts, heuristic_classes, args.repeat, not args.no_memory
+        )
+
+    return results
+
+
+def ipc(args) -> dict:
+    """Trace synthetic blocks through GethIPCManager from a ReplayIPCServer,
+    once per tracing mode, measuring transactions traced per second and the
+    IPC requests it took"""
+    trace = synthetic_trace(args.workload, args.seed)
+    trace.pop("tx_hash")
+
+    blocks = {
+        number: [f"0x{number:032x}{i:032x}" for i in range(args.block_size)]
+        for number in range(args.blocks)
+    }
+    # every transaction replays the same trace
+    traces = {tx_hash: trace for tx_hashes in blocks.values() for tx_hash in tx_hashes}
+
+    ipc_path = os.path.join(tempfile.mkdtemp(), "replay.ipc")
+    server = ReplayIPCServer(ipc_path, traces, args.latency, blocks)
+
+    loop = asyncio.new_event_loop()
+    Thread(target=loop.run_forever, daemon=True).start()
+    asyncio.run_coroutine_threadsafe(server.start(), loop).result()
+
+    results = {
+        "version": RESULTS_VERSION,
+        "workload": args.workload,
+        "ops": len(trace["Ops"]),
+        "blocks": args.blocks,
+        "block_size": args.block_size,
+        "latency": args.latency,
+        "concurrency": args.concurrency,
+        "batch_size": args.batch_size,
+        "modes": {},
+    }
+
+    for mode in args.modes.split(","):
+        if mode not in ("tx", "block"):
+            raise ValueError(f"Unknown mode {mode}")
+
+        output = Queue()
+        geth = GethIPCManager(
+            ipc_path,
+            output,
+            None,
+            concurrency=args.concurrency or None,
+            batch_size=args.batch_size,
+            connections=args.connections,
+            queue_size=len(traces) + 1,
+            block_traces=mode == "block",
+        )
+
+        for number, tx_hashes in blocks.items():
+            geth.queue_block({"number": number, "transactions": tx_hashes})
+        geth.tx_queue.put(STOP)
+
+        requests = server.requests
+        start = time.perf_counter()
+
+        thread = Thread(target=geth.run_async if args.concurrency else geth.run)
+        thread.start()
+
+        traced = 0
+        while output.get() is not STOP:
+            traced += 1
+
+        seconds = time.perf_counter() - start
+        thread.join()
+        geth.client.close()
+
+        logger.info(f"{mode}: {traced} transactions in {seconds:.2f}s")
+        results["modes"][mode] = {
+            "transactions": traced,
+            "requests": server.requests - requests,
+            "seconds": seconds,
+            "tx_per_second": traced / seconds,
+        }
+
+    asyncio.run_coroutine_threadsafe(server.stop(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+
+    return results
+
+
+async def record(args):
+    os.makedirs(args.corpus, exist_ok=True)
+
+    # kept as JSON, as the node returned it
+    async with AsyncIPCClient(args.ipc, decode_traces=False) as client:
+        traces = await client.trace_transactions(args.tx)
+
+    for tx_hash, trace in zip(args.tx, traces):
+        with open(os.path.join(args.corpus, f"{tx_hash}.json"), "w") as f:
+            json.dump(trace, f)
+
+        logger.info(f"Recorded {tx_hash} ({len(trace['Ops'] or [])} ops)")
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    print(
+        f"{'workload':<10} {'stage':<32} {'base s':>10} {'new s':>10} {'ratio':>7} "
+        f"{'base MB':>9} {'new MB':>9} {'base B/op':>10} {'new B/op':>10}"
+    )
+
+    for workload, new_entry in new["workloads"].items():
+        base_entry = base["workloads"].get(workload)
+        if base_entry is None:
+            continue
+
+        for stage, new_stage in new_entry["stages"].items():
+            base_stage = base_entry["stages"].get(stage)
+            if base_stage is None or "min" not in base_stage or "min" not in new_stage:
+                continue
+
+            ratio = new_stage["min"] / base_stage["min"] if base_stage["min"] else float("inf")
+            memory = [
+                f"{s['peak_bytes'] / 2**20:>9.2f}" if "peak_bytes" in s else f"{'-':>9}"
+                for s in (base_stage, new_stage)
+            ]
+            # what the stage holds on to per op of the workload, e.g. the
+            # size of an op after destackify
+            per_op = [
+                f"{s['retained_bytes'] / entry['ops']:>10.1f}"
+                if "retained_bytes" in s and entry["ops"]
+                else f"{'-':>10}"
+                for s, entry in ((base_stage, base_entry), (new_stage, new_entry))
+            ]
+            flag = " !" if ratio > 1 + args.threshold else ""
+
+            print(
+                f"{workload:<10} {stage:<32} {base_stage['min']:>10.4f} "
+                f"{new_stage['min']:>10.4f} {ratio:>7.2f} {memory[0]} {memory[1]} "
+                f"{per_op[0]} {per_op[1]}{flag}"
+            )
+
+
+parser = argparse.ArgumentParser(description="Vandal Python Analyzer benchmarks")
+subparsers = parser.add_subparsers(dest="action", required=True)
+
+run_parser = subparsers.add_parser(
+    "run", help="Time and memory profile every analysis stage, writing JSON results"
+)
+run_parser.add_argument(
+    "--workloads",
+    help="Synthetic workloads to run, separated by commas. "
+    f"Defaults to all of {', '.join(WORKLOADS)} unless --corpus is given",
+)
+run_parser.add_argument("--corpus", help="Directory of recorded <tx hash>.json traces")
+run_parser.add_argument(
+    "--heuristics", help="Heuristics to run. Separate multiple heuristics with a comma"
+)
+run_parser.add_argument("--repeat", help="Timed runs per workload", type=int, default=5)
+run_parser.add_argument("--seed", help="Seed for the synthetic traces", type=int, default=0)
+run_parser.add_argument("--no-memory", help="Skip the memory profiling run", action="store_true")
+run_parser.add_argument("--output", help="File to write results to. Defaults to stdout")
+
+ipc_parser = subparsers.add_parser(
+    "ipc",
+    help="Measure tracing throughput against a local replay of synthetic blocks, "
+    "per transaction and per block",
+)
+ipc_parser.add_argument(
+    "--workload", help="Synthetic workload every transaction replays", default="small"
+)
+ipc_parser.add_argument("--blocks", help="Blocks to trace", type=int, default=20)
+ipc_parser.add_argument("--block-size", help="Transactions per block", type=int, default=50)
+ipc_parser.add_argument(
+    "--latency", help="Seconds the replay waits before each response", type=float, default=0.005
+)
+ipc_parser.add_argument(
+    "--concurrency",
+    help="IPC requests in flight. 0 traces synchronously, one request at a time",
+    type=int,
+    default=16,
+)
+ipc_parser.add_argument(
+    "--batch-size", help="Transactions per JSON-RPC batch when tracing per transaction", type=int, default=1
+)
+ipc_parser.add_argument("--connections", help="IPC sockets to spread requests over", type=int, default=1)
+ipc_parser.add_argument(
+    "--modes", help="Tracing modes to run, separated by commas: tx, block", default="tx,block"
+)
+ipc_parser.add_argument("--seed", help="Seed for the synthetic trace", type=int, default=0)
+ipc_parser.add_argument("--output", help="File to write results to. Defaults to stdout")
+
+record_parser = subparsers.add_parser(
+    "record", help="Record debug_traceVandalTransaction outputs into a corpus"
+)
+record_parser.add_argument("corpus", help="Corpus directory")
+record_parser.add_argument("tx", help="Transaction hashes to record", nargs="+")
+record_parser.add_argument("--ipc", help="Path to Geth IPC socket", default="/tmp/geth.ipc")
+
+compare_parser = subparsers.add_parser(
+    "compare", help="Compare two results files stage by stage"
+)
+compare_parser.add_argument("base", help="Baseline results")
+compare_parser.add_argument("new", help="New results")
+compare_parser.add_argument(
+    "--threshold",
+    help="Flag stages slower than the baseline by more than this fraction",
+    type=float,
+    default=0.1,
+)
+
+args = parser.parse_args()
+
+if args.action == "run":
+    results = run(args)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+if args.action == "ipc":
+    results = ipc(args)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+if args.action == "record":
+    asyncio.run(record(args))
+
+if args.action == "compare":
+    compare(args)
@@ -0,0 +1,195 @@
+from collections import defaultdict
+from contextlib import contextmanager
+import gc
+import json
+import pickle
+import statistics
+import time
+import tracemalloc
+
+import pyanalyze.vandal.evm_cfg as evm_cfg
+import pyanalyze.vandal.memtypes as mem
+from pyanalyze.api.metaoploader import MetaOpLoader
+from pyanalyze.heuristics.heuristics import BaseHeuristic
+from pyanalyze.tracesummary import TraceSummary
+from pyanalyze.vandal.tac_cfg import Destackifier
+from pyanalyze.vandal.tracefile import BinaryTrace
+
+
+def _parse(text: str) -> dict:
+    trace = json.loads(text)
+
+    # recordings may hold the raw JSON-RPC response
+    if "result" in trace and "Ops" not in trace:
+        trace = trace["result"]
+
+    return trace
+
+
+class StageTimer:
+    """Wall time and, if trace_memory is set, peak and retained allocation of
+    each stage, summed over every trace run through the pipeline.
+
+    Memory is measured with tracemalloc, relative to what was allocated when
+    the stage started. The retained bytes are what the stage still holds
+    when it ends, e.g. the ops it built, which the peak can hide when the
+    stage also frees its input. Tracing slows everything down, so memory
+    and time are measured in separate runs.
+    """
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.seconds: dict[str, float] = defaultdict(float)
+        self.peak_bytes: dict[str, int] = defaultdict(int)
+        self.retained_bytes: dict[str, int] = defaultdict(int)
+        self.errors: dict[str, str] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            allocated, _ = tracemalloc.get_traced_memory()
+
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.errors.setdefault(name, repr(e))
+            raise
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+
+            if self.trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                self.peak_bytes[name] = max(self.peak_bytes[name], peak - allocated)
+                self.retained_bytes[name] += current - allocated
+
+
+def run_pipeline(text: str, heuristics: list[BaseHeuristic], timer: StageTimer):
+    """
+    Analyze one trace, timing every stage separately.
+
+    The TAC stages (decode, blocks_from_ops, destackify, apply_operations)
+    are the steps of TACGraph.from_geth. The heuristics do not need them,
+    since the loader reads the trace directly, but other consumers of the
+    TACGraph do. The remaining stages are what worker.analyze_tx does,
+    except that every heuristic runs whatever the prefilter decides.
+
+    Args:
+      text: JSON trace, or a JSON-RPC response holding one
+      heuristics: heuristic instances, all run on one loader
+      timer: receives the timings
+    """
+    with timer.stage("parse"):
+        trace = _parse(text)
+
+    with timer.stage("decode"):
+        trace = BinaryTrace.from_dict(trace)
+        ops = evm_cfg.ops_from_trace(trace)
+
+    with timer.stage("blocks_from_ops"):
+        blocks = evm_cfg.blocks_from_ops(ops, trace.pc, trace.op)
+
+    with timer.stage("destackify"):
+        destack = Destackifier()
+        stacks = []
+        tac_blocks = [destack.convert_block(block, stacks) for block in blocks]
+
+    with timer.stage("apply_operations"):
+        stack, memory = defaultdict(dict), mem.TraceMemory()
+        for block in tac_blocks:
+            block.apply_operations(stack, memory)
+
+    with timer.stage("prefilter"):
+        summary = TraceSummary.from_trace(trace)
+        for heuristic in heuristics:
+            heuristic.may_match(summary)
+
+    loader_ops = [op for heuristic in heuristics for op in heuristic.REQUIRED_OPS]
+
+    with timer.stage("loader"):
+        api = MetaOpLoader.from_trace(trace, loader_ops)
+
+    for heuristic in heuristics:
+        heuristic.results = None
+
+        # a failing heuristic is reported, the others still run
+        try:
+            with timer.stage(f"heuristic:{heuristic.name}"):
+                heuristic.analyze(api)
+        except Exception:
+            heuristic.results = None
+
+    with timer.stage("export"):
+        # what a worker sends back to the manager
+        pickle.dumps(
+            [
+                (i, heuristic.results.detached())
+                for i, heuristic in enumerate(heuristics)
+                if heuristic.is_vulnerable()
+            ]
+        )
+
+
+def run_workload(
+    texts: list[str], heuristic_classes: list[type], repeat: int = 5, memory: bool = True
+) -> dict:
+    """
+    Run every trace of a workload through the pipeline repeat times, plus
+    once more under tracemalloc if memory is set.
+
+    Returns the workload entry of the benchmark results: per stage the
+    minimum and median seconds over the repeats, summed over the traces,
+    the largest peak allocation of any trace and the allocation retained,
+    summed over the traces.
+    """
+    runs: list[StageTimer] = []
+
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            timer = StageTimer()
+            heuristics = [cls() for cls in heuristic_classes]
+
+            for text in texts:
+                try:
+                    run_pipeline(text, heuristics, timer)
+                except Exception:
+                    pass
+
+            runs.append(timer)
+            gc.collect()
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    stages = {}
+    for name in runs[0].seconds:
+        seconds = [run.seconds[name] for run in runs]
+        stages[name] = {"min": min(seconds), "median": statistics.median(seconds)}
+
+    if memory:
+        timer = StageTimer(trace_memory=True)
+        heuristics = [cls() for cls in heuristic_classes]
+
+        tracemalloc.start()
+        try:
+            for text in texts:
+                try:
+                    run_pipeline(text, heuristics, timer)
+                except Exception:
+                    pass
+        finally:
+            tracemalloc.stop()
+
+        for name, peak in timer.peak_bytes.items():
+            stages.setdefault(name, {})["peak_bytes"] = peak
+            stages[name]["retained_bytes"] = timer.retained_bytes[name]
+
+    return {
+        "traces": len(texts),
+        "ops": sum(len(_parse(text)["Ops"] or []) for text in texts),
+        "stages": stages,
+        "errors": runs[0].errors,
+    }
@@ -0,0 +1,240 @@
+import random
+
+# opcodes the generator emits
+OPCODES = {
+    "ADD": 0x01,
+    "ISZERO": 0x15,
+    "TIMESTAMP": 0x42,
+    "POP": 0x50,
+    "MLOAD": 0x51,
+    "MSTORE": 0x52,
+    "SLOAD": 0x54,
+    "SSTORE": 0x55,
+    "JUMPI": 0x57,
+    "GAS": 0x5A,
+    "JUMPDEST": 0x5B,
+    "PUSH1": 0x60,
+    "PUSH2": 0x61,
+    "DUP1": 0x80,
+    "SWAP1": 0x90,
+    "CALL": 0xF1,
+    "RETURN": 0xF3,
+    "REVERT": 0xFD,
+}
+
+# symbolic stacks stop growing at 1024 entries, keep well below
+MAX_STACK = 256
+
+
+class TraceGenerator:
+    """
+    Generates debug_traceVandalTransaction output for a made-up transaction.
+
+    Every frame runs a random mix of storage reads and writes, timestamp
+    checks, conditional jumps, arithmetic, memory round trips and calls. The
+    EVM stack is tracked, so every op finds its arguments on the stack and
+    the values in the trace are consistent with them (sums are sums, a
+    reverted call returns 0), and calls nest into new frames at pc 0.
+
+    Args:
+      n_ops: number of ops to generate. The outermost frame keeps running
+        until the trace is this long.
+      seed: seed for the random choices.
+      max_depth: deepest call frame.
+      call_rate: chance that an op in a frame is a call, i.e. the fan-out.
+      chain_rate: chance that an op extends the def-use chain on top of the
+        stack with an ADD.
+      frame_ops: (min, max) ops run by a called frame.
+    """
+
+    def __init__(
+        self,
+        n_ops: int,
+        seed: int = 0,
+        max_depth: int = 4,
+        call_rate: float = 0.14,
+        chain_rate: float = 0.08,
+        frame_ops: tuple[int, int] = (10, 60),
+    ):
+        self.n_ops = n_ops
+        self.random = random.Random(seed)
+        self.max_depth = max_depth
+        self.call_rate = call_rate
+        self.chain_rate = chain_rate
+        self.frame_ops = frame_ops
+
+        self.ops: list[dict] = []
+        self.storage: dict[tuple[int, int], int] = {}
+
+    def generate(self, to: str = "0x00000000000000000000000000000000000000aa") -> dict:
+        self.ops = []
+        self.storage = {}
+        self.frame(1, 0)
+
+        return {"To": to, "Ops": self.ops}
+
+    def emit(self, pc: int, op: str, ret: int = None, extra: int = None):
+        op = {
+            "pc": pc,
+            "op": OPCODES[op],
+            "opIndex": len(self.ops),
+            "ret": "" if ret is None else hex(ret),
+        }
+        if extra is not None:
+            op["extra"] = hex(extra)
+
+        self.ops.append(op)
+
+    def full(self) -> bool:
+        return len(self.ops) >= self.n_ops
+
+    def frame(self, depth: int, address: int) -> int:
+        """Emit one call frame, returning its success flag"""
+        r = self.random
+        pc = 0
+        stack = []
+
+        # the outermost frame runs until the trace is full
+        budget = r.randint(*self.frame_ops) if depth > 1 else -1
+
+        self.emit(pc, "JUMPDEST")
+        pc += 1
+
+        while budget != 0 and not self.full():
+            budget -= 1
+            choice = r.random()
+
+            if len(stack) > MAX_STACK:
+                self.emit(pc, "POP")
+                pc += 1
+                stack.pop()
+            elif choice < self.call_rate:
+                pc = self.call(pc, depth, stack)
+            elif choice < self.call_rate + self.chain_rate and stack:
+                # top = top + constant, keeping the chain on the stack
+                value = r.randint(0, 9)
+                self.emit(pc, "PUSH1", value)
+                pc += 2
+                result = (stack.pop() + value) % 2**256
+                self.emit(pc, "ADD", result)
+                pc += 1
+                stack.append(result)
+            else:
+                pc = self.step(pc, address, stack, r.random())
+
+        if depth > 1 and r.random() < 0.15:
+            self.emit(pc, "PUSH1", 0)
+            self.emit(pc + 2, "PUSH1", 0)
+            self.emit(pc + 4, "REVERT")
+            return 0
+
+        self.emit(pc, "PUSH1", 0)
+        self.emit(pc + 2, "PUSH1", 0)
+        self.emit(pc + 4, "RETURN")
+        return 1
+
+    def call(self, pc: int, depth: int, stack: list[int]) -> int:
+        r = self.random
+        callee = r.randint(1, 4)
+
+        for value in (0, 0, 0, 0, r.choice([0, 0, 5]), callee):
+            self.emit(pc, "PUSH1", value)
+            pc += 2
+        self.emit(pc, "GAS", 10000)
+        pc += 1
+
+        success = 1
+        if depth < self.max_depth and r.random() < 0.8:
+            success = self.frame(depth + 1, callee)
+
+        self.emit(pc, "CALL", success, 0)
+        stack.append(success)
+
+        return pc + 1
+
+    def step(self, pc: int, address: int, stack: list[int], choice: float) -> int:
+        r = self.random
+
+        if choice < 0.25:
+            key = r.randint(0, 5)
+            value = self.storage.get((address, key), r.randint(0, 3))
+            self.emit(pc, "PUSH1", key)
+            self.emit(pc + 2, "SLOAD", value)
+            stack.append(value)
+            return pc + 3
+
+        if choice < 0.35:
+            self.emit(pc, "TIMESTAMP", 1000)
+            stack.append(1000)
+            return pc + 1
+
+        if choice < 0.5 and stack:
+            condition = stack.pop()
+            dest = pc + 40
+            self.emit(pc, "PUSH2", dest)
+            self.emit(pc + 3, "JUMPI")
+            pc = dest if condition else pc + 4
+            self.emit(pc, "JUMPDEST")
+            return pc + 1
+
+        if choice < 0.62:
+            value, key = r.randint(0, 3), r.randint(0, 5)
+            self.emit(pc, "PUSH1", value)
+            self.emit(pc + 2, "PUSH1", key)
+            self.emit(pc + 4, "SSTORE")
+            self.storage[(address, key)] = value
+            return pc + 5
+
+        if choice < 0.72 and len(stack) >= 2:
+            result = (stack.pop() + stack.pop()) % 2**256
+            self.emit(pc, "ADD", result)
+            stack.append(result)
+            return pc + 1
+
+        if choice < 0.77 and stack:
+            result = int(stack.pop() == 0)
+            self.emit(pc, "ISZERO", result)
+            stack.append(result)
+            return pc + 1
+
+        if choice < 0.82 and stack:
+            self.emit(pc, "DUP1")
+            stack.append(stack[-1])
+            return pc + 1
+
+        if choice < 0.87 and len(stack) >= 2:
+            self.emit(pc, "SWAP1")
+            stack[-1], stack[-2] = stack[-2], stack[-1]
+            return pc + 1
+
+        if choice < 0.9 and stack:
+            self.emit(pc, "POP")
+            stack.pop()
+            return pc + 1
+
+        offset, value = r.choice([0, 32, 64]), r.randint(0, 9)
+        self.emit(pc, "PUSH1", value)
+        self.emit(pc + 2, "PUSH1", offset)
+        self.emit(pc + 4, "MSTORE")
+        self.emit(pc + 5, "PUSH1", offset)
+        self.emit(pc + 7, "MLOAD", value)
+        stack.append(value)
+        return pc + 8
+
+
+# named workloads for the benchmark suite: TraceGenerator arguments
+WORKLOADS: dict[str, dict] = {
+    "small": {"n_ops": 2_000},
+    "large": {"n_ops": 50_000},
+    "deep": {"n_ops": 20_000, "max_depth": 128, "call_rate": 0.3, "frame_ops": (20, 80)},
+    "wide": {"n_ops": 20_000, "max_depth": 2, "call_rate": 0.5, "frame_ops": (3, 10)},
+    "chains": {"n_ops": 20_000, "chain_rate": 0.6},
+}
+
+
+def synthetic_trace(workload: str, seed: int = 0) -> dict:
+    """Generate the trace of a named workload"""
+    trace = TraceGenerator(seed=seed, **WORKLOADS[workload]).generate()
+    trace["tx_hash"] = "0x" + f"{workload}-{seed}".encode().hex().rjust(64, "0")
+
+    return trace
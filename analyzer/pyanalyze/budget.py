@@ -0,0 +1,92 @@
+import time
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, resource: str, limit):
+        super().__init__(f"{resource} budget of {limit} exceeded")
+        self.resource = resource
+        self.limit = limit
+
+
+class Budget:
+    """
+    Limits on the analysis of one transaction. None means unlimited.
+
+    Args:
+      max_seconds: wall time, from loading the trace to the end of the last
+        heuristic
+      max_ops: ops in the trace
+      max_variables: variables materialized by the loader
+      max_links: links made by all heuristics together
+    """
+
+    def __init__(
+        self,
+        max_seconds: float = None,
+        max_ops: int = None,
+        max_variables: int = None,
+        max_links: int = None,
+    ):
+        self.max_seconds = max_seconds
+        self.max_ops = max_ops
+        self.max_variables = max_variables
+        self.max_links = max_links
+
+    def is_limited(self) -> bool:
+        return any(
+            limit is not None
+            for limit in (self.max_seconds, self.max_ops, self.max_variables, self.max_links)
+        )
+
+    def meter(self) -> "BudgetMeter":
+        return BudgetMeter(self)
+
+
+class BudgetMeter:
+    """What one transaction has used of a Budget.
+
+    The loader and MetaOpViews check it as they go and raise BudgetExceeded
+    once any limit is reached. Loops call tick() once per op, which only
+    reads the clock every TICKS calls. Once the time or link limit is
+    exceeded, every later check raises as well, so the remaining work of
+    the transaction is cut short.
+    """
+
+    TICKS = 256
+
+    def __init__(self, budget: Budget):
+        self.budget = budget
+        self.deadline = (
+            time.monotonic() + budget.max_seconds if budget.max_seconds is not None else None
+        )
+        self.links = 0
+        self.exceeded: BudgetExceeded = None
+        self._ticks = BudgetMeter.TICKS
+
+    def _exceed(self, resource: str, limit):
+        self.exceeded = BudgetExceeded(resource, limit)
+        raise self.exceeded
+
+    def check(self):
+        if self.exceeded is not None:
+            raise self.exceeded
+
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self._exceed("time", self.budget.max_seconds)
+
+    def tick(self):
+        self._ticks -= 1
+        if self._ticks <= 0:
+            self._ticks = BudgetMeter.TICKS
+            self.check()
+
+    def check_variables(self, n: int):
+        # only fails this load, a smaller one can still fit
+        if self.budget.max_variables is not None and n > self.budget.max_variables:
+            raise BudgetExceeded("variables", self.budget.max_variables)
+
+    def add_links(self, n: int):
+        self.links += n
+
+        if self.budget.max_links is not None and self.links > self.budget.max_links:
+            self._exceed("links", self.budget.max_links)
@@ -0,0 +1,202 @@
+from threading import Lock
+import os
+import sqlite3
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (
+    number INTEGER PRIMARY KEY,
+    tx_count INTEGER NOT NULL,
+    remaining INTEGER NOT NULL,
+    completed_at REAL
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    tx_hash TEXT PRIMARY KEY,
+    block INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    status TEXT,
+    completed_at REAL
+);
+CREATE INDEX IF NOT EXISTS pending_transactions
+    ON transactions (block, position) WHERE status IS NULL;
+CREATE TABLE IF NOT EXISTS shards (
+    start INTEGER PRIMARY KEY,
+    end INTEGER NOT NULL,
+    owner TEXT,
+    claimed_at REAL,
+    completed_at REAL
+);
+"""
+
+
+class CheckpointStore:
+    """
+    Progress of the pipeline, kept in a SQLite database so it survives
+    restarts.
+
+    Every block is registered with its transactions when it is fetched, and
+    every transaction is completed once it leaves the pipeline (exported,
+    or dropped by tracing or analysis). A block is complete once all of its
+    transactions are. After a restart the transactions of registered blocks
+    that never completed are analyzed again, and blocks are fetched from
+    the one after the last registered block.
+
+    Several processes can share one store, e.g. backfill workers, which
+    claim disjoint shards of a block range (see claim_shard). Writes are
+    committed immediately, with the database in WAL mode so commits do not
+    wait on a disk flush.
+    """
+
+    def __init__(self, path: str, timeout: float = 30.0):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.path = path
+        self._lock = Lock()
+
+        # used from the polling, tracing, analysis and export threads
+        self._db = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def add_block(self, number: int, tx_hashes: list[str]):
+        """Register a fetched block and its transactions. Registering a block
+        again keeps the progress already made on it"""
+        with self._lock, self._db:
+            if self._db.execute("SELECT 1 FROM blocks WHERE number = ?", (number,)).fetchone():
+                return
+
+            self._db.execute(
+                "INSERT INTO blocks VALUES (?, ?, ?, ?)",
+                (number, len(tx_hashes), len(tx_hashes), time.time() if not tx_hashes else None),
+            )
+            self._db.executemany(
+                "INSERT OR IGNORE INTO transactions VALUES (?, ?, ?, NULL, NULL)",
+                [(tx_hash, number, i) for i, tx_hash in enumerate(tx_hashes)],
+            )
+
+    def complete_tx(self, tx_hash: str, status: str = "done"):
+        """Mark a transaction as finished, with status saying how (e.g. done,
+        failed or dropped). Completing it again has no effect"""
+        now = time.time()
+
+        with self._lock, self._db:
+            row = self._db.execute(
+                "UPDATE transactions SET status = ?, completed_at = ? "
+                "WHERE tx_hash = ? AND status IS NULL RETURNING block",
+                (status, now, tx_hash),
+            ).fetchone()
+
+            if row is None:
+                return
+
+            self._db.execute(
+                "UPDATE blocks SET remaining = remaining - 1, "
+                "completed_at = CASE WHEN remaining = 1 THEN ? END WHERE number = ?",
+                (now, row[0]),
+            )
+
+    def is_block_complete(self, number: int) -> bool:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT remaining FROM blocks WHERE number = ?", (number,)
+            ).fetchone()
+
+        return row is not None and row[0] == 0
+
+    def next_block(self, start: int = None, end: int = None) -> int:
+        """The block after the last registered one in [start, end), or None
+        if none is registered"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT MAX(number) FROM blocks WHERE number >= ? AND number < ?",
+                (start if start is not None else -1, end if end is not None else 2**63 - 1),
+            ).fetchone()
+
+        return row[0] + 1 if row[0] is not None else None
+
+    def pending_transactions(self, start: int = None, end: int = None) -> list[str]:
+        """Transactions of registered blocks in [start, end) that never
+        completed, in block order"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT tx_hash FROM transactions "
+                "WHERE status IS NULL AND block >= ? AND block < ? ORDER BY block, position",
+                (start if start is not None else -1, end if end is not None else 2**63 - 1),
+            ).fetchall()
+
+        return [tx_hash for tx_hash, in rows]
+
+    def transaction_counts(self, start: int = None, end: int = None) -> tuple[int, int]:
+        """Number of completed transactions, and of transactions, in the
+        registered blocks in [start, end)"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(status), COUNT(*) FROM transactions WHERE block >= ? AND block < ?",
+                (start if start is not None else -1, end if end is not None else 2**63 - 1),
+            ).fetchone()
+
+    def add_shards(self, ranges: list[tuple[int, int]]):
+        """Register block ranges [start, end) to be claimed. Ranges already
+        registered keep their progress"""
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO shards VALUES (?, ?, NULL, NULL, NULL)", ranges
+            )
+
+    def claim_shard(self, owner: str, lease: float = 600.0) -> tuple[int, int]:
+        """Claim the lowest shard that is neither complete nor claimed by
+        another owner within the last lease seconds. Returns its block range,
+        or None if there is none left.
+
+        Owners renew their claims with renew_shard while working on them, so
+        the shards of a crashed owner are claimed again once its lease runs
+        out. An owner gets back its own unfinished shard straight away, so
+        owners with stable names resume their shards after a restart"""
+        now = time.time()
+
+        with self._lock, self._db:
+            # write lock first, so two processes never claim the same shard
+            self._db.execute("BEGIN IMMEDIATE")
+            row = self._db.execute(
+                "SELECT start, end FROM shards WHERE completed_at IS NULL "
+                "AND (owner IS NULL OR owner = ? OR claimed_at < ?) ORDER BY start LIMIT 1",
+                (owner, now - lease),
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            self._db.execute(
+                "UPDATE shards SET owner = ?, claimed_at = ? WHERE start = ?",
+                (owner, now, row[0]),
+            )
+
+        return row
+
+    def renew_shard(self, start: int, owner: str):
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE shards SET claimed_at = ? WHERE start = ? AND owner = ?",
+                (time.time(), start, owner),
+            )
+
+    def complete_shard(self, start: int):
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE shards SET completed_at = ? WHERE start = ?", (time.time(), start)
+            )
+
+    def shard_progress(self, start: int = None, end: int = None) -> tuple[int, int]:
+        """Number of completed shards, and of shards, starting in [start, end)"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(completed_at), COUNT(*) FROM shards WHERE start >= ? AND start < ?",
+                (start if start is not None else -1, end if end is not None else 2**63 - 1),
+            ).fetchone()
@@ -1,54 +1,222 @@
 from web3 import Web3, exceptions
 from queue import Queue
-from threading import Thread
-import time
+from threading import Thread, Event
+from pyanalyze.ipc import (
+    AsyncIPCClient,
+    IPCClient,
+    IPCError,
+    TRACE_ENDPOINT,
+    BLOCK_TRACE_ENDPOINT,
+    METHOD_NOT_FOUND,
+    block_traces,
+)
+from pyanalyze.pipeline import STOP, DEFAULT_QUEUE_SIZE
+from pyanalyze.tracecache import TraceCache
+from pyanalyze.checkpoint import CheckpointStore
+from pyanalyze.vandal.tracefile import BinaryTrace
+from pyanalyze import metrics, pipeline
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
 
 class GethIPCManager:
     def __init__(
-        self, ipc_path: str, output_queue: Queue, manager, start_block="latest"
+        self,
+        ipc_path: str,
+        output_queue: Queue,
+        manager,
+        start_block="latest",
+        concurrency: int = None,
+        batch_size: int = 1,
+        connections: int = 1,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        stopping: Event = None,
+        cache: TraceCache = None,
+        checkpoint: CheckpointStore = None,
+        block_traces: bool = False,
     ) -> None:
         self.w3 = Web3(Web3.IPCProvider(ipc_path))
-        self.tx_queue = Queue()
+        self.ipc_path = ipc_path
+        self.tx_queue = Queue(maxsize=queue_size)
         self.output_queue = output_queue
         self.block = start_block
         self.manager = manager
 
+        # set to stop every stage immediately, dropping queued work
+        self.stopping = stopping if stopping is not None else Event()
+        self.poll_thread: Thread = None
+        self.run_thread: Thread = None
+
+        # tracing goes through AsyncIPCClient when a concurrency is set,
+        # otherwise one transaction at a time through IPCClient. Both decode
+        # traces into BinaryTraces as they are read
+        self.client = IPCClient(ipc_path)
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.connections = connections
+
+        # blocks are traced with one BLOCK_TRACE_ENDPOINT call each when set,
+        # until the node turns out not to offer it
+        self.block_traces = block_traces
+
+        # traces are read from and written to the cache when set
+        self.cache = cache
+
+        # fetched blocks and dropped transactions are recorded when set, and
+        # polling resumes from the recorded position
+        self.checkpoint = checkpoint
+
         logger.info(f"Geth IPC Manager initialized with start block {self.block}")
 
     def set_block(self, block: str):
         self.block = block
 
     def start(self):
-        self.__init_tx_queue()
-
         self.poll_thread = Thread(target=self.poll_for_txs)
         self.poll_thread.start()
 
-        self.run_thread = Thread(target=self.run)
+        if self.concurrency:
+            self.run_thread = Thread(target=self.run_async)
+        else:
+            self.run_thread = Thread(target=self.run)
         self.run_thread.start()
 
     def __init_tx_queue(self):
+        if self.checkpoint is not None and self.checkpoint.next_block() is not None:
+            self.resume()
+            return
+
         res = self.w3.eth.get_block(self.block, full_transactions=False)
         self.block = res["number"] + 1
 
-        for tx in res["transactions"]:
-            self.tx_queue.put(tx.hex())
+        self.queue_block(res)
+
+    def resume(self):
+        """Continue after the last block recorded in the checkpoint, first
+        requeueing the transactions that never completed"""
+        pending = self.checkpoint.pending_transactions()
+        self.block = self.checkpoint.next_block()
+
+        logger.info(
+            f"Resuming from block {self.block} with {len(pending)} unfinished transactions"
+        )
+
+        for tx_hash in pending:
+            pipeline.put(self.tx_queue, tx_hash, self.stopping)
+
+    @staticmethod
+    def block_tx_hashes(res) -> list[str]:
+        # web3 returns HexBytes, raw JSON-RPC results hex strings
+        return [tx if isinstance(tx, str) else tx.hex() for tx in res["transactions"]]
+
+    def queue_block(self, res):
+        tx_hashes = GethIPCManager.block_tx_hashes(res)
+
+        if self.checkpoint is not None:
+            self.checkpoint.add_block(res["number"], tx_hashes)
+
+        # traced together (see trace_block)
+        if self.block_traces and tx_hashes:
+            pipeline.put(self.tx_queue, (res["number"], tx_hashes), self.stopping)
+            return
+
+        for tx_hash in tx_hashes:
+            pipeline.put(self.tx_queue, tx_hash, self.stopping)
+
+    def complete(self, tx_hash: str, status: str):
+        if self.checkpoint is not None:
+            self.checkpoint.complete_tx(tx_hash, status)
 
     def get_vandal_trace(self, tx_hash: str) -> dict:
-        endpoint = "debug_traceVandalTransaction"
-        res = self.w3.provider.make_request(endpoint, [tx_hash])
-        return res["result"]        
+        """The trace of tx_hash, from the cache or the node. An IPCError
+        from the node is returned rather than raised"""
+        if self.cache is not None:
+            trace = self.cache.get(tx_hash)
+            if trace is not None:
+                metrics.count("geth.cache_hits")
+                return trace
+
+        try:
+            with metrics.timer("geth.trace"):
+                res = self.client.request(TRACE_ENDPOINT, [tx_hash])
+        except IPCError as e:
+            return e
+        metrics.count("geth.traced")
+
+        self.cache_trace(tx_hash, res)
+        return res
+
+    def get_vandal_block_traces(self, number: int, tx_hashes: list[str]) -> dict:
+        """Trace every transaction of a block with one BLOCK_TRACE_ENDPOINT
+        call. Returns the traces by tx hash, leaving out any the node did not
+        return, or none if block traces are off or every one is cached"""
+        if not self.block_traces or self.is_cached(tx_hashes):
+            return {}
+
+        try:
+            with metrics.timer("geth.trace_block"):
+                res = self.client.request(BLOCK_TRACE_ENDPOINT, [hex(number)])
+        except IPCError as e:
+            self.block_trace_failed(number, e)
+            return {}
+
+        return self.block_results(number, tx_hashes, res)
+
+    def is_cached(self, tx_hashes: list[str]) -> bool:
+        return self.cache is not None and all(tx_hash in self.cache for tx_hash in tx_hashes)
+
+    def block_results(self, number: int, tx_hashes: list[str], res: list) -> dict:
+        traces = block_traces(res)
+        found = {tx_hash: traces[tx_hash] for tx_hash in tx_hashes if tx_hash in traces}
+
+        metrics.count("geth.traced_blocks")
+        metrics.count("geth.traced", len(found))
+
+        if len(found) < len(tx_hashes):
+            logger.warning(
+                f"Block trace of {number} is missing {len(tx_hashes) - len(found)} "
+                "transactions, tracing them one by one"
+            )
+
+        return found
+
+    def block_trace_failed(self, number: int, e: IPCError):
+        if e.code == METHOD_NOT_FOUND:
+            # other blocks may have been in flight already
+            if self.block_traces:
+                logger.warning(
+                    f"Node does not offer {BLOCK_TRACE_ENDPOINT}, tracing transactions one by one"
+                )
+            self.block_traces = False
+            return
+
+        metrics.count("geth.errors.block_trace")
+        logger.warning(f"Failed to trace block {number}, tracing its transactions one by one: {e}")
+
+    def cache_trace(self, tx_hash: str, res: dict):
+        if isinstance(res, BinaryTrace):
+            empty = len(res) == 0
+        else:
+            empty = not isinstance(res, dict) or not res.get("Ops")
+
+        if self.cache is None or empty:
+            return
+
+        try:
+            self.cache.put(tx_hash, res)
+        except (OSError, ValueError, OverflowError) as e:
+            logger.warning(f"Failed to cache trace for {tx_hash}: {e}")
 
     def poll_for_txs(self):
+        self.__init_tx_queue()
+
         backoff = 1
 
         last_n_blocks = 0
         since_last_n = 0
 
-        while True:
+        while not self.stopping.is_set():
             try:
                 res = self.w3.eth.get_block(self.block, full_transactions=False)
             except exceptions.BlockNotFound:
@@ -62,12 +230,15 @@ class GethIPCManager:
                     )
                     break
 
-                time.sleep(2**backoff)
+                self.stopping.wait(2**backoff)
                 backoff += 1
                 continue
 
             self.block += 1
 
+            metrics.count("geth.blocks")
+            metrics.observe("geth.block_transactions", len(res["transactions"]), metrics.SIZE_BUCKETS)
+
             last_n_blocks += len(res["transactions"])
             since_last_n += 1
 
@@ -78,22 +249,177 @@ class GethIPCManager:
                 last_n_blocks = 0
                 since_last_n = 0
 
-            for tx in res["transactions"]:
-                self.tx_queue.put(tx.hex())
+            self.queue_block(res)
 
-        self.manager.stop()
+        pipeline.put(self.tx_queue, STOP, self.stopping)
 
     def run(self):
         while True:
-            if self.tx_queue.qsize() > 0:
-                tx_hash = self.tx_queue.get(block=True)
-                res = self.get_vandal_trace(tx_hash)
-                if len(res) == 0:
-                    continue
-                res['tx_hash'] = tx_hash
-                if res['Ops'] is not None:
-                    self.output_queue.put(res)
+            item = pipeline.get(self.tx_queue, self.stopping)
+            if item is STOP:
+                break
+
+            if not isinstance(item, tuple):
+                self.put_trace(item, self.get_vandal_trace(item))
+                continue
+
+            number, tx_hashes = item
+            traces = self.get_vandal_block_traces(number, tx_hashes)
+
+            found = [tx_hash for tx_hash in tx_hashes if tx_hash in traces]
+            self.put_traces(found, [traces[tx_hash] for tx_hash in found])
+
+            for tx_hash in tx_hashes:
+                if tx_hash not in traces:
+                    self.put_trace(tx_hash, self.get_vandal_trace(tx_hash))
+
+        pipeline.put(self.output_queue, STOP, self.stopping)
+
+    def put_trace(self, tx_hash: str, res: dict):
+        if isinstance(res, IPCError):
+            metrics.count("geth.errors.trace")
+            logger.error(f"Failed to trace {tx_hash}: {res}")
+            self.complete(tx_hash, "failed")
+            return
+        if res is None or (isinstance(res, dict) and len(res) == 0):
+            metrics.count("geth.empty_traces")
+            self.complete(tx_hash, "empty")
+            return
+        res['tx_hash'] = tx_hash
+        if isinstance(res, BinaryTrace) or res['Ops'] is not None:
+            pipeline.put(self.output_queue, res, self.stopping)
+        else:
+            self.complete(tx_hash, "empty")
+
+    def run_async(self):
+        asyncio.run(self._run_async())
+
+    async def _run_async(self):
+        loop = asyncio.get_running_loop()
+        in_flight = set()
+
+        async with AsyncIPCClient(self.ipc_path, self.connections, self.concurrency) as client:
+            done = False
+
+            # a block taken off the queue while filling a batch
+            item = None
+
+            while not done:
+                if item is None:
+                    item = await loop.run_in_executor(
+                        None, pipeline.get, self.tx_queue, self.stopping
+                    )
+                if item is STOP:
+                    break
+
+                if isinstance(item, tuple):
+                    task = self._trace_block(client, *item)
+                    item = None
+                else:
+                    tx_hashes, item = [item], None
+                    while len(tx_hashes) < self.batch_size and not self.tx_queue.empty():
+                        tx_hash = self.tx_queue.get_nowait()
+                        if tx_hash is STOP:
+                            done = True
+                            break
+                        if isinstance(tx_hash, tuple):
+                            item = tx_hash
+                            break
+                        tx_hashes.append(tx_hash)
+
+                    task = self._trace_batch(client, tx_hashes)
+
+                # keep at most `concurrency` batches in flight
+                if len(in_flight) >= self.concurrency:
+                    _, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+
+                in_flight.add(asyncio.create_task(task))
+
+            if in_flight:
+                await asyncio.wait(in_flight)
+
+        pipeline.put(self.output_queue, STOP, self.stopping)
+
+    async def _trace_batch(self, client: AsyncIPCClient, tx_hashes: list[str]):
+        try:
+            await self.trace_batch(client, tx_hashes)
+        except ConnectionError as e:
+            metrics.count("geth.errors.connection")
+            logger.error(f"Lost IPC connection while tracing {len(tx_hashes)} transactions: {e}")
+
+    async def _trace_block(self, client: AsyncIPCClient, number: int, tx_hashes: list[str]):
+        try:
+            await self.trace_block(client, number, tx_hashes)
+        except ConnectionError as e:
+            metrics.count("geth.errors.connection")
+            logger.error(f"Lost IPC connection while tracing block {number}: {e}")
+
+    async def trace_block(self, client: AsyncIPCClient, number: int, tx_hashes: list[str]):
+        """Trace the transactions of a block with one BLOCK_TRACE_ENDPOINT
+        call, falling back to trace_batch for any it does not return, and
+        queue the traces. Raises ConnectionError if the IPC connection is
+        lost"""
+        traces = {}
+
+        if self.block_traces and not self.is_cached(tx_hashes):
+            try:
+                with metrics.timer("geth.trace_block"):
+                    res = await client.request(BLOCK_TRACE_ENDPOINT, [hex(number)])
+            except IPCError as e:
+                self.block_trace_failed(number, e)
+            else:
+                traces = self.block_results(number, tx_hashes, res)
+
+        if traces:
+            found = [tx_hash for tx_hash in tx_hashes if tx_hash in traces]
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.put_traces, found, [traces[tx_hash] for tx_hash in found]
+            )
+
+        rest = [tx_hash for tx_hash in tx_hashes if tx_hash not in traces]
+        if rest:
+            await self.trace_batch(client, rest)
+
+    async def trace_batch(self, client: AsyncIPCClient, tx_hashes: list[str]):
+        """Trace tx_hashes, or read them from the cache, and queue the traces.
+        Raises ConnectionError if the IPC connection is lost"""
+        cached = {}
+        if self.cache is not None:
+            cached = {tx_hash: self.cache.get(tx_hash) for tx_hash in tx_hashes}
+
+        misses = [tx_hash for tx_hash in tx_hashes if cached.get(tx_hash) is None]
+        metrics.count("geth.cache_hits", len(tx_hashes) - len(misses))
+
+        with metrics.timer("geth.trace_batch"):
+            traced = await client.trace_transactions(misses, self.batch_size)
+
+        metrics.count("geth.traced", len(misses))
+
+        traced = dict(zip(misses, traced))
+        results = [
+            cached[tx_hash] if cached.get(tx_hash) is not None else traced[tx_hash]
+            for tx_hash in tx_hashes
+        ]
+
+        # queueing blocks while the analysis stage is behind, so keep it off
+        # the event loop
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.put_traces, tx_hashes, results, traced.keys()
+        )
+
+    def put_traces(self, tx_hashes: list[str], results: list, traced=None):
+        """Queue the traces of tx_hashes, caching those in traced, or all of
+        them if it is None. Traces read from the cache are not written back"""
+        for tx_hash, res in zip(tx_hashes, results):
+            if traced is None or tx_hash in traced:
+                self.cache_trace(tx_hash, res)
+            self.put_trace(tx_hash, res)
 
     def stop(self):
-        self.poll_thread.join()
-        self.run_thread.join()
\ No newline at end of file
+        self.stopping.set()
+
+        for thread in (self.poll_thread, self.run_thread):
+            if thread is not None:
+                thread.join()
+
+        self.client.close()
\ No newline at end of file
@@ -5,6 +5,8 @@ from pyanalyze.api.metaop import REVERT, CALL, JUMPI
 
 class FailedSend(BaseHeuristic):
     REQUIRED_OPS = [REVERT, CALL, JUMPI]
+    # reverts and calls are linked from the whole trace, not only depth 1
+    PREREQUISITES = [(JUMPI, DiscreteFilters.depth_eq(1)), (REVERT, None), (CALL, None)]
 
     def __init__(self):
         super().__init__('FailedSend')
@@ -1,10 +1,16 @@
 from pyanalyze.api.metaopview import MetaOpResults
+from pyanalyze.tracesummary import TraceSummary
 import json
 
 class BaseHeuristic:
     REQUIRED_OPS = []
     OUTPUT_KEYS = []
 
+    # (MetaOp, depth filter or None) pairs that must all occur in a trace for
+    # the heuristic to find anything. None requires every REQUIRED_OPS op at
+    # any depth
+    PREREQUISITES = None
+
     def __init__(self, name):
         self.name = name
         self.results : MetaOpResults = None
@@ -14,7 +20,14 @@ class BaseHeuristic:
 
     def export(self, output_dir, tx_hash):
         with open(f'{output_dir}/reentrancy-{tx_hash}.json', 'w') as f:
-            json.dump(f, self.results)
+            json.dump(self.results.to_dict(), f)
+
+    def may_match(self, summary: TraceSummary) -> bool:
+        """Cheap necessary condition checked before a trace is loaded"""
+        if self.PREREQUISITES is None:
+            return all(summary.has(op) for op in self.REQUIRED_OPS)
+
+        return all(summary.has(op, depth) for op, depth in self.PREREQUISITES)
 
     def is_vulnerable(self):
         return self.results is not None and len(self.results) > 0
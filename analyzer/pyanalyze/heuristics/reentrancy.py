@@ -5,6 +5,12 @@ from pyanalyze.api.metaop import SLOAD, JUMPI, SSTORE
 
 class Reentrancy(BaseHeuristic):
     REQUIRED_OPS = [SLOAD, JUMPI, SSTORE]
+    # the JUMPI is linked at the SLOAD's depth
+    PREREQUISITES = [
+        (SLOAD, DiscreteFilters.depth_gt(2)),
+        (JUMPI, DiscreteFilters.depth_gt(2)),
+        (SSTORE, None),
+    ]
     OUTPUT_KEYS = [
         "SLOAD.op_index",
         "JUMPI.op_index",
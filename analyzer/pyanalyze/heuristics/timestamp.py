@@ -5,6 +5,7 @@ from pyanalyze.api.metaop import TIMESTAMP, JUMPI
 
 class TimestampDependency(BaseHeuristic):
     REQUIRED_OPS = [TIMESTAMP, JUMPI]
+    PREREQUISITES = [(TIMESTAMP, DiscreteFilters.depth_eq(1)), (JUMPI, None)]
 
     def __init__(self):
         super().__init__('TimestampDependency')
@@ -5,6 +5,7 @@ from pyanalyze.api.metaop import CALL, JUMPI
 
 class UncheckedCall(BaseHeuristic):
     REQUIRED_OPS = [CALL, JUMPI]
+    PREREQUISITES = [(CALL, DiscreteFilters.depth_eq(1)), (JUMPI, DiscreteFilters.depth_eq(1))]
 
     def __init__(self):
         super().__init__('UncheckedCall')
@@ -0,0 +1,287 @@
+from pyanalyze.tracestream import TraceStreamDecoder
+import asyncio
+import itertools
+import json
+import logging
+import socket
+
+logger = logging.getLogger(__name__)
+
+TRACE_ENDPOINT = "debug_traceVandalTransaction"
+
+# traces every transaction of a block in one call, where the node offers it.
+# Takes the block number and, like debug_traceBlockByNumber, returns a list
+# of {"txHash", "result"} or {"txHash", "error"}
+BLOCK_TRACE_ENDPOINT = "debug_traceVandalBlockByNumber"
+
+# JSON-RPC error code for a method the node does not offer
+METHOD_NOT_FOUND = -32601
+
+# geth writes one JSON value per line, but a single trace can run to hundreds
+# of MB, so anything reading whole lines needs a buffer limit far above
+# asyncio's default
+DEFAULT_READ_LIMIT = 2**30
+
+# responses are read and decoded this many bytes at a time, with reading
+# paused while this much is buffered
+READ_CHUNK = 2**20
+
+
+class IPCError(Exception):
+    """A JSON-RPC error object returned by the node for a single request"""
+
+    def __init__(self, error: dict):
+        self.code = error.get("code")
+        self.message = error.get("message")
+        super().__init__(f"JSON-RPC error {self.code}: {self.message}")
+
+
+def block_traces(result: list) -> dict:
+    """Map each transaction in a BLOCK_TRACE_ENDPOINT result to its trace, or
+    to an IPCError if the node failed to trace it"""
+    traces = {}
+
+    for entry in result or []:
+        error = entry.get("error")
+        if error is None:
+            traces[entry["txHash"]] = entry.get("result")
+        else:
+            traces[entry["txHash"]] = IPCError(error if isinstance(error, dict) else {"message": error})
+
+    return traces
+
+
+class IPCConnection:
+    """A single Unix socket to the node. Requests are written as soon as they
+    are issued and matched to their responses by id, so any number of them
+    can be in flight at once.
+
+    Responses are decoded as they are read (see TraceStreamDecoder), so
+    traces arrive as BinaryTraces unless decode_traces is unset."""
+
+    def __init__(self, ipc_path: str, read_limit: int = READ_CHUNK, decode_traces: bool = True):
+        self.ipc_path = ipc_path
+        self.read_limit = read_limit
+        self.decode_traces = decode_traces
+        self.reader: asyncio.StreamReader = None
+        self.writer: asyncio.StreamWriter = None
+        self.pending: dict[int, asyncio.Future] = {}
+        self._read_task: asyncio.Task = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_unix_connection(
+            self.ipc_path, limit=self.read_limit
+        )
+        self._read_task = asyncio.create_task(self._read_loop())
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+
+        if self._read_task is not None:
+            self._read_task.cancel()
+            try:
+                await self._read_task
+            except asyncio.CancelledError:
+                pass
+
+        self._fail_pending(ConnectionError(f"IPC connection to {self.ipc_path} closed"))
+
+    async def send(self, payload) -> list[asyncio.Future]:
+        """Write a request or a batch of requests and return one future per
+        request, resolved with its response object"""
+        requests = payload if isinstance(payload, list) else [payload]
+        loop = asyncio.get_running_loop()
+        futures = []
+
+        for request in requests:
+            future = loop.create_future()
+            self.pending[request["id"]] = future
+            futures.append(future)
+
+        self.writer.write(json.dumps(payload).encode() + b"\n")
+        await self.writer.drain()
+
+        return futures
+
+    async def _read_loop(self):
+        decoder = TraceStreamDecoder(self.decode_traces)
+
+        try:
+            while True:
+                data = await self.reader.read(READ_CHUNK)
+                if not data:
+                    break
+
+                for response in decoder.feed(data):
+                    self._dispatch(response)
+        except (ConnectionError, ValueError) as e:
+            self._fail_pending(e)
+            return
+
+        self._fail_pending(ConnectionError(f"IPC connection to {self.ipc_path} closed"))
+
+    def _dispatch(self, response):
+        for item in response if isinstance(response, list) else [response]:
+            future = self.pending.pop(item.get("id"), None)
+
+            if future is None:
+                logger.warning(f"Dropping IPC response with unknown id {item.get('id')}")
+            elif not future.done():
+                future.set_result(item)
+
+    def _fail_pending(self, exc: Exception):
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(exc)
+        self.pending.clear()
+
+
+class AsyncIPCClient:
+    """Asyncio JSON-RPC client for the geth IPC endpoint.
+
+    Requests are pipelined over one or more Unix sockets (picked round-robin),
+    may be grouped into JSON-RPC batch arrays, and at most `concurrency`
+    requests or batches are in flight at any time.
+    """
+
+    def __init__(
+        self,
+        ipc_path: str,
+        connections: int = 1,
+        concurrency: int = 16,
+        read_limit: int = READ_CHUNK,
+        decode_traces: bool = True,
+    ):
+        if connections < 1 or concurrency < 1:
+            raise ValueError("connections and concurrency must be at least 1")
+
+        self.ipc_path = ipc_path
+        self.concurrency = concurrency
+        self.connections = [
+            IPCConnection(ipc_path, read_limit, decode_traces) for _ in range(connections)
+        ]
+
+        self._ids = itertools.count(1)
+        self._next_connection = itertools.cycle(self.connections)
+        self._slots: asyncio.Semaphore = None
+
+    async def connect(self):
+        self._slots = asyncio.Semaphore(self.concurrency)
+
+        for connection in self.connections:
+            await connection.connect()
+
+    async def close(self):
+        for connection in self.connections:
+            await connection.close()
+
+    async def __aenter__(self) -> "AsyncIPCClient":
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _request(self, method: str, params: list) -> dict:
+        return {"jsonrpc": "2.0", "id": next(self._ids), "method": method, "params": params}
+
+    @staticmethod
+    def _result(response: dict):
+        if "error" in response:
+            return IPCError(response["error"])
+        return response.get("result")
+
+    async def request(self, method: str, params: list):
+        """Issue a single request and return its result, raising IPCError if
+        the node returned an error"""
+        async with self._slots:
+            futures = await next(self._next_connection).send(self._request(method, params))
+            result = AsyncIPCClient._result(await futures[0])
+
+        if isinstance(result, IPCError):
+            raise result
+        return result
+
+    async def batch(self, calls: list[tuple[str, list]]) -> list:
+        """Issue calls as one JSON-RPC batch array. Results are returned in
+        the order of calls, with an IPCError in place of each failed call"""
+        if not calls:
+            return []
+
+        async with self._slots:
+            payload = [self._request(method, params) for method, params in calls]
+            # a batch of one is sent as a plain request
+            if len(payload) == 1:
+                payload = payload[0]
+            futures = await next(self._next_connection).send(payload)
+            responses = await asyncio.gather(*futures)
+
+        return [AsyncIPCClient._result(response) for response in responses]
+
+    async def trace_transactions(self, tx_hashes: list[str], batch_size: int = 1) -> list:
+        """Trace every transaction with debug_traceVandalTransaction, batch_size
+        transactions per request, with batches running concurrently. Results
+        are returned in the order of tx_hashes"""
+        batches = [
+            tx_hashes[i : i + batch_size] for i in range(0, len(tx_hashes), batch_size)
+        ]
+        results = await asyncio.gather(
+            *(self.batch([(TRACE_ENDPOINT, [tx_hash]) for tx_hash in batch]) for batch in batches)
+        )
+
+        return [res for batch in results for res in batch]
+
+
+class IPCClient:
+    """Blocking JSON-RPC client over one Unix socket, one request at a time.
+
+    Used instead of web3's provider for traces, since responses are decoded
+    as they are read (see TraceStreamDecoder) rather than read in full and
+    then parsed. The socket is opened on the first request, and again after
+    an error.
+    """
+
+    def __init__(self, ipc_path: str, timeout: float = None, decode_traces: bool = True):
+        self.ipc_path = ipc_path
+        self.timeout = timeout
+        self.decode_traces = decode_traces
+        self.sock: socket.socket = None
+        self._ids = itertools.count(1)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def request(self, method: str, params: list):
+        """Issue a request and return its result, raising IPCError if the
+        node returned an error"""
+        if self.sock is None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(self.timeout)
+            self.sock.connect(self.ipc_path)
+
+        request_id = next(self._ids)
+        payload = {"jsonrpc": "2.0", "id": request_id, "method": method, "params": params}
+        decoder = TraceStreamDecoder(self.decode_traces)
+
+        try:
+            self.sock.sendall(json.dumps(payload).encode() + b"\n")
+
+            while True:
+                data = self.sock.recv(READ_CHUNK)
+                if not data:
+                    raise ConnectionError(f"IPC connection to {self.ipc_path} closed")
+
+                for response in decoder.feed(data):
+                    if isinstance(response, dict) and response.get("id") == request_id:
+                        result = AsyncIPCClient._result(response)
+                        if isinstance(result, IPCError):
+                            raise result
+                        return result
+        except (OSError, ValueError):
+            # the rest of the response may still be on the socket
+            self.close()
+            raise
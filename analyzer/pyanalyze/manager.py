@@ -1,26 +1,94 @@
 from pyanalyze.geth import GethIPCManager
-from pyanalyze.vandal.tac_cfg import TACGraph
-from queue import Queue
-from pyanalyze.api.metaoploader import MetaOpLoader
+from pyanalyze.tracecache import TraceCache
+from pyanalyze.checkpoint import CheckpointStore
+from pyanalyze.backfill import Backfill
+from pyanalyze.ipc import IPCError
+from pyanalyze.pipeline import STOP, DEFAULT_QUEUE_SIZE
+from pyanalyze import pipeline, worker
+from queue import Queue, Empty
+from threading import Thread, Event
+from concurrent.futures import ProcessPoolExecutor, Future
+from collections import deque
 from pyanalyze.api.metaopview import *
 from pyanalyze.api.metaopfilter import *
 from pyanalyze.heuristics.heuristics import BaseHeuristic
+from pyanalyze.tracesummary import SkipCounters
+from pyanalyze.metrics import MetricsReporter, MetricsSink
+from pyanalyze.budget import Budget, BudgetExceeded
+from pyanalyze import metrics
 from logging import getLogger
+import copy
 
 logger = getLogger(__name__)
 
 class VandalManager:
     def __init__(
-        self, ipc_path: str, start_block="latest", output_dir="./output"
+        self,
+        ipc_path: str,
+        start_block="latest",
+        output_dir="./output",
+        ipc_concurrency: int = None,
+        ipc_batch_size: int = 1,
+        ipc_connections: int = 1,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        workers: int = None,
+        trace_cache: str = None,
+        metrics_sink: MetricsSink = None,
+        metrics_interval: float = 60.0,
+        budget: Budget = None,
+        defer_queue_size: int = 256,
+        checkpoint: str = None,
+        block_traces: bool = False,
     ) -> None:
-        self.work_queue = Queue()
-        self.geth = GethIPCManager(ipc_path, self.work_queue, self, start_block)
+        self.stopping = Event()
+
+        # progress is recorded here when set, so a restart resumes where
+        # the last run stopped
+        self.checkpoint = CheckpointStore(checkpoint) if checkpoint else None
+
+        self.work_queue = Queue(maxsize=queue_size)
+        self.export_queue = Queue(maxsize=queue_size)
+        self.export_thread: Thread = None
+        self.geth = GethIPCManager(
+            ipc_path,
+            self.work_queue,
+            self,
+            start_block,
+            concurrency=ipc_concurrency,
+            batch_size=ipc_batch_size,
+            connections=ipc_connections,
+            queue_size=queue_size,
+            stopping=self.stopping,
+            cache=TraceCache(trace_cache) if trace_cache else None,
+            checkpoint=self.checkpoint,
+            block_traces=block_traces,
+        )
         self.heuristics : list[BaseHeuristic] = []
         self.output_dir = output_dir
 
         self.export_func = self.export_file if output_dir else self.export_stdout
 
-        self.loader_ops = []
+        self.skip_counters = SkipCounters()
+
+        # analysis runs in this many worker processes when set, otherwise on
+        # the calling thread
+        self.workers = workers
+        self.pool: ProcessPoolExecutor = None
+
+        # per-stage latencies, counts and queue depths are recorded and
+        # exported to the sink when set
+        self.metrics_reporter: MetricsReporter = None
+        if metrics_sink is not None:
+            self.metrics_reporter = MetricsReporter(metrics_sink, metrics_interval)
+
+        # transactions over budget are rerun shallow (see worker.analyze)
+        # from the deferred queue, whenever no new transaction is waiting
+        self.budget = budget
+        self.defer_queue_size = defer_queue_size
+        self.deferred: deque = deque()
+        self.input_done = False
+
+        self.backfill: Backfill = None
 
     def register_heuristic(self, heuristic : BaseHeuristic):
         logger.info(f"Registering heuristic {heuristic.name}")
@@ -29,48 +97,271 @@ class VandalManager:
             raise ValueError("Heuristic class cannot be None")
 
         self.heuristics.append(heuristic)
-        self.loader_ops.extend(heuristic.REQUIRED_OPS)
+        self.skip_counters.add_heuristic(heuristic.name)
+
+    def start_metrics(self):
+        if self.metrics_reporter is None:
+            return
+
+        self.metrics_reporter.start()
+
+        metrics.gauge("queue.tx", self.geth.tx_queue.qsize)
+        metrics.gauge("queue.work", self.work_queue.qsize)
+        metrics.gauge("queue.export", self.export_queue.qsize)
+        metrics.gauge("queue.deferred", lambda: len(self.deferred))
+
+    def stop_metrics(self):
+        if self.metrics_reporter is not None:
+            self.metrics_reporter.stop()
 
     def run_cli(self, block):
+        self.start_metrics()
+
         self.geth.set_block(block)
         self.geth.start()
 
+        self.export_thread = Thread(target=self.run_export)
+        self.export_thread.start()
+
+        if self.workers:
+            self.run_pool()
+        else:
+            self.run_serial()
+
+        pipeline.put(self.export_queue, STOP, self.stopping)
+        self.export_thread.join()
+        self.geth.stop()
+
+        logger.info(str(self.skip_counters))
+        self.stop_metrics()
+
+    def run_backfill(
+        self,
+        start: int,
+        end: int,
+        shard_size: int = 1000,
+        shard_workers: int = 4,
+        owner: str = None,
+    ):
+        """Analyze every transaction in blocks [start, end], resuming the
+        progress recorded in the checkpoint (see Backfill)"""
+        self.backfill = Backfill(self.geth, start, end, shard_size, shard_workers, owner)
+
+        self.start_metrics()
+        self.backfill.start()
+
+        self.export_thread = Thread(target=self.run_export)
+        self.export_thread.start()
+
+        if self.workers:
+            self.run_pool()
+        else:
+            self.run_serial()
+
+        pipeline.put(self.export_queue, STOP, self.stopping)
+        self.export_thread.join()
+        self.backfill.join()
+
+        logger.info(self.backfill.progress())
+        logger.info(str(self.skip_counters))
+        self.stop_metrics()
+
+    def next_tx(self) -> tuple:
+        """The next transaction to analyze, and whether it was deferred.
+        Deferred transactions only run while no new transaction is waiting,
+        so they never hold up the block stream"""
+        if self.stopping.is_set():
+            return STOP, False
+
+        if not self.input_done:
+            if self.deferred:
+                try:
+                    tx = self.work_queue.get_nowait()
+                except Empty:
+                    tx = None
+            else:
+                tx = pipeline.get(self.work_queue, self.stopping)
+
+            if tx is STOP:
+                self.input_done = True
+            elif tx is not None:
+                return tx, False
+
+        if self.deferred and not self.stopping.is_set():
+            return self.deferred.popleft(), True
+
+        return STOP, False
+
+    def can_defer(self, deferred: bool) -> bool:
+        return self.budget is not None and self.defer_queue_size > 0 and not deferred
+
+    def defer(self, tx):
+        if len(self.deferred) >= self.defer_queue_size:
+            metrics.count("budget.deferred_dropped")
+            logger.warning(f"Deferred queue full, dropping transaction {tx['tx_hash']}")
+            self.geth.complete(tx["tx_hash"], "dropped")
+            return
+
+        metrics.count("budget.deferred")
+        logger.info(f"Transaction {tx['tx_hash']} over budget, deferring")
+        self.deferred.append(tx)
+
+    def run_serial(self):
+        while True:
+            tx, deferred = self.next_tx()
+            if tx is STOP:
+                break
+
+            try:
+                self.analyze_tx(tx, deferred, self.can_defer(deferred))
+            except BudgetExceeded:
+                self.defer(tx)
+                continue
+            except Exception as e:
+                # as a worker failing in run_pool
+                metrics.count("analyze.errors")
+                logger.error(f"Analysis failed on {tx['tx_hash']}: {e!r}")
+                self.geth.complete(tx["tx_hash"], "failed")
+                continue
+
+            # heuristics keep their results on the instance, so export from a
+            # copy while the next transaction is analyzed
+            heuristics = [copy.copy(h) for h in self.heuristics if h.is_vulnerable()]
+            pipeline.put(self.export_queue, (tx['tx_hash'], heuristics), self.stopping)
+
+    def run_pool(self):
+        self.pool = ProcessPoolExecutor(
+            self.workers,
+            initializer=worker.init_worker,
+            initargs=([type(h) for h in self.heuristics], metrics.enabled(), self.budget),
+        )
+
+        # results are exported in the order transactions were traced, with
+        # enough in flight to keep every worker busy. Transactions are kept
+        # until then in case they are deferred
+        in_flight: deque[tuple[Future, dict]] = deque()
+
         while True:
-            if self.work_queue.qsize() > 0:
-                tx = self.work_queue.get(block=True)
-                self.analyze_tx(tx)
-                self.export_func(tx['tx_hash'])
+            # results are not held back waiting for the next transaction,
+            # which may only come once they are exported (a backfill shard
+            # is only done when its last transactions are)
+            while in_flight and not self.stopping.is_set() and (
+                len(in_flight) >= 2 * self.workers
+                or in_flight[0][0].done()
+                or (self.work_queue.empty() and not self.deferred)
+            ):
+                self.export_future(*in_flight.popleft())
+
+            tx, deferred = self.next_tx()
+            if tx is STOP:
+                if not in_flight or self.stopping.is_set():
+                    break
+
+                # results still in flight may defer more transactions
+                self.export_future(*in_flight.popleft())
+                continue
+
+            future = self.pool.submit(worker.analyze_tx, tx, deferred, self.can_defer(deferred))
+            in_flight.append((future, tx))
+
+        self.pool.shutdown(cancel_futures=True)
+
+    def export_future(self, future: Future, tx: dict):
+        try:
+            tx_hash, results, ran, worker_metrics, deferred = future.result()
+        except Exception as e:
+            metrics.count("analyze.errors.worker")
+            logger.error(f"Analysis failed in worker: {e!r}")
+            self.geth.complete(tx["tx_hash"], "failed")
+            return
+
+        metrics.merge(worker_metrics)
+
+        if deferred:
+            self.defer(tx)
+            return
+
+        self.skip_counters.record(ran)
+
+        heuristics = []
+        for i, res in results:
+            heuristic = copy.copy(self.heuristics[i])
+            heuristic.results = res
+            heuristics.append(heuristic)
+
+        pipeline.put(self.export_queue, (tx_hash, heuristics), self.stopping)
+
+    def run_export(self):
+        while True:
+            item = pipeline.get(self.export_queue, self.stopping)
+            if item is STOP:
+                break
+
+            tx_hash, heuristics = item
+            try:
+                with metrics.timer("export"):
+                    self.export_func(tx_hash, heuristics)
+            except Exception as e:
+                # the transaction still completes, so its block or shard does
+                metrics.count("export.errors")
+                logger.error(f"Failed to export results for {tx_hash}: {e!r}")
+                self.geth.complete(tx_hash, "failed")
+                continue
+
+            metrics.count("export.vulnerable", len(heuristics))
+
+            self.geth.complete(tx_hash, "done")
 
     def run_file(self, tx_hash):
+        self.start_metrics()
+
         logger.info(f"Analyzing transaction {tx_hash}")
 
         tx = self.geth.get_vandal_trace(tx_hash)
+        if isinstance(tx, IPCError):
+            logger.error(f"Failed to trace {tx_hash}: {tx}")
+            self.stop_metrics()
+            return
+        if not tx or (isinstance(tx, dict) and tx.get("Ops") is None):
+            logger.error(f"No trace for {tx_hash}")
+            self.stop_metrics()
+            return
+
+        tx["tx_hash"] = tx_hash
         self.analyze_tx(tx)
 
         logger.info(f"Exporting results for {tx_hash}")
 
-        self.export_func(tx_hash)
+        with metrics.timer("export"):
+            self.export_func(tx_hash)
 
-    def analyze_tx(self, tx):
-        try:
-            cfg = TACGraph.from_geth(tx)
-            api = MetaOpLoader(cfg, self.loader_ops)
-        except OverflowError:
-            logger.error(f"Transaction {tx['tx_hash']} too large to analyze")
-            return
+        self.stop_metrics()
 
-        for heuristic in self.heuristics:
-            heuristic.analyze(api)
+    def analyze_tx(self, tx, shallow: bool = False, defer: bool = False):
+        ran = worker.analyze(tx, self.heuristics, self.budget, shallow, defer)
+        self.skip_counters.record(ran)
 
-    def export_stdout(self, tx_hash):
-        for heuristic in self.heuristics:
+    def export_stdout(self, tx_hash, heuristics=None):
+        for heuristic in heuristics if heuristics is not None else self.heuristics:
             if heuristic.is_vulnerable():
-                heuristic.print(self.output_dir, tx_hash)
+                heuristic.print(tx_hash)
     
-    def export_file(self, tx_hash):
-        for heuristic in self.heuristics:
+    def export_file(self, tx_hash, heuristics=None):
+        for heuristic in heuristics if heuristics is not None else self.heuristics:
             if heuristic.is_vulnerable():
                 heuristic.export(self.output_dir, tx_hash)
 
     def stop(self):
+        self.stopping.set()
         self.geth.stop()
+
+        if self.backfill is not None:
+            self.backfill.join()
+
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+
+        if self.export_thread is not None:
+            self.export_thread.join()
+
+        self.stop_metrics()
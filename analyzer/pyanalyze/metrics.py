@@ -0,0 +1,410 @@
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Lock, Thread
+import functools
+import json
+import re
+import time
+
+# Process-wide counters, gauges and histograms, exported through a sink (see
+# MetricsReporter). Recording is a no-op until enable() is called, so the
+# instrumentation left in the pipeline costs one global lookup per call when
+# metrics are off.
+
+# upper bounds of the histogram buckets: latencies from 10us to 100s, and
+# sizes (ops, variables, links) from 1 to 16M
+LATENCY_BUCKETS = tuple(10.0 ** (e / 2) for e in range(-10, 5))
+SIZE_BUCKETS = tuple(4**e for e in range(13))
+
+
+class Histogram:
+    """Counts of observed values per bucket, plus their number and sum. The
+    last bucket holds values above every bound"""
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other: dict):
+        for i, n in enumerate(other["counts"]):
+            self.counts[i] += n
+        self.count += other["count"]
+        self.sum += other["sum"]
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th quantile"""
+        rank = q * self.count
+        seen = 0
+
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            seen += n
+            if n and seen >= rank:
+                return bound
+
+        return 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": list(self.buckets),
+            "counts": list(self.counts),
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Histogram":
+        histogram = cls(tuple(d["buckets"]))
+        histogram.merge(d)
+        return histogram
+
+
+class Registry:
+    def __init__(self):
+        self._lock = Lock()
+        self.counters: dict[str, int] = {}
+        self.gauges: dict[str, float] = {}
+        self.histograms: dict[str, Histogram] = {}
+
+        # gauges read when a snapshot is taken, e.g. queue depths
+        self.gauge_callbacks: dict[str, callable] = {}
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def set_gauge(self, name: str, value: float):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, value, buckets: tuple = LATENCY_BUCKETS):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def snapshot(self, reset: bool = False) -> dict:
+        gauges = {name: fn() for name, fn in list(self.gauge_callbacks.items())}
+
+        with self._lock:
+            gauges.update(self.gauges)
+            snapshot = {
+                "time": time.time(),
+                "counters": dict(self.counters),
+                "gauges": gauges,
+                "histograms": {
+                    name: histogram.to_dict() for name, histogram in self.histograms.items()
+                },
+            }
+
+            if reset:
+                self.counters.clear()
+                self.gauges.clear()
+                self.histograms.clear()
+
+        return snapshot
+
+    def merge(self, snapshot: dict):
+        """Add the counters and histograms of a snapshot, e.g. one drained
+        from a worker process"""
+        with self._lock:
+            for name, n in snapshot["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+            for name, d in snapshot["histograms"].items():
+                if name in self.histograms:
+                    self.histograms[name].merge(d)
+                else:
+                    self.histograms[name] = Histogram.from_dict(d)
+
+
+_registry: Registry = None
+
+
+def enable() -> Registry:
+    global _registry
+
+    if _registry is None:
+        _registry = Registry()
+
+    return _registry
+
+
+def disable():
+    global _registry
+    _registry = None
+
+
+def enabled() -> bool:
+    return _registry is not None
+
+
+def count(name: str, n: int = 1):
+    registry = _registry
+    if registry is not None:
+        registry.count(name, n)
+
+
+def observe(name: str, value, buckets: tuple = LATENCY_BUCKETS):
+    registry = _registry
+    if registry is not None:
+        registry.observe(name, value, buckets)
+
+
+def gauge(name: str, fn):
+    """Report fn() as a gauge whenever metrics are exported"""
+    registry = _registry
+    if registry is not None:
+        registry.gauge_callbacks[name] = fn
+
+
+class _Timer:
+    __slots__ = ("registry", "name", "start")
+
+    def __init__(self, registry: Registry, name: str):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.name, time.perf_counter() - self.start)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(name: str):
+    """Context manager recording the latency of its body in histogram name"""
+    registry = _registry
+    if registry is None:
+        return _NULL_TIMER
+    return _Timer(registry, name)
+
+
+def timed(name: str):
+    """Decorator recording the latency of every call in histogram name"""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            registry = _registry
+            if registry is None:
+                return fn(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                registry.observe(name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def drain() -> dict:
+    """Snapshot and reset the metrics of this process, or None if disabled"""
+    registry = _registry
+    if registry is None:
+        return None
+    return registry.snapshot(reset=True)
+
+
+def merge(snapshot: dict):
+    registry = _registry
+    if registry is not None and snapshot is not None:
+        registry.merge(snapshot)
+
+
+class MetricsSink:
+    """Receives a snapshot of every metric, cumulative since enable(), each
+    time metrics are exported"""
+
+    def emit(self, snapshot: dict):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class StdoutSink(MetricsSink):
+    """Prints a summary table"""
+
+    def emit(self, snapshot: dict):
+        lines = [f"metrics at {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snapshot['time']))}"]
+
+        for name, n in sorted(snapshot["counters"].items()):
+            lines.append(f"  {name:<40} {n}")
+
+        for name, value in sorted(snapshot["gauges"].items()):
+            lines.append(f"  {name:<40} {value}")
+
+        for name, d in sorted(snapshot["histograms"].items()):
+            histogram = Histogram.from_dict(d)
+            mean = histogram.sum / histogram.count if histogram.count else 0
+            lines.append(
+                f"  {name:<40} n={histogram.count} mean={mean:.6g} "
+                f"p50<={histogram.quantile(0.5):.6g} p99<={histogram.quantile(0.99):.6g}"
+            )
+
+        print("\n".join(lines), flush=True)
+
+
+class JSONLinesSink(MetricsSink):
+    """Appends every snapshot to a file as one JSON object per line"""
+
+    def __init__(self, path: str):
+        self.file = open(path, "a")
+
+    def emit(self, snapshot: dict):
+        self.file.write(json.dumps(snapshot) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class HTTPSink(MetricsSink):
+    """Serves the current metrics in the Prometheus text format at /metrics,
+    and as JSON at /metrics.json"""
+
+    def __init__(self, port: int, host: str = "127.0.0.1"):
+        self.snapshot: dict = None
+
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                # served live while metrics are enabled
+                registry = _registry
+                snapshot = registry.snapshot() if registry is not None else sink.snapshot
+
+                if snapshot is None or self.path not in ("/metrics", "/metrics.json"):
+                    self.send_error(404)
+                    return
+
+                if self.path == "/metrics":
+                    body, content_type = HTTPSink.prometheus(snapshot), "text/plain; version=0.0.4"
+                else:
+                    body, content_type = json.dumps(snapshot), "application/json"
+
+                body = body.encode()
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def emit(self, snapshot: dict):
+        self.snapshot = snapshot
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @staticmethod
+    def prometheus(snapshot: dict) -> str:
+        def metric_name(name: str) -> str:
+            return "pyanalyze_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+        lines = []
+
+        for name, n in sorted(snapshot["counters"].items()):
+            name = metric_name(name)
+            lines += [f"# TYPE {name} counter", f"{name} {n}"]
+
+        for name, value in sorted(snapshot["gauges"].items()):
+            name = metric_name(name)
+            lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+
+        for name, d in sorted(snapshot["histograms"].items()):
+            name = metric_name(name)
+            lines.append(f"# TYPE {name} histogram")
+
+            cumulative = 0
+            for bound, n in zip(d["buckets"] + ["+Inf"], d["counts"]):
+                cumulative += n
+                lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+
+            lines += [f"{name}_sum {d['sum']}", f"{name}_count {d['count']}"]
+
+        return "\n".join(lines) + "\n"
+
+
+def sink_from_spec(spec: str) -> MetricsSink:
+    """Create a sink from "stdout", "jsonl:<path>" or "http:[<host>:]<port>" """
+    kind, _, arg = spec.partition(":")
+
+    if kind == "stdout" and not arg:
+        return StdoutSink()
+    if kind == "jsonl" and arg:
+        return JSONLinesSink(arg)
+    if kind == "http" and arg:
+        host, _, port = arg.rpartition(":")
+        return HTTPSink(int(port), host or "127.0.0.1")
+
+    raise ValueError(f"Unknown metrics sink {spec}")
+
+
+class MetricsReporter:
+    """Exports a snapshot to sink every interval seconds, and once more when
+    stopped"""
+
+    def __init__(self, sink: MetricsSink, interval: float = 60.0):
+        self.sink = sink
+        self.interval = interval
+        self.stopping = Event()
+        self.thread: Thread = None
+
+    def start(self):
+        enable()
+
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.export()
+
+    def export(self):
+        registry = _registry
+        if registry is not None:
+            self.sink.emit(registry.snapshot())
+
+    def stop(self):
+        if self.thread is None:
+            return
+
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+
+        self.export()
+        self.sink.close()
@@ -0,0 +1,36 @@
+from queue import Queue, Empty, Full
+from threading import Event
+
+# Passed down the pipeline (fetch -> trace -> analyze -> export) when a stage
+# has no more work, so each downstream stage drains its queue and exits
+STOP = object()
+
+DEFAULT_QUEUE_SIZE = 1024
+
+# how often a blocked stage wakes up to check whether it has been stopped
+POLL_INTERVAL = 0.5
+
+
+def put(queue: Queue, item, stopping: Event) -> bool:
+    """Block until item fits in queue. Returns False, without queueing the
+    item, if the pipeline is stopped first"""
+    while not stopping.is_set():
+        try:
+            queue.put(item, timeout=POLL_INTERVAL)
+            return True
+        except Full:
+            continue
+
+    return False
+
+
+def get(queue: Queue, stopping: Event):
+    """Block until an item is available. Returns STOP if the pipeline is
+    stopped first"""
+    while not stopping.is_set():
+        try:
+            return queue.get(timeout=POLL_INTERVAL)
+        except Empty:
+            continue
+
+    return STOP
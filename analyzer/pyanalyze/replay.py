@@ -0,0 +1,149 @@
+import asyncio
+import json
+import logging
+import os
+from glob import glob
+
+from pyanalyze.ipc import TRACE_ENDPOINT, BLOCK_TRACE_ENDPOINT, DEFAULT_READ_LIMIT
+
+logger = logging.getLogger(__name__)
+
+
+class ReplayIPCServer:
+    """A fake geth IPC endpoint that replays recorded traces.
+
+    Serves debug_traceVandalTransaction over a Unix socket from a dict of
+    tx hash -> recorded trace, speaking newline-delimited JSON-RPC with batch
+    array support. latency (seconds) is added to every request to emulate
+    tracing time on the node. Used to exercise AsyncIPCClient and the
+    pipeline without a node.
+
+    When blocks (block number -> tx hashes) is set, eth_getBlockByNumber is
+    served from it as well, returning null for any other block like a node
+    does past its head, and so is BLOCK_TRACE_ENDPOINT unless block_traces
+    is unset. latency applies once per request, so a block trace costs the
+    same as one transaction trace.
+    """
+
+    def __init__(
+        self,
+        ipc_path: str,
+        traces: dict[str, dict],
+        latency: float = 0.0,
+        blocks: dict[int, list[str]] = None,
+        block_traces: bool = True,
+    ):
+        self.ipc_path = ipc_path
+        self.traces = traces
+        self.blocks = blocks
+        self.block_traces = block_traces
+        self.latency = latency
+        self.requests = 0
+        self._server: asyncio.AbstractServer = None
+
+    @classmethod
+    def from_dir(cls, ipc_path: str, trace_dir: str, latency: float = 0.0) -> "ReplayIPCServer":
+        """Load every <tx hash>.json under trace_dir, as written by
+        scripts/debug.py or the trace cache"""
+        traces = {}
+
+        for path in glob(os.path.join(trace_dir, "*.json")):
+            with open(path) as f:
+                trace = json.load(f)
+
+            # recordings may hold the raw JSON-RPC response
+            if "result" in trace and "Ops" not in trace:
+                trace = trace["result"]
+
+            traces[os.path.basename(path)[: -len(".json")]] = trace
+
+        return cls(ipc_path, traces, latency)
+
+    async def start(self):
+        if os.path.exists(self.ipc_path):
+            os.remove(self.ipc_path)
+
+        self._server = await asyncio.start_unix_server(
+            self._handle, self.ipc_path, limit=DEFAULT_READ_LIMIT
+        )
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+        if os.path.exists(self.ipc_path):
+            os.remove(self.ipc_path)
+
+    async def __aenter__(self) -> "ReplayIPCServer":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def serve_forever(self):
+        await self.start()
+        await self._server.serve_forever()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                request = json.loads(line)
+                asyncio.create_task(self._respond(request, writer))
+        except (ConnectionError, ValueError) as e:
+            logger.warning(f"Replay connection closed: {e}")
+        finally:
+            writer.close()
+
+    async def _respond(self, request, writer: asyncio.StreamWriter):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if isinstance(request, list):
+            response = [self.handle_request(r) for r in request]
+        else:
+            response = self.handle_request(request)
+
+        if not writer.is_closing():
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+
+    def handle_request(self, request: dict) -> dict:
+        self.requests += 1
+        method, params = request.get("method"), request.get("params", [])
+
+        if method == TRACE_ENDPOINT and params and params[0] in self.traces:
+            return {"jsonrpc": "2.0", "id": request.get("id"), "result": self.traces[params[0]]}
+
+        if method == "eth_getBlockByNumber" and self.blocks is not None and params:
+            number = int(params[0], 16)
+            block = None
+            if number in self.blocks:
+                block = {"number": hex(number), "transactions": self.blocks[number]}
+            return {"jsonrpc": "2.0", "id": request.get("id"), "result": block}
+
+        if method == BLOCK_TRACE_ENDPOINT and self.blocks is not None and self.block_traces and params:
+            number = int(params[0], 16)
+            if number not in self.blocks:
+                error = {"code": -32000, "message": f"block {params[0]} not found"}
+                return {"jsonrpc": "2.0", "id": request.get("id"), "error": error}
+
+            result = [
+                {"txHash": tx_hash, "result": self.traces[tx_hash]}
+                if tx_hash in self.traces
+                else {"txHash": tx_hash, "error": f"transaction {tx_hash} not found"}
+                for tx_hash in self.blocks[number]
+            ]
+            return {"jsonrpc": "2.0", "id": request.get("id"), "result": result}
+
+        if method == TRACE_ENDPOINT:
+            error = {"code": -32000, "message": f"transaction {params[0] if params else None} not found"}
+        else:
+            error = {"code": -32601, "message": f"the method {method} does not exist/is not available"}
+
+        return {"jsonrpc": "2.0", "id": request.get("id"), "error": error}
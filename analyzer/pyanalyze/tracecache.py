@@ -0,0 +1,78 @@
+import mmap
+import os
+import struct
+import tempfile
+from logging import getLogger
+
+from pyanalyze.vandal.tracefile import BinaryTrace
+
+logger = getLogger(__name__)
+
+
+class TraceCache:
+    """On-disk cache of binary traces, one file per transaction.
+
+    Files are addressed by tx hash (<cache_dir>/<first byte>/<tx hash>.vtrc)
+    and written atomically, so several processes can share a cache. Reads
+    memory-map the file, so a cached trace costs no parsing and the page
+    cache is shared between runs.
+    """
+
+    SUFFIX = ".vtrc"
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, tx_hash: str) -> str:
+        tx_hash = tx_hash.lower()
+        key = tx_hash[2:] if tx_hash.startswith("0x") else tx_hash
+
+        return os.path.join(self.cache_dir, key[:2], tx_hash + TraceCache.SUFFIX)
+
+    def __contains__(self, tx_hash: str) -> bool:
+        return os.path.exists(self.path(tx_hash))
+
+    def get(self, tx_hash: str) -> BinaryTrace:
+        """Return the cached trace for tx_hash, or None"""
+        try:
+            with open(self.path(tx_hash), "rb") as f:
+                # the mapping stays open for as long as the trace's columns
+                # reference it
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            # ValueError: empty file
+            self.misses += 1
+            return None
+
+        try:
+            trace = BinaryTrace.from_buffer(buffer, tx_hash)
+        except (ValueError, struct.error) as e:
+            logger.warning(f"Ignoring corrupt cached trace for {tx_hash}: {e}")
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return trace
+
+    def put(self, tx_hash: str, trace: dict) -> BinaryTrace:
+        """Encode and store a trace dict, returning the encoded trace"""
+        if not isinstance(trace, BinaryTrace):
+            trace = BinaryTrace.from_dict(trace)
+
+        path = self.path(tx_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(trace.to_bytes())
+            os.replace(tmp_path, path)
+        except OSError:
+            os.remove(tmp_path)
+            raise
+
+        return trace
@@ -0,0 +1,145 @@
+import json
+import re
+
+from pyanalyze.vandal.tracefile import BinaryTraceBuilder
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# start of the ops array of a trace, which is the only part of a response
+# that can run to hundreds of MB
+OPS_START = re.compile(rb'"Ops"\s*:\s*\[')
+
+# longest prefix of an OPS_START match that can be cut off by a chunk boundary
+_OPS_START_TAIL = 64
+
+
+class TraceStreamDecoder:
+    """
+    Incremental decoder for the newline delimited JSON-RPC responses of the
+    node, as read from the IPC socket.
+
+    Everything outside the "Ops" arrays of traces is small, so it is kept as
+    bytes and decoded with json once the response is complete. The ops are
+    decoded as soon as they arrive, a chunk at a time, into a
+    BinaryTraceBuilder, and the object holding them ("To" and "Ops", the
+    result of a transaction trace or an entry of a block trace) is replaced
+    with the BinaryTrace. The raw response and the ops as dicts are never
+    held in full, so memory grows with the encoded trace only. Chunks of
+    ops are parsed with orjson when it is installed.
+
+    Ops must be flat objects of numbers and hex strings, as written by
+    debug_traceVandalTransaction, so the array ends at the first ']' after
+    it starts.
+    """
+
+    def __init__(self, decode_traces: bool = True):
+        self.decode_traces = decode_traces
+
+        # the response being read, with every ops array replaced by the
+        # index of its builder
+        self.envelope = bytearray()
+        self.builders: list[BinaryTraceBuilder] = []
+
+        # undecoded bytes of the ops array being read, or None outside one
+        self.ops: bytearray = None
+
+        self._decoder = json.JSONDecoder()
+
+    def feed(self, data: bytes) -> list:
+        """Consume the next bytes read, returning the responses they complete"""
+        responses = []
+
+        while data:
+            if self.ops is not None:
+                data = self._feed_ops(data)
+                continue
+
+            end = data.find(b"\n")
+            line, data = (data, b"") if end < 0 else (data[: end + 1], data[end + 1 :])
+
+            start = len(self.envelope)
+            self.envelope += line
+
+            if self.decode_traces:
+                # the key may have been split over the previous chunk
+                match = OPS_START.search(self.envelope, max(0, start - _OPS_START_TAIL))
+                if match is not None:
+                    data = bytes(self.envelope[match.end() :]) + data
+                    del self.envelope[match.end() - 1 :]
+                    self.envelope += str(len(self.builders)).encode()
+
+                    self.builders.append(BinaryTraceBuilder())
+                    self.ops = bytearray()
+                    continue
+
+            if end >= 0:
+                responses += self._finish()
+
+        return responses
+
+    def _feed_ops(self, data: bytes) -> bytes:
+        end = data.find(b"]")
+        self.ops += data if end < 0 else data[:end]
+
+        # decode every complete op read so far
+        last = self.ops.rfind(b"}")
+        if last >= 0:
+            chunk = bytes(self.ops[: last + 1]).lstrip(b", \t\r\n")
+            del self.ops[: last + 1]
+            self.builders[-1].extend(_loads(b"[" + chunk + b"]"))
+
+        if end < 0:
+            return b""
+
+        if self.ops.strip(b", \t\r\n"):
+            raise ValueError("Malformed ops array in trace")
+
+        self.ops = None
+        return data[end + 1 :]
+
+    def _finish(self) -> list:
+        text = self.envelope.decode()
+        builders = self.builders
+
+        self.envelope = bytearray()
+        self.builders = []
+
+        # tolerate several JSON values on one line
+        values = []
+        pos = 0
+        while True:
+            while pos < len(text) and text[pos].isspace():
+                pos += 1
+            if pos == len(text):
+                break
+
+            value, pos = self._decoder.raw_decode(text, pos)
+            values.append(value)
+
+        if builders:
+            values = [_build_traces(value, builders) for value in values]
+
+        return values
+
+
+def _build_traces(value, builders: list[BinaryTraceBuilder]):
+    """Replace every object holding the index of a builder as its "Ops",
+    e.g. the result of a transaction trace or each trace in a block trace,
+    with the built trace"""
+    if isinstance(value, list):
+        for i, item in enumerate(value):
+            value[i] = _build_traces(item, builders)
+    elif isinstance(value, dict):
+        ops = value.get("Ops")
+        if isinstance(ops, int) and not isinstance(ops, bool):
+            return builders[ops].build(value.get("To"))
+
+        for key, item in value.items():
+            value[key] = _build_traces(item, builders)
+
+    return value
@@ -0,0 +1,105 @@
+import numpy as np
+
+import pyanalyze.vandal.evm_cfg as evm_cfg
+import pyanalyze.vandal.opcodes as opcodes
+from pyanalyze.vandal.tracefile import BinaryTrace
+from pyanalyze.api.metaop import MetaOp, metaop_to_op_name
+from pyanalyze.api.metaopfilter import OpFilter
+
+
+class TraceSummary:
+    """Which ops occur in a trace, and at which call depths.
+
+    Built with one vectorized pass over the opcode column, so heuristics can
+    be ruled out (see BaseHeuristic.may_match) before a trace is loaded.
+    Depths are computed as MetaOpLoader computes them, and ops are named as
+    their MetaOps (PUSHn is CONST, LOGn is LOG).
+    """
+
+    def __init__(self, depths: dict[str, np.ndarray]):
+        self.depths = depths
+
+    @classmethod
+    def from_trace(cls, trace: dict) -> "TraceSummary":
+        if not isinstance(trace, BinaryTrace):
+            trace = BinaryTrace.from_dict(trace)
+
+        if len(trace) == 0:
+            return cls({})
+
+        _, depth, _, _ = evm_cfg.frame_layout(trace.pc, trace.op)
+
+        # every distinct (opcode, depth) pair
+        pairs = np.unique(np.stack([trace.op.astype(np.int64), depth], axis=1), axis=0)
+        codes, depths = pairs[:, 0], pairs[:, 1]
+
+        summary = {}
+        for code in np.unique(codes).tolist():
+            if code not in opcodes.BYTECODES:
+                continue
+
+            opcode = opcodes.BYTECODES[code]
+            if opcode.is_push():
+                name = opcodes.CONST.name
+            elif opcode.is_log():
+                name = opcodes.LOG.name
+            else:
+                name = opcode.name
+
+            op_depths = depths[codes == code]
+            if name in summary:
+                op_depths = np.union1d(summary[name], op_depths)
+            summary[name] = op_depths
+
+        return cls(summary)
+
+    def has(self, op: MetaOp, depth: OpFilter = None) -> bool:
+        """Whether the trace has an op of type op, at a depth passing the
+        depth filter if given"""
+        depths = self.depths.get(metaop_to_op_name[op])
+
+        if depths is None:
+            return False
+        if depth is None:
+            return True
+
+        return bool(np.any(depth.operator(depths, depth.value)))
+
+
+class SkipCounters:
+    """How many transactions, and how many heuristic runs, the prefilter
+    skipped"""
+
+    def __init__(self, heuristic_names: list[str] = None):
+        self.transactions = 0
+        self.skipped = 0
+        self.heuristic_names: list[str] = []
+        self.heuristic_skips: list[int] = []
+
+        for name in heuristic_names or []:
+            self.add_heuristic(name)
+
+    def add_heuristic(self, name: str):
+        self.heuristic_names.append(name)
+        self.heuristic_skips.append(0)
+
+    def record(self, ran: list[bool]):
+        """Count one transaction, given which heuristics ran on it (in
+        registration order)"""
+        self.transactions += 1
+
+        if not any(ran):
+            self.skipped += 1
+
+        for i, heuristic_ran in enumerate(ran):
+            if not heuristic_ran:
+                self.heuristic_skips[i] += 1
+
+    def __str__(self):
+        heuristics = ", ".join(
+            f"{name} {n}" for name, n in zip(self.heuristic_names, self.heuristic_skips)
+        )
+        return (
+            f"Prefilter skipped {self.skipped}/{self.transactions} transactions "
+            f"(per heuristic: {heuristics})"
+        )
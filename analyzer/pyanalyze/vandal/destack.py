@@ -0,0 +1,319 @@
+"""destack.py: Single-pass destackification of a trace, without building a TACGraph."""
+
+import typing as t
+
+import pyanalyze.vandal.evm_cfg as evm_cfg
+import pyanalyze.vandal.memtypes as mem
+import pyanalyze.vandal.opcodes as opcodes
+import pyanalyze.vandal.tracefile as tracefile
+
+# (opcode name, used variable names, defined variable name or None, value of
+# the defined variable or None if not constant, op_index, call_index, pc,
+# depth), one per TAC op in block order
+Record = t.Tuple[str, t.List[str], t.Optional[str], t.Optional[int], int, int, int, int]
+
+CARDINALITY = mem.Variable.CARDINALITY
+
+# how the Destackifier translates an opcode
+(
+    SWAP,
+    DUP,
+    POP,
+    CONST,
+    LOAD,
+    TRACED,
+    TRACED_NO_ARGS,
+    STORE,
+    COPY,
+    EXTCODECOPY,
+    ARITH,
+    ASSIGN,
+    OP,
+) = range(13)
+
+
+def _translation(opcode: opcodes.OpCode) -> int:
+    # mirrors the branches of Destackifier.__gen_instruction and
+    # TACBasicBlock.apply_operations
+    if opcode.is_swap():
+        return SWAP
+    if opcode.is_dup():
+        return DUP
+    if opcode == opcodes.POP:
+        return POP
+    if opcode.is_push():
+        return CONST
+    if opcode.is_log():
+        return OP
+    if opcode in (opcodes.MSTORE, opcodes.MSTORE8):
+        return STORE
+    if opcode in (opcodes.SLOAD, opcodes.MLOAD):
+        return LOAD
+    if opcode == opcodes.SSTORE:
+        return OP
+    if opcode.is_kind_one():
+        return TRACED_NO_ARGS
+    if opcode.is_kind_two():
+        return TRACED
+    if opcode.is_kind_three_store_two():
+        return EXTCODECOPY if opcode == opcodes.EXTCODECOPY else COPY
+    if opcode.is_kind_four() or opcode.is_kind_five():
+        return TRACED
+    if opcode.push == 1:
+        return ARITH if opcode.is_arithmetic() else ASSIGN
+    return OP
+
+
+def _code(code: int) -> tuple:
+    opcode = opcodes.BY_VALUE[code]
+    if opcode is None:
+        return None
+
+    flags = opcodes.FLAGS[code]
+    kind = _translation(opcode)
+    if kind == CONST:
+        name = opcodes.CONST.name
+    elif flags & opcodes.IS_LOG:
+        name = opcodes.LOG.name
+    else:
+        name = opcode.name
+
+    return (
+        name,
+        kind,
+        opcodes.POP_COUNTS[code],
+        opcodes.PUSH_COUNTS[code] == 1,
+        bool(flags & opcodes.IS_CALL),
+        bool(flags & opcodes.POSSIBLY_HALTS),
+        bool(flags & (opcodes.IS_KIND_FOUR | opcodes.IS_KIND_FIVE)),
+    )
+
+
+# (name, translation, pops, whether it defines a variable, is a call,
+# possibly halts, closes a frame) of every opcode value, or None for bytes
+# that are not opcodes
+_CODES = [_code(code) for code in range(256)]
+
+
+class _Stack:
+    """The symbolic stack of one call frame, holding variable names. Popping
+    past the bottom yields S0, S1, ... as in memtypes.VariableStack"""
+
+    def __init__(self, depth: int):
+        self.items: t.List[str] = []
+        self.empty_pops = 0
+        self.depth = depth
+
+    def pop_many(self, n: int) -> t.List[str]:
+        items = self.items
+        if len(items) >= n:
+            popped = items[-n:] if n else []
+            del items[len(items) - n :]
+            popped.reverse()
+            return popped
+
+        popped = items[::-1]
+        items.clear()
+        for _ in range(n - len(popped)):
+            popped.append(f"S{self.empty_pops}")
+            self.empty_pops += 1
+        return popped
+
+    def push_many(self, names: t.Iterable[str]) -> None:
+        items = self.items
+        for name in names:
+            if len(items) < mem.VariableStack.DEFAULT_MAX:
+                items.append(name)
+
+
+def _int(values: t.Dict[str, int], name: str) -> int:
+    # trim_0x_to_int of a TACArg: constants print as hex, anything else as
+    # its name, which does not parse
+    if name not in values:
+        raise ValueError(f"{name} is not constant")
+    return values[name]
+
+
+def destackify(
+    trace: dict,
+    memory: mem.TraceMemory = None,
+    storage: mem.StorageIndex = None,
+    meter=None,
+) -> t.Tuple[t.List[Record], t.Dict[int, str]]:
+    """
+    Translate a trace into the TAC ops TACGraph.from_geth would produce,
+    with constants folded, in one pass over the ops.
+
+    Only the information MetaOpLoader needs is kept: the records of every op
+    and the address executing at each depth. Stacks are lists of variable
+    names and constant values are tracked in a single dict, so no Variable,
+    TACOp or block objects are built.
+
+    Args:
+      trace: result from debug_traceVandalTransaction. JSON formatted, or
+        a tracefile.BinaryTrace
+      memory: if set, receives the memory writes, as TACGraph.memory would
+      storage: if set, receives the storage accesses, as TACGraph.storage
+        would
+      meter: if set, a pyanalyze.budget.BudgetMeter ticked once per op, so
+        a trace over the time budget raises BudgetExceeded part way through
+
+    Returns:
+      The op records and the depth -> address mapping.
+
+    Raises:
+      Any error the TACGraph construction or MetaOpLoader would raise,
+      though not necessarily the same one: a trace that fails here should be
+      rerun through TACGraph.from_geth for the exact error.
+    """
+    if not isinstance(trace, tracefile.BinaryTrace):
+        trace = tracefile.BinaryTrace.from_dict(trace)
+
+    addresses = {1: trace["To"].lower()}
+    records: t.List[Record] = []
+
+    n = len(trace)
+    if n == 0:
+        return records, addresses
+
+    call_index, depth, splits, keep_last = evm_cfg.frame_layout(trace.pc, trace.op)
+    rows = list(trace.rows())
+    call_index = call_index.tolist()
+    depth = depth.tolist()
+
+    # bytes that are not opcodes fail as in evm_cfg.ops_from_trace
+    codes = _CODES
+    for code in set(trace.op.tolist()):
+        if codes[code] is None:
+            opcodes.opcode_by_value(code)
+
+    starts = [0] + splits
+    ends = splits + [n]
+    if not keep_last:
+        starts.pop()
+        ends.pop()
+
+    # constant value of every variable known to be constant
+    values: t.Dict[str, int] = {}
+    stacks: t.List[_Stack] = []
+    n_vars = 0
+
+    for start, end in zip(starts, ends):
+        first_pc, first_code = rows[start][0], rows[start][1]
+        opens_frame = first_pc == 0
+        resumes_frame = codes[first_code][6]
+
+        # as in Destackifier.convert_block
+        if opens_frame:
+            stack = _Stack(depth[start])
+        elif resumes_frame:
+            stack = stacks.pop()
+            if depth[start] != stack.depth:
+                stack = stacks.pop()
+        else:
+            raise ValueError(f"Block at op {start} does not start a call frame")
+
+        frame = None
+        if memory is not None:
+            frame = memory.enter(rows[start][2], depth[start], opens_frame, call_index[start])
+
+        for i in range(start, end):
+            if meter is not None:
+                meter.tick()
+
+            pc, code, op_index, value, _ = rows[i]
+            name, kind, pops, defines, is_call, _, _ = codes[code]
+
+            if kind == SWAP:
+                items = stack.pop_many(pops)
+                stack.push_many(reversed([items[-1]] + items[1:-1] + [items[0]]))
+                continue
+            if kind == DUP:
+                items = stack.pop_many(pops)
+                stack.push_many(reversed([items[-1]] + items))
+                continue
+            if kind == POP:
+                stack.pop_many(1)
+                continue
+
+            def_name = None
+            if defines:
+                def_name = f"V{n_vars}"
+                n_vars += 1
+
+            if kind == CONST:
+                used = []
+                values[def_name] = value % CARDINALITY
+            elif kind == LOAD:
+                used = stack.pop_many(1)
+                values[def_name] = value % CARDINALITY
+
+                if storage is not None and name == opcodes.SLOAD.name:
+                    storage.load(op_index, depth[i], values.get(used[0]), values[def_name])
+            elif kind == TRACED:
+                used = stack.pop_many(pops)
+                values[def_name] = value % CARDINALITY
+            elif kind == TRACED_NO_ARGS:
+                used = []
+                values[def_name] = value % CARDINALITY
+            else:
+                used = stack.pop_many(pops)
+
+                if kind == STORE:
+                    offset = _int(values, used[0])
+                    stored = _int(values, used[1])
+                    if name == opcodes.MSTORE.name:
+                        data = stored.to_bytes(32, "big")
+                    else:
+                        data = (stored & 0xFF).to_bytes(1, "big")
+                elif kind == COPY:
+                    offset = _int(values, used[0])
+                    data = value.to_bytes(_int(values, used[2]), "big")
+                elif kind == EXTCODECOPY:
+                    offset = _int(values, used[1])
+                    data = value.to_bytes(_int(values, used[3]), "big")
+
+                if frame is not None and kind in (STORE, COPY, EXTCODECOPY):
+                    frame.write(offset, data, op_index)
+                elif kind == OP and storage is not None and name == opcodes.SSTORE.name:
+                    storage.store(op_index, depth[i], values.get(used[0]), values.get(used[1]))
+                elif kind == ARITH and all(u in values for u in used):
+                    values[def_name] = (
+                        getattr(mem.Variable, name)(*(values[u] for u in used))
+                        % CARDINALITY
+                    )
+
+            if is_call:
+                if used[1] not in values:
+                    raise TypeError(f"Call address {used[1]} is not constant")
+                addresses[depth[i] + 1] = hex(values[used[1]]).lower()
+
+                if storage is not None:
+                    storage.call(
+                        depth[i],
+                        values[used[1]],
+                        name in (opcodes.DELEGATECALL.name, opcodes.CALLCODE.name),
+                    )
+
+            records.append(
+                (
+                    name,
+                    used,
+                    def_name,
+                    values.get(def_name),
+                    op_index,
+                    call_index[i],
+                    pc,
+                    depth[i],
+                )
+            )
+
+            if def_name is not None:
+                stack.push_many((def_name,))
+
+        # a block both opening and resuming a frame is kept twice, as in
+        # Destackifier.convert_block
+        if not codes[rows[end - 1][1]][5]:
+            stacks.extend([stack] * (opens_frame + resumes_frame))
+
+    return records, addresses
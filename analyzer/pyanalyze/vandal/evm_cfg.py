@@ -2,8 +2,11 @@
 
 import typing as t
 
+import numpy as np
+
 import pyanalyze.vandal.cfg as cfg
 import pyanalyze.vandal.opcodes as opcodes
+import pyanalyze.vandal.tracefile as tracefile
 
 
 class EVMBasicBlock(cfg.BasicBlock):
@@ -83,6 +86,9 @@ class EVMOp:
     Represents a single EVM operation.
     """
 
+    # one per op of a trace, so no per-instance __dict__
+    __slots__ = ("pc", "opcode", "value", "block", "depth", "extra", "call_index", "op_index")
+
     def __init__(
         self,
         pc: int,
@@ -159,64 +165,117 @@ class EVMOp:
         )
 
 
-def blocks_from_ops(ops: t.Iterable[EVMOp]) -> t.Iterable[EVMBasicBlock]:
+# opcodes that close a call frame: CALL, CALLCODE, DELEGATECALL, STATICCALL,
+# CREATE, CREATE2. Indexed by opcode value, as the opcodes tables are
+_FLAGS = np.array(opcodes.FLAGS, dtype=np.int64)
+_CLOSES_FRAME = (_FLAGS & (opcodes.IS_KIND_FOUR | opcodes.IS_KIND_FIVE)) != 0
+_PC_GAP = np.array(opcodes.PC_GAPS, dtype=np.int64)
+_POSSIBLY_HALTS = (_FLAGS & opcodes.POSSIBLY_HALTS) != 0
+
+
+def frame_layout(
+    pcs: np.ndarray, codes: np.ndarray
+) -> t.Tuple[np.ndarray, np.ndarray, t.List[int], bool]:
+    """
+    Compute the call frame structure of a non-empty trace.
+
+    Args:
+      pcs: program counter of every op.
+      codes: opcode value of every op.
+
+    Returns:
+      The call_index and depth of every op, the indices at which a new block
+      starts, and whether the last block is kept.
+    """
+    n = len(pcs)
+    pcs = pcs.astype(np.int64)
+    codes = codes.astype(np.int64)
+
+    # a new contract (pc 0) opens a call frame and starts a new block. The
+    # first op opens the outermost frame without splitting.
+    opens = pcs == 0
+    call_index = np.cumsum(opens) - opens[0]
+
+    # a call or create closes the frame and starts a new block, unless it
+    # directly follows the previous op in the same frame (e.g. 238;ADD
+    # 239;CALL), i.e. the callee executed no ops. For the first op the
+    # previous op wraps around to the last one.
+    prev = np.roll(np.arange(n), 1)
+    prev_codes = codes[prev]
+    inline = (
+        (call_index[prev] == call_index)
+        & (pcs - pcs[prev] == _PC_GAP[prev_codes])
+        & ~_POSSIBLY_HALTS[prev_codes]
+    )
+    is_call = ~opens & _CLOSES_FRAME[codes]
+    closes = is_call & ~inline
+
+    depth = np.cumsum(opens.astype(np.int64) - closes)
+
+    splits = np.flatnonzero((opens & (np.arange(n) != 0)) | closes).tolist()
+
+    # the last block is only kept if its last instruction does not alter flow
+    keep_last = not (opens[-1] or is_call[-1])
+
+    return call_index, depth, splits, keep_last
+
+
+def ops_from_trace(trace: "tracefile.BinaryTrace") -> t.List[EVMOp]:
+    """Decode every op of a trace into an EVMOp"""
+    opcode_of = {
+        code: opcodes.opcode_by_value(code) for code in np.unique(trace.op).tolist()
+    }
+
+    return [
+        EVMOp(pc, opcode_of[op], value=value, op_index=op_index, extra=extra)
+        for pc, op, op_index, value, extra in trace.rows()
+    ]
+
+
+def blocks_from_ops(
+    ops: t.Iterable[EVMOp], pcs: np.ndarray = None, codes: np.ndarray = None
+) -> t.Iterable[EVMBasicBlock]:
     """
     Process a sequence of EVMOps and create a sequence of EVMBasicBlocks.
 
     Args:
       ops: sequence of EVMOps to be put into blocks.
+      pcs: program counter of every op, if already available as an array.
+      codes: opcode value of every op, if already available as an array.
 
     Returns:
       List of BasicBlocks from the input ops, in arbitrary order.
     """
+    ops = list(ops)
+    n = len(ops)
 
-    blocks = []
+    if n == 0:
+        return []
+
+    if pcs is None:
+        pcs = np.fromiter((op.pc for op in ops), dtype=np.int64, count=n)
+    if codes is None:
+        codes = np.fromiter((op.opcode.code for op in ops), dtype=np.int64, count=n)
 
-    # details for block currently being processed
-    entry, exit = (0, len(ops) - 1) if len(ops) > 0 else (None, None)
-    current = EVMBasicBlock(entry, exit)
-
-    call_index = 0
-    for i, op in enumerate(ops):
-        if op.pc == 0 and i != 0:
-            call_index += 1
-        op.call_index = call_index
-
-    # Linear scan of all EVMOps to create initial EVMBasicBlocks
-    depth = 0
-    for i, op in enumerate(ops):
-        op.block = current
-        current.evm_ops.append(op)
-
-        # Remove all the intra blocks and only focus on the inter edges
-        # add a condition to create a new block when encountering the new contract 0;
-        if op.pc == 0 and i == 0:
-            depth = 1
-        elif op.pc == 0 and i != 0:
-            depth += 1
-            new = current.split(i)
-            blocks.append(current)
-            current = new
-
-        # Add CREATE and CREATE2
-        elif op.opcode.is_kind_four() or op.opcode.is_kind_five():
-            # Make sure conditions such as 238;ADD 239;CALL will not be split
-            if (
-                ops[i - 1].call_index == op.call_index
-                and op.pc - ops[i - 1].pc == ops[i - 1].opcode.op_pc_gap()
-                and not ops[i - 1].opcode.possibly_halts()
-            ):
-                pass
-            else:
-                depth -= 1
-                new = current.split(i)
-                blocks.append(current)
-                current = new
-
-        # Always add last block if its last instruction does not alter flow
-        elif i == len(ops) - 1:
-            blocks.append(current)
-
-        op.depth = depth
+    call_index, depth, splits, keep_last = frame_layout(pcs, codes)
+
+    for op, i, d in zip(ops, call_index.tolist(), depth.tolist()):
+        op.call_index = i
+        op.depth = d
+
+    # blocks run between consecutive splits
+    blocks = []
+    starts = [0] + splits
+    ends = splits + [n]
+
+    for entry, end in zip(starts, ends):
+        block = EVMBasicBlock(entry, n - 1, ops[entry:end])
+        block.exit = end - 1
+        for op in block.evm_ops:
+            op.block = block
+        blocks.append(block)
+
+    if not keep_last:
+        blocks.pop()
 
     return blocks
@@ -13,6 +13,8 @@ from copy import copy
 
 
 class LatticeElement(abc.ABC):
+    __slots__ = ("value",)
+
     def __init__(self, value):
         """
         Construct a lattice element with the given value.
@@ -83,6 +85,8 @@ class LatticeElement(abc.ABC):
 class BoundedLatticeElement(LatticeElement):
     """An element from a lattice with defined Top and Bottom elements."""
 
+    __slots__ = ()
+
     TOP_SYMBOL = "⊤"
     BOTTOM_SYMBOL = "⊥"
 
@@ -165,6 +169,8 @@ class IntLatticeElement(BoundedLatticeElement):
     compare superior and inferior with every other element, respectively.
     """
 
+    __slots__ = ()
+
     def __init__(self, value: int):
         """
         Args:
@@ -232,6 +238,8 @@ class SubsetLatticeElement(BoundedLatticeElement):
     elements, the bottom is the empty set, and other elements are subsets of top.
     """
 
+    __slots__ = ()
+
     def __init__(self, value: t.Iterable):
         """
         Args:
@@ -3,7 +3,9 @@ in the ethereum machine."""
 
 import abc
 import copy
+import heapq
 import typing as t
+from bisect import bisect_right
 from itertools import zip_longest, dropwhile
 
 from pyanalyze.vandal.lattice import LatticeElement, SubsetLatticeElement as ssle
@@ -13,10 +15,15 @@ VAR_DEFAULT_NAME = "Var"
 VAR_RESULT_NAME = "Res"
 """The name to apply to variables resulting from an arithmetic operation."""
 
+_value_set = LatticeElement.value
+"""Slot of the value set of a Variable that is not a single constant."""
+
 
 class Location(abc.ABC):
     """A generic storage location: variables, memory, static storage."""
 
+    __slots__ = ()
+
     @property
     def identifier(self) -> str:
         """Return the string identifying this object."""
@@ -49,6 +56,9 @@ class Variable(ssle, Location):
     the result of some TAC operation. Its size is 32 bytes.
     """
 
+    # one or more per op of a trace, so no per-instance __dict__
+    __slots__ = ("name", "def_sites", "_const")
+
     SIZE = 32
     """Variables are 32 bytes in size."""
 
@@ -72,12 +82,47 @@ class Variable(ssle, Location):
                      was possibly defined.
         """
 
-        # Make sure the input values are not out of range.
-        mod = [] if values is None else [v % self.CARDINALITY for v in values]
-        super().__init__(value=mod)
         self.name = name
         self.def_sites = def_sites
 
+        # Make sure the input values are not out of range. Nearly every
+        # variable is a single constant, which is kept without a set.
+        if type(values) is list and len(values) == 1 and isinstance(values[0], int):
+            self._const = values[0] % self.CARDINALITY
+        elif isinstance(values, Variable) and values._const is not None:
+            self._const = values._const
+        else:
+            self.value = (
+                set() if values is None else {v % self.CARDINALITY for v in values}
+            )
+
+    @property
+    def value(self) -> set:
+        """
+        The set of values this Variable may take, or the Top set.
+
+        A Variable with exactly one value holds it in _const rather than in a
+        set, so a new set is returned for it, and changing that set does not
+        change the Variable. Assign to value instead.
+        """
+        if self._const is not None:
+            return {self._const}
+        return _value_set.__get__(self)
+
+    @value.setter
+    def value(self, value: set):
+        if len(value) == 1:
+            (v,) = value
+
+            # Top is a set of one symbol
+            if isinstance(v, int):
+                self._const = v
+                _value_set.__set__(self, None)
+                return
+
+        self._const = None
+        _value_set.__set__(self, value)
+
     def __deepcopy__(self, memodict={}):
         if self.is_top:
             return type(self).top(self.name, copy.deepcopy(self.def_sites, memodict))
@@ -105,7 +150,35 @@ class Variable(ssle, Location):
         Args:
           vals: an iterable of values that this Variable will hold
         """
-        self.value = ssle(v % self.CARDINALITY for v in vals).value
+        if isinstance(vals, Variable) and vals._const is not None:
+            self._const = vals._const
+            _value_set.__set__(self, None)
+        else:
+            self.value = {v % self.CARDINALITY for v in vals}
+
+    @property
+    def is_top(self) -> bool:
+        return self._const is None and super().is_top
+
+    @property
+    def is_bottom(self) -> bool:
+        return self._const is None and super().is_bottom
+
+    @property
+    def is_const(self) -> bool:
+        return self._const is not None
+
+    @property
+    def is_finite(self) -> bool:
+        return self._const is not None or super().is_finite
+
+    def __len__(self):
+        return 1 if self._const is not None else super().__len__()
+
+    def __iter__(self):
+        if self._const is not None:
+            return iter((self._const,))
+        return super().__iter__()
 
     @property
     def identifier(self) -> str:
@@ -208,9 +281,7 @@ class Variable(ssle, Location):
     @property
     def const_value(self):
         """If this variable is constant, return its value."""
-        if not self.is_const:
-            return None
-        return next(iter(self))
+        return self._const
 
     def complement(self) -> "Variable":
         """
@@ -244,6 +315,11 @@ class Variable(ssle, Location):
                 arity of the specified operation.
           name: the name of the result Variable.
         """
+        # constants are folded directly, without a product of value sets
+        consts = [arg.const_value for arg in args]
+        if None not in consts:
+            return cls(values=[getattr(cls, opname)(*consts)], name=name)
+
         result = ssle.cartesian_map(getattr(cls, opname), args)
         return cls(values=result, name=name)
 
@@ -387,6 +463,8 @@ class Variable(ssle, Location):
 class MetaVariable(Variable):
     """A Variable to stand in for Variables."""
 
+    __slots__ = ("payload",)
+
     def __init__(self, name: str, payload=None, def_sites: ssle = ssle.bottom()):
         """
         Args:
@@ -599,3 +677,286 @@ class VariableStack(LatticeElement):
         yields an empty stack.
         """
         return super().join_all(elements, initial=VariableStack())
+
+
+class FrameMemory:
+    """
+    The memory of one call frame, as written by the ops of a trace.
+
+    Memory is sparse: it is split into pages of PAGE_SIZE bytes, and only
+    the pages written to exist. A page holds the writes touching it, as
+    (op_index, offset, data) tuples in execution order. The data of a write
+    is the bytes object it stored, shared by every page it spans and never
+    copied, so a copy to a large offset costs no more than one to offset 0.
+
+    Since the writes are kept rather than applied, memory can be read as it
+    was after any op of the frame.
+    """
+
+    PAGE_SIZE = 4096
+    """Bytes per page."""
+
+    def __init__(self, frame: int):
+        """
+        Args:
+          frame: call_index of the first op of this frame.
+        """
+        self.frame = frame
+        self.pages: t.Dict[int, t.List[t.Tuple[int, int, bytes]]] = {}
+
+    def write(self, offset: int, data: bytes, op_index: int):
+        """Record that the op at op_index stored data at offset. Writes must
+        be recorded in execution order."""
+        if not data:
+            return
+
+        write = (op_index, offset, data)
+        first, last = offset // self.PAGE_SIZE, (offset + len(data) - 1) // self.PAGE_SIZE
+        for page in range(first, last + 1):
+            self.pages.setdefault(page, []).append(write)
+
+    def writes(
+        self, offset: int, length: int, op_index: int = None
+    ) -> t.Iterator[t.Tuple[int, int, bytes]]:
+        """
+        The writes overlapping [offset, offset + length) by ops up to and
+        including op_index, or by every op if it is None, latest first.
+        """
+        if length <= 0:
+            return
+
+        first, last = offset // self.PAGE_SIZE, (offset + length - 1) // self.PAGE_SIZE
+        if last - first < len(self.pages):
+            pages = [page for page in range(first, last + 1) if page in self.pages]
+        else:
+            pages = sorted(page for page in self.pages if first <= page <= last)
+
+        candidates = []
+        for page in pages:
+            writes = self.pages[page]
+            end = len(writes)
+            if op_index is not None:
+                end = bisect_right(writes, (op_index, float("inf")))
+
+            candidates.append(map(writes.__getitem__, range(end - 1, -1, -1)))
+
+        if len(candidates) > 1:
+            candidates = heapq.merge(*candidates, key=lambda w: w[0], reverse=True)
+        elif candidates:
+            candidates = candidates[0]
+
+        # a write spanning several pages is seen once per page
+        previous = None
+        for write in candidates:
+            if write is previous:
+                continue
+            previous = write
+
+            _, w_offset, data = write
+            if w_offset < offset + length and offset < w_offset + len(data):
+                yield write
+
+    def read(self, offset: int, length: int, op_index: int = None) -> bytes:
+        """
+        The bytes at [offset, offset + length) after the op at op_index, or
+        after the last op if it is None. Bytes never written are zero.
+        """
+        buffer = bytearray(max(length, 0))
+
+        # ranges of the buffer no later write has filled
+        gaps = [(offset, offset + length)]
+
+        for _, w_offset, data in self.writes(offset, length, op_index):
+            w_end = w_offset + len(data)
+            view = memoryview(data)
+
+            unfilled = []
+            for lo, hi in gaps:
+                a, b = max(lo, w_offset), min(hi, w_end)
+                if a >= b:
+                    unfilled.append((lo, hi))
+                    continue
+
+                buffer[a - offset : b - offset] = view[a - w_offset : b - w_offset]
+                if lo < a:
+                    unfilled.append((lo, a))
+                if b < hi:
+                    unfilled.append((b, hi))
+
+            gaps = unfilled
+            if not gaps:
+                break
+
+        return bytes(buffer)
+
+    def word(self, offset: int, op_index: int = None) -> int:
+        """The 32 byte word at offset after the op at op_index, as MLOAD
+        would read it."""
+        return int.from_bytes(self.read(offset, Variable.SIZE, op_index), "big")
+
+
+class TraceMemory:
+    """
+    The memory of every call frame of a transaction.
+
+    Ops are assigned to frames in execution order with enter, so the frame
+    an op ran in, and its memory as of that op, can be looked up by
+    op_index without replaying the trace.
+    """
+
+    def __init__(self):
+        self.frames: t.Dict[int, FrameMemory] = {}
+        """Memory of each frame, by the call_index of its first op."""
+
+        # op_index from which on each entry of _entered runs
+        self._starts: t.List[int] = []
+        self._entered: t.List[FrameMemory] = []
+
+        # innermost frame opened at each call depth
+        self._depths: t.Dict[int, FrameMemory] = {}
+
+    def enter(self, op_index: int, depth: int, opens: bool, call_index: int) -> FrameMemory:
+        """
+        Record that the ops from op_index on run at depth, until the next
+        call to enter. If opens is set they start a new frame, identified by
+        call_index, otherwise they resume the last frame opened at depth.
+
+        Returns:
+          The memory of the frame entered.
+        """
+        if opens or depth not in self._depths:
+            frame = self.frames[call_index] = FrameMemory(call_index)
+            self._depths[depth] = frame
+        else:
+            frame = self._depths[depth]
+
+        if not self._entered or self._entered[-1] is not frame:
+            self._starts.append(op_index)
+            self._entered.append(frame)
+
+        return frame
+
+    def frame_at(self, op_index: int) -> t.Optional[FrameMemory]:
+        """The memory of the frame the op at op_index ran in, or None if it
+        comes before every frame entered."""
+        i = bisect_right(self._starts, op_index) - 1
+        return self._entered[i] if i >= 0 else None
+
+    def read(self, op_index: int, offset: int, length: int) -> bytes:
+        """The bytes at [offset, offset + length) in the memory of the frame
+        the op at op_index ran in, after that op."""
+        frame = self.frame_at(op_index)
+        if frame is None:
+            return bytes(max(length, 0))
+        return frame.read(offset, length, op_index)
+
+    def word(self, op_index: int, offset: int) -> int:
+        """The word at offset in the memory of the frame the op at op_index
+        ran in, after that op."""
+        return int.from_bytes(self.read(op_index, offset, Variable.SIZE), "big")
+
+
+# (op_index, call depth, whether it is a write, value read or written or
+# None if not constant), one per SLOAD or SSTORE
+StorageAccess = t.Tuple[int, int, bool, t.Optional[int]]
+
+
+class StorageIndex:
+    """
+    Every SLOAD and SSTORE of a transaction, by contract address and slot.
+
+    The accesses of each (address, slot) are kept in execution order, so
+    questions such as whether a slot read at some depth is written later
+    from a shallower frame are answered from that slot's accesses alone.
+    Accesses to slots that are not constant are not recorded.
+
+    The address of an access is the one whose storage its depth uses when
+    it runs, as recorded with call. This is the address the call was made
+    to, except for DELEGATECALL and CALLCODE, which run in the storage of
+    the caller. MetaOp.address instead keeps the address called.
+    """
+
+    def __init__(self, address: str = None):
+        """
+        Args:
+          address: the contract the transaction is sent to, executing at
+                   depth 1.
+        """
+        self.accesses: t.Dict[t.Tuple[str, int], t.List[StorageAccess]] = {}
+        """Accesses of each (address, slot), in execution order."""
+
+        # address executing at each call depth
+        self.addresses: t.Dict[int, str] = {}
+        if address is not None:
+            self.addresses[1] = address.lower()
+
+    def call(self, depth: int, address: int, delegate: bool = False):
+        """Record a call made at depth to address, which the ops at depth + 1
+        run in until the next call made at depth. A delegating call
+        (DELEGATECALL or CALLCODE) keeps the storage of depth."""
+        if delegate:
+            self.addresses[depth + 1] = self.addresses.get(depth)
+        else:
+            self.addresses[depth + 1] = hex(address).lower()
+
+    def load(self, op_index: int, depth: int, slot: int, value: int):
+        """Record an SLOAD at depth of slot, reading value."""
+        self._record(op_index, depth, slot, False, value)
+
+    def store(self, op_index: int, depth: int, slot: int, value: int):
+        """Record an SSTORE at depth of value to slot."""
+        self._record(op_index, depth, slot, True, value)
+
+    def _record(self, op_index: int, depth: int, slot: int, write: bool, value: int):
+        if slot is None:
+            return
+
+        key = (self.addresses.get(depth), slot)
+        self.accesses.setdefault(key, []).append((op_index, depth, write, value))
+
+    def slots(self, address: str = None) -> t.List[t.Tuple[str, int]]:
+        """The (address, slot) pairs accessed, only those of address if set."""
+        if address is None:
+            return list(self.accesses)
+        return [key for key in self.accesses if key[0] == address.lower()]
+
+    def reads(self, address: str, slot: int) -> t.List[StorageAccess]:
+        """The SLOADs of slot of address, in execution order."""
+        return [a for a in self.accesses.get((address.lower(), slot), ()) if not a[2]]
+
+    def writes(self, address: str, slot: int) -> t.List[StorageAccess]:
+        """The SSTOREs of slot of address, in execution order."""
+        return [a for a in self.accesses.get((address.lower(), slot), ()) if a[2]]
+
+    def writes_after(
+        self, address: str, slot: int, op_index: int, max_depth: int = None
+    ) -> t.List[StorageAccess]:
+        """The SSTOREs of slot of address after the op at op_index, only
+        those at most max_depth deep if set."""
+        accesses = self.accesses.get((address.lower(), slot), [])
+        start = bisect_right(accesses, (op_index, float("inf")))
+
+        return [
+            a
+            for a in accesses[start:]
+            if a[2] and (max_depth is None or a[1] <= max_depth)
+        ]
+
+    def read_write_pairs(
+        self, depth_gap: int = 0
+    ) -> t.Iterator[t.Tuple[str, int, StorageAccess, StorageAccess]]:
+        """
+        Every SLOAD with an SSTORE of the same slot and address after it, at
+        least depth_gap frames shallower, as (address, slot, read, write).
+        E.g. a depth_gap of 2 finds slots read in a reentrant call and
+        written afterwards by a frame it was called from.
+        """
+        for (address, slot), accesses in self.accesses.items():
+            for i, read in enumerate(accesses):
+                if read[2]:
+                    continue
+
+                for write in accesses[i + 1 :]:
+                    if write[2] and write[1] <= read[1] - depth_gap:
+                        yield address, slot, read, write
+
@@ -17,6 +17,9 @@ class OpCode:
         self.pop = pop
         self.push = push
 
+        # set once every opcode is defined, see _classify
+        self.flags = 0
+
     def stack_delta(self) -> int:
         """Return the net effect on the stack size of running this operation."""
         return self.push - self.pop
@@ -35,71 +38,39 @@ class OpCode:
     def __hash__(self) -> int:
         return self.code.__hash__()
 
+    # Predicates read the flags precomputed for every opcode (see
+    # _classify), so they cost one attribute lookup and a mask
+
     # Special cases for kind one, such as CALLVALUE
     # Those opcodes do not need anything from stack, but will give related dynamic info
     def is_kind_one(self) -> bool:
-        special = {
-            ADDRESS.name,
-            ORIGIN.name,
-            CALLER.name,
-            CALLVALUE.name,
-            CALLDATASIZE.name,
-            CODESIZE.name,
-            GASPRICE.name,
-            RETURNDATASIZE.name,
-            COINBASE.name,
-            TIMESTAMP.name,
-            NUMBER.name,
-            DIFFICULTY.name,
-            GASLIMIT.name,
-            PC.name,
-            MSIZE.name,
-            GAS.name,
-        }
-        return self.name in special
+        return bool(self.flags & IS_KIND_ONE)
 
     # Special cases for kind two, such as CALLDATALOAD
     # Need one or more stack arguments and related dynamic info
     def is_kind_two(self) -> bool:
-        special = {
-            SHA3.name,
-            BALANCE.name,
-            CALLDATALOAD.name,
-            EXTCODESIZE.name,
-            BLOCKHASH.name,
-        }
-        return self.name in special
+        return bool(self.flags & IS_KIND_TWO)
 
     # Special cases for part of kind three load, SLOAD
     def is_kind_three_load(self) -> bool:
-        special = {SLOAD.name}
-        return self.name in special
+        return bool(self.flags & IS_KIND_THREE_LOAD)
 
     # Special cases for part of kind three store, like MSTORE
     def is_kind_three_store_one(self) -> bool:
-        special = {MSTORE.name, MSTORE8.name, SSTORE.name}
-        return self.name in special
+        return bool(self.flags & IS_KIND_THREE_STORE_ONE)
 
     # Special cases for some other store operations, they are special
     # since they do need some arguments from the stack and then get the related data
     # to store them into the memory
     def is_kind_three_store_two(self) -> bool:
-        special = {
-            CALLDATACOPY.name,
-            CODECOPY.name,
-            EXTCODECOPY.name,
-            RETURNDATACOPY.name,
-        }
-        return self.name in special
+        return bool(self.flags & IS_KIND_THREE_STORE_TWO)
 
     # Special cases for four call opcodes
     def is_kind_four(self) -> bool:
-        special = {CALL.name, CALLCODE.name, DELEGATECALL.name, STATICCALL.name}
-        return self.name in special
+        return bool(self.flags & IS_KIND_FOUR)
 
     def is_kind_five(self) -> bool:
-        special = {CREATE.name, CREATE2.name}
-        return self.name in special
+        return bool(self.flags & IS_KIND_FIVE)
 
     def op_pc_gap(self) -> int:
         if self.is_push():
@@ -109,79 +80,57 @@ class OpCode:
 
     def is_push(self) -> bool:
         """Predicate: opcode is a push operation."""
-        return PUSH1.code <= self.code <= PUSH32.code
+        return bool(self.flags & IS_PUSH)
 
     def is_swap(self) -> bool:
         """Predicate: opcode is a swap operation."""
-        return SWAP1.code <= self.code <= SWAP16.code
+        return bool(self.flags & IS_SWAP)
 
     def is_dup(self) -> bool:
         """Predicate: opcode is a dup operation."""
-        return DUP1.code <= self.code <= DUP16.code
+        return bool(self.flags & IS_DUP)
 
     def is_log(self) -> bool:
         """Predicate: opcode is a log operation."""
-        return LOG0.code <= self.code <= LOG4.code
+        return bool(self.flags & IS_LOG)
 
     def is_missing(self) -> bool:
-        return self.code not in BYTECODES
+        return bool(self.flags & IS_MISSING)
 
     def is_invalid(self) -> bool:
-        return (self.code == INVALID.code) or self.is_missing()
+        return bool(self.flags & IS_INVALID)
 
     def is_arithmetic(self) -> bool:
         """Predicate: opcode's result can be calculated from its inputs alone."""
-        return (ADD.code <= self.code <= SIGNEXTEND.code) or (
-            LT.code <= self.code <= BYTE.code
-        )
+        return bool(self.flags & IS_ARITHMETIC)
 
     def is_memory(self) -> bool:
         """Predicate: opcode operates on memory"""
-        return MLOAD.code <= self.code <= MSTORE8.code
+        return bool(self.flags & IS_MEMORY)
 
     def is_storage(self) -> bool:
         """Predicate: opcode operates on storage ('the tape')"""
-        return SLOAD.code <= self.code <= SSTORE.code
+        return bool(self.flags & IS_STORAGE)
 
     def is_call(self) -> bool:
         """Predicate: opcode calls an external contract"""
-        return self in (
-            CALL,
-            CALLCODE,
-            DELEGATECALL,
-            STATICCALL,
-        )
+        return bool(self.flags & IS_CALL)
 
     def alters_flow(self) -> bool:
         """Predicate: opcode alters EVM control flow."""
-        return (
-            self.code
-            in (
-                JUMP.code,
-                JUMPI.code,
-            )
-        ) or self.possibly_halts()
+        return bool(self.flags & ALTERS_FLOW)
 
     def is_exception(self) -> bool:
         """Predicate: opcode causes the EVM to throw an exception."""
-        return (
-            self.code in (THROW.code, THROWI.code, REVERT.code)
-        ) or self.is_invalid()
+        return bool(self.flags & IS_EXCEPTION)
 
     def halts(self) -> bool:
         """Predicate: opcode causes the EVM to halt."""
-        halt_codes = (
-            STOP.code,
-            RETURN.code,
-            SELFDESTRUCT.code,
-            THROW.code,
-            REVERT.code,
-        )
-        return (self.code in halt_codes) or self.is_invalid()
+        return bool(self.flags & HALTS)
 
     def possibly_halts(self) -> bool:
         """Predicate: opcode MAY cause the EVM to halt. (halts + THROWI)"""
-        return self.halts() or self.code == THROWI.code
+        return bool(self.flags & POSSIBLY_HALTS)
 
     def push_len(self) -> int:
         """Return the number of bytes the given PUSH instruction pushes."""
@@ -192,6 +141,32 @@ class OpCode:
         return self.code - LOG0.code if self.is_log() else 0
 
 
+# Flag bits of OpCode.flags, one per predicate
+(
+    IS_KIND_ONE,
+    IS_KIND_TWO,
+    IS_KIND_THREE_LOAD,
+    IS_KIND_THREE_STORE_ONE,
+    IS_KIND_THREE_STORE_TWO,
+    IS_KIND_FOUR,
+    IS_KIND_FIVE,
+    IS_PUSH,
+    IS_SWAP,
+    IS_DUP,
+    IS_LOG,
+    IS_MISSING,
+    IS_INVALID,
+    IS_ARITHMETIC,
+    IS_MEMORY,
+    IS_STORAGE,
+    IS_CALL,
+    ALTERS_FLOW,
+    IS_EXCEPTION,
+    HALTS,
+    POSSIBLY_HALTS,
+) = (1 << i for i in range(21))
+
+
 # Construct all EVM opcodes
 # Arithmetic Ops and STOP
 STOP = OpCode("STOP", 0x00, 0, 0)
@@ -368,6 +343,103 @@ BYTECODES = {code.code: code for code in OPCODES.values()}
 """Dictionary mapping of byte values to EVM OpCode objects"""
 
 
+
+def _classify(opcode: OpCode) -> int:
+    """The flags of an opcode, i.e. which of the OpCode predicates hold"""
+    code = opcode.code
+    flags = 0
+
+    for names, flag in (
+        (_KIND_ONE, IS_KIND_ONE),
+        (_KIND_TWO, IS_KIND_TWO),
+        (_KIND_THREE_LOAD, IS_KIND_THREE_LOAD),
+        (_KIND_THREE_STORE_ONE, IS_KIND_THREE_STORE_ONE),
+        (_KIND_THREE_STORE_TWO, IS_KIND_THREE_STORE_TWO),
+        (_KIND_FOUR, IS_KIND_FOUR),
+        (_KIND_FIVE, IS_KIND_FIVE),
+    ):
+        if opcode.name in names:
+            flags |= flag
+
+    for low, high, flag in (
+        (PUSH1, PUSH32, IS_PUSH),
+        (SWAP1, SWAP16, IS_SWAP),
+        (DUP1, DUP16, IS_DUP),
+        (LOG0, LOG4, IS_LOG),
+        (ADD, SIGNEXTEND, IS_ARITHMETIC),
+        (LT, BYTE, IS_ARITHMETIC),
+        (MLOAD, MSTORE8, IS_MEMORY),
+        (SLOAD, SSTORE, IS_STORAGE),
+    ):
+        if low.code <= code <= high.code:
+            flags |= flag
+
+    if code not in BYTECODES:
+        flags |= IS_MISSING
+    if code == INVALID.code or flags & IS_MISSING:
+        flags |= IS_INVALID
+    if code in (CALL.code, CALLCODE.code, DELEGATECALL.code, STATICCALL.code):
+        flags |= IS_CALL
+    if code in (THROW.code, THROWI.code, REVERT.code) or flags & IS_INVALID:
+        flags |= IS_EXCEPTION
+    if code in (STOP.code, RETURN.code, SELFDESTRUCT.code, THROW.code, REVERT.code) or flags & IS_INVALID:
+        flags |= HALTS
+    if flags & HALTS or code == THROWI.code:
+        flags |= POSSIBLY_HALTS
+    if code in (JUMP.code, JUMPI.code) or flags & POSSIBLY_HALTS:
+        flags |= ALTERS_FLOW
+
+    return flags
+
+
+_KIND_ONE = frozenset(
+    op.name
+    for op in (
+        ADDRESS,
+        ORIGIN,
+        CALLER,
+        CALLVALUE,
+        CALLDATASIZE,
+        CODESIZE,
+        GASPRICE,
+        RETURNDATASIZE,
+        COINBASE,
+        TIMESTAMP,
+        NUMBER,
+        DIFFICULTY,
+        GASLIMIT,
+        PC,
+        MSIZE,
+        GAS,
+    )
+)
+_KIND_TWO = frozenset(op.name for op in (SHA3, BALANCE, CALLDATALOAD, EXTCODESIZE, BLOCKHASH))
+_KIND_THREE_LOAD = frozenset({SLOAD.name})
+_KIND_THREE_STORE_ONE = frozenset(op.name for op in (MSTORE, MSTORE8, SSTORE))
+_KIND_THREE_STORE_TWO = frozenset(
+    op.name for op in (CALLDATACOPY, CODECOPY, EXTCODECOPY, RETURNDATACOPY)
+)
+_KIND_FOUR = frozenset(op.name for op in (CALL, CALLCODE, DELEGATECALL, STATICCALL))
+_KIND_FIVE = frozenset(op.name for op in (CREATE, CREATE2))
+
+for _opcode in OPCODES.values():
+    _opcode.flags = _classify(_opcode)
+
+# Per byte value lookup tables, for classifying instructions by their
+# value alone. Bytes that are not opcodes get the properties of
+# missing_opcode, and None in BY_VALUE
+BY_VALUE = [BYTECODES.get(code) for code in range(256)]
+"""List mapping byte values to EVM OpCode objects"""
+
+FLAGS = [
+    opcode.flags if opcode is not None else _classify(OpCode("MISSING", code, 0, 0))
+    for code, opcode in enumerate(BY_VALUE)
+]
+POP_COUNTS = [opcode.pop if opcode is not None else 0 for opcode in BY_VALUE]
+PUSH_COUNTS = [opcode.push if opcode is not None else 0 for opcode in BY_VALUE]
+PC_GAPS = [opcode.op_pc_gap() if opcode is not None else 1 for opcode in BY_VALUE]
+
+
 def opcode_by_name(name: str) -> OpCode:
     """
     Mapping: Retrieves the named OpCode object (case-insensitive).
@@ -386,9 +458,10 @@ def opcode_by_value(val: int) -> OpCode:
     Throws:
       LookupError: if there is no opcode defined with the given value.
     """
-    if val not in BYTECODES:
+    opcode = BY_VALUE[val] if 0 <= val < 256 else BYTECODES.get(val)
+    if opcode is None:
         raise LookupError("No opcode with value '0x{:02X}'.".format(val))
-    return BYTECODES[val]
+    return opcode
 
 
 def missing_opcode(val: int) -> OpCode:
@@ -400,4 +473,6 @@ def missing_opcode(val: int) -> OpCode:
     """
     if val in BYTECODES:
         raise ValueError("Opcode {} exists.")
-    return OpCode("MISSING", val, 0, 0)
+    opcode = OpCode("MISSING", val, 0, 0)
+    opcode.flags = _classify(opcode)
+    return opcode
@@ -41,6 +41,7 @@ import pyanalyze.vandal.memtypes as mem
 import pyanalyze.vandal.opcodes as opcodes
 import pyanalyze.vandal.patterns as patterns
 import pyanalyze.vandal.settings as settings
+import pyanalyze.vandal.tracefile as tracefile
 from pyanalyze.vandal.lattice import SubsetLatticeElement as ssle
 
 import sys
@@ -55,6 +56,13 @@ trim_0x_to_int = lambda x: (
 )
 
 
+def arg_to_int(arg: "TACArg") -> int:
+    """trim_0x_to_int of an arg, without printing and parsing it back when
+    it is constant"""
+    value = arg.value.const_value
+    return value if value is not None else trim_0x_to_int(arg)
+
+
 class TACGraph(cfg.ControlFlowGraph):
     """
     A control flow graph holding Three-Address Code blocks and
@@ -101,7 +109,12 @@ class TACGraph(cfg.ControlFlowGraph):
         """
 
         self.stack = defaultdict(dict)
-        self.memory = bytearray()
+
+        self.memory = mem.TraceMemory()
+        """The memory of every call frame, as written by the ops of this graph."""
+
+        self.storage = mem.StorageIndex(to_addr)
+        """Every SLOAD and SSTORE of this graph, by address and slot."""
 
         # Propagate constants and add CFG edges.
         self.apply_operations()
@@ -117,32 +130,18 @@ class TACGraph(cfg.ControlFlowGraph):
         Construct and return a TACGraph from the given Geth optrace.
 
         Args:
-          trace: result from debug_traceVandalTransaction. JSON formatted
+          trace: result from debug_traceVandalTransaction. JSON formatted, or
+            a tracefile.BinaryTrace
         """
 
-        ops = []
+        # JSON traces are decoded into columns in bulk, which parses each
+        # distinct ret/extra word once instead of once per op
+        if not isinstance(trace, tracefile.BinaryTrace):
+            trace = tracefile.BinaryTrace.from_dict(trace)
 
-        to = trace["To"]
+        ops = evm_cfg.ops_from_trace(trace)
 
-        for op in trace["Ops"]:
-            pc = op["pc"]
-            op_index = op["opIndex"]
-            opcode = opcodes.opcode_by_value(op["op"])
-
-            if "ret" in op and len(op["ret"]) > 0:
-                value = int(op["ret"], 16)
-            else:
-                value = 0
-            if "extra" in op and len(op["extra"]) > 0:
-                extra = int(op["extra"], 16)
-            else:
-                extra = None
-
-            ops.append(
-                evm_cfg.EVMOp(pc, opcode, value=value, op_index=op_index, extra=extra)
-            )
-
-        return cls(evm_cfg.blocks_from_ops(ops), to)
+        return cls(evm_cfg.blocks_from_ops(ops, trace.pc, trace.op), trace["To"])
 
     @property
     def tac_ops(self):
@@ -179,8 +178,13 @@ class TACGraph(cfg.ControlFlowGraph):
         possess multiple possible values, performing operations in all possible
         combinations of values.
         """
+        # memory and storage keep every access, so they are rebuilt rather
+        # than written again
+        self.memory = mem.TraceMemory()
+        self.storage = mem.StorageIndex(self.sc_addr)
+
         for block in self.blocks:
-            block.apply_operations(self.stack, self.memory, use_sets)
+            block.apply_operations(self.stack, self.memory, use_sets, self.storage)
 
     def resolve_addresses(self) -> None:
         """
@@ -350,7 +354,11 @@ class TACBasicBlock(evm_cfg.EVMBasicBlock):
                     site.block = self
 
     def apply_operations(
-        self, stack: defaultdict(dict) = None, memory: bytearray = None, use_sets=False
+        self,
+        stack: defaultdict(dict) = None,
+        memory: mem.TraceMemory = None,
+        use_sets=False,
+        storage: mem.StorageIndex = None,
     ) -> None:
         """
         Propagate and fold constants through the arithmetic TAC instructions
@@ -359,55 +367,86 @@ class TACBasicBlock(evm_cfg.EVMBasicBlock):
         If use_sets is True, folding will also be done on Variables that
         possess multiple possible values, performing operations in all possible
         combinations of values.
+
+        Memory writes are recorded in the memory of the block's call frame,
+        and storage accesses in storage if set, so the blocks of a trace must
+        be applied in order.
         """
+        if memory is None:
+            memory = mem.TraceMemory()
+
+        frame = None
+        if self.evm_ops:
+            first = self.evm_ops[0]
+            frame = memory.enter(first.op_index, first.depth, first.pc == 0, first.call_index)
+
         for op in self.tac_ops:
-            if op.opcode == opcodes.CONST:
+            code = op.opcode.code
+            flags = op.opcode.flags
+
+            if storage is not None:
+                if code == opcodes.SLOAD.code:
+                    storage.load(
+                        op.op_index, op.depth, op.args[0].value.const_value, op.lhs.const_value
+                    )
+                elif code == opcodes.SSTORE.code:
+                    storage.store(
+                        op.op_index,
+                        op.depth,
+                        op.args[0].value.const_value,
+                        op.args[1].value.const_value,
+                    )
+                elif flags & opcodes.IS_CALL and op.args[1].value.is_const:
+                    storage.call(
+                        op.depth,
+                        op.args[1].value.const_value,
+                        code in (opcodes.DELEGATECALL.code, opcodes.CALLCODE.code),
+                    )
+
+            if code == opcodes.CONST.code:
                 op.lhs.values = op.args[0].value.values
 
             # Special cases: they both belong to three_store_two.
             elif (
-                op.opcode == opcodes.CALLDATACOPY
-                or op.opcode == opcodes.CODECOPY
-                or op.opcode == opcodes.RETURNDATACOPY
+                code == opcodes.CALLDATACOPY.code
+                or code == opcodes.CODECOPY.code
+                or code == opcodes.RETURNDATACOPY.code
             ):
-                destoffset = trim_0x_to_int(op.args[0])
-                length = trim_0x_to_int(op.args[2])
+                destoffset = arg_to_int(op.args[0])
+                length = arg_to_int(op.args[2])
                 value = op.value
-                memory[destoffset : destoffset + length] = value.to_bytes(
-                    length, byteorder="big"
-                )
-            elif op.opcode == opcodes.EXTCODECOPY:
-                destoffset = trim_0x_to_int(op.args[1])
-                length = trim_0x_to_int(op.args[3])
+                frame.write(destoffset, value.to_bytes(length, byteorder="big"), op.op_index)
+            elif code == opcodes.EXTCODECOPY.code:
+                destoffset = arg_to_int(op.args[1])
+                length = arg_to_int(op.args[3])
                 value = op.value
-                memory[destoffset : destoffset + length] = value.to_bytes(
-                    length, byteorder="big"
-                )
+                frame.write(destoffset, value.to_bytes(length, byteorder="big"), op.op_index)
 
             # Special cases: cases for kind one and two, but those opcodes are not in three_store
             # Those opcodes have already had their value assigned to the lhs in the __handal_evm_op
-            elif op.opcode.is_kind_one() or op.opcode.is_kind_two():
+            elif flags & (opcodes.IS_KIND_ONE | opcodes.IS_KIND_TWO):
                 continue
 
             # Special cases: SLOAD and MLOAD get their value from the geth, and these values have been assigned
-            elif op.opcode == opcodes.MLOAD or op.opcode == opcodes.SLOAD:
+            elif code == opcodes.MLOAD.code or code == opcodes.SLOAD.code:
                 continue
 
             # Special cases: SSTORE and MSTORE. Store variable values to the related storage and memory
-            elif op.opcode == opcodes.SSTORE:
+            elif code == opcodes.SSTORE.code:
                 var_name = "S[{}]".format(op.args[0])
                 var_value = op.args[1].value.values
                 stack[var_name] = var_value
-            elif op.opcode == opcodes.MSTORE:
-                offset = trim_0x_to_int(op.args[0])
-                value = trim_0x_to_int(op.args[1])
-                memory[offset : offset + 32] = value.to_bytes(32, byteorder="big")
-            elif op.opcode == opcodes.MSTORE8:
-                offset = trim_0x_to_int(op.args[0])
-                value = trim_0x_to_int(op.args[1])
-                memory[offset : offset + 1] = value.to_bytes(8, byteorder="big")
-
-            elif op.opcode.is_arithmetic():
+            elif code == opcodes.MSTORE.code:
+                offset = arg_to_int(op.args[0])
+                value = arg_to_int(op.args[1])
+                frame.write(offset, value.to_bytes(32, byteorder="big"), op.op_index)
+            elif code == opcodes.MSTORE8.code:
+                offset = arg_to_int(op.args[0])
+                value = arg_to_int(op.args[1])
+                # only the low byte is stored
+                frame.write(offset, (value & 0xFF).to_bytes(1, "big"), op.op_index)
+
+            elif flags & opcodes.IS_ARITHMETIC:
                 if op.constant_args() or (op.constrained_args() and use_sets):
                     rhs = [arg.value for arg in op.args]
                     op.lhs.values = mem.Variable.arith_op(op.opcode.name, rhs).values
@@ -423,6 +462,9 @@ class TACOp(patterns.Visitable):
     of the EVM instruction it was derived from.
     """
 
+    # one per op of a trace, so no per-instance __dict__
+    __slots__ = ("opcode", "args", "pc", "block", "value", "op_index", "call_index", "depth")
+
     def __init__(
         self,
         opcode: opcodes.OpCode,
@@ -511,6 +553,8 @@ class TACAssignOp(TACOp):
     this operation's result is implicitly bound.
     """
 
+    __slots__ = ("lhs", "print_name", "value_extra")
+
     def __init__(
         self,
         lhs: mem.Variable,
@@ -587,6 +631,8 @@ class TACArg:
     of a TACBasicBlock.
     """
 
+    __slots__ = ("var", "stack_var")
+
     def __init__(self, var: mem.Variable = None, stack_var: mem.MetaVariable = None):
         self.var = var
         """The actual variable this arg contains."""
@@ -620,6 +666,8 @@ class TACArg:
 class TACLocRef:
     """Contains a reference to a program counter within a particular block."""
 
+    __slots__ = ("block", "pc")
+
     def __init__(self, block, pc):
         self.block = block
         """The block that contains the referenced instruction."""
@@ -761,11 +809,13 @@ class Destackifier:
         needful way.
         """
 
-        if op.opcode.is_swap():
+        flags = op.opcode.flags
+
+        if flags & opcodes.IS_SWAP:
             self.stack.swap(op.opcode.pop)
-        elif op.opcode.is_dup():
+        elif flags & opcodes.IS_DUP:
             self.stack.dup(op.opcode.pop)
-        elif op.opcode == opcodes.POP:
+        elif op.opcode.code == opcodes.POP.code:
             self.stack.pop()
         else:
             self.__gen_instruction(op)
@@ -787,23 +837,26 @@ class Destackifier:
             for site in new_var.def_sites:
                 site.pc = op.pc
 
+        code = op.opcode.code
+        flags = op.opcode.flags
+
         # Generate the appropriate TAC operation.
         # Special cases first, followed by the fallback to generic instructions.
-        if op.opcode.is_push():
+        if flags & opcodes.IS_PUSH:
             args = [TACArg(var=mem.Variable(values=[op.value], name="C"))]
             inst = TACAssignOp(new_var, opcodes.CONST, args, op.pc, print_name=False)
-        elif op.opcode.is_missing():
+        elif flags & opcodes.IS_MISSING:
             args = [TACArg(var=mem.Variable(values=[op.value], name="C"))]
             inst = TACOp(op.opcode, args, op.pc)
-        elif op.opcode.is_log():
+        elif flags & opcodes.IS_LOG:
             args = [TACArg.from_var(var) for var in self.stack.pop_many(op.opcode.pop)]
             inst = TACOp(opcodes.LOG, args, op.pc)
-        elif op.opcode == opcodes.MSTORE:
+        elif code == opcodes.MSTORE.code:
             args = [
                 TACArg.from_var(var) for var in self.stack.pop_many(opcodes.MSTORE.pop)
             ]
             inst = TACOp(op.opcode, args, op.pc)
-        elif op.opcode == opcodes.MSTORE8:
+        elif code == opcodes.MSTORE8.code:
             args = [
                 TACArg.from_var(var) for var in self.stack.pop_many(opcodes.MSTORE8.pop)
             ]
@@ -812,11 +865,11 @@ class Destackifier:
 
         # SLOAD is same as MLOAD, they both hasve value in the tempt file
         # We will assign the real value to the storage variable
-        elif op.opcode == opcodes.SLOAD or op.opcode == opcodes.MLOAD:
+        elif code == opcodes.SLOAD.code or code == opcodes.MLOAD.code:
             new_var = mem.Variable(values=[op.value], name=new_var.name)
             args = [TACArg.from_var(self.stack.pop())]
             inst = TACAssignOp(new_var, op.opcode, args, op.pc)
-        elif op.opcode == opcodes.SSTORE:
+        elif code == opcodes.SSTORE.code:
             args = [
                 TACArg.from_var(var) for var in self.stack.pop_many(opcodes.SSTORE.pop)
             ]
@@ -826,7 +879,7 @@ class Destackifier:
         # For kind one, there are no arguments for the previous vandal, so the inst will be incomplete
         # For example, 0xa CALLVALUE 0x0 will be transalated into V4 =
         # Now we assign the real value to this opcode and keep its opcode
-        elif op.opcode.is_kind_one():
+        elif flags & opcodes.IS_KIND_ONE:
             new_var = mem.Variable(values=[op.value], name=new_var.name)
             args = []
             inst = TACAssignOp(new_var, op.opcode, args, op.pc, print_name=False)
@@ -834,23 +887,23 @@ class Destackifier:
         # Special cases for kind two, such as CALLDATALOAD
         # Args have all the stack arguments, those information (stack arguments) are useless
         # Since we just get the values from geth, not using them.
-        elif op.opcode.is_kind_two():
+        elif flags & opcodes.IS_KIND_TWO:
             new_var = mem.Variable(values=[op.value], name=new_var.name)
             args = [TACArg.from_var(var) for var in self.stack.pop_many(op.opcode.pop)]
             inst = TACAssignOp(new_var, op.opcode, args, op.pc, print_name=False)
 
         # Special cases for kind three store two, such as CALLDATACOPY
         # There are multiple arguments in this kind of opcodes
-        elif op.opcode.is_kind_three_store_two():
+        elif flags & opcodes.IS_KIND_THREE_STORE_TWO:
             args = [TACArg.from_var(var) for var in self.stack.pop_many(op.opcode.pop)]
             inst = TACOp(op.opcode, args, op.pc, None, op.value)
-        elif op.opcode.is_kind_four():
+        elif flags & opcodes.IS_KIND_FOUR:
             # op.value is success flag, value_extra is the memory content.
             new_var = mem.Variable(values=[op.value], name=new_var.name)
             args = [TACArg.from_var(var) for var in self.stack.pop_many(op.opcode.pop)]
             inst = TACAssignOp(new_var, op.opcode, args, op.pc, None, True, op.extra)
 
-        elif op.opcode.is_kind_five():
+        elif flags & opcodes.IS_KIND_FIVE:
             new_var = mem.Variable(values=[op.value], name=new_var.name)
             args = [TACArg.from_var(var) for var in self.stack.pop_many(op.opcode.pop)]
             inst = TACAssignOp(new_var, op.opcode, args, op.pc, None, True, None)
@@ -0,0 +1,246 @@
+"""tracefile.py: Compact binary encoding of debug_traceVandalTransaction traces."""
+
+from array import array
+import struct
+import typing as t
+
+import numpy as np
+
+MAGIC = b"VTRC"
+VERSION = 1
+
+# magic, version, n_ops, n_words, len(To), len(word blob)
+HEADER = struct.Struct("<4sHxxQQII")
+
+# ret/extra references for ops without a value
+NO_WORD = -1
+
+
+def _align(offset: int, size: int) -> int:
+    return (offset + size - 1) // size * size
+
+
+class BinaryTrace:
+    """
+    A Vandal trace stored as fixed-width columns.
+
+    pc, op and opIndex are stored as one array each. The ret and extra words
+    of every op are references into a table of distinct words, kept as one
+    blob of minimal-length big-endian integers plus offsets, since most
+    traces repeat the same few stack values many times.
+
+    The columns can be views onto a memory-mapped file (see from_buffer), in
+    which case only the word blob is copied until the ops are decoded.
+
+    Supports the keys of the JSON trace ("To", "Ops", "tx_hash") so it can be
+    passed anywhere a trace dict is expected.
+    """
+
+    def __init__(
+        self,
+        to: str,
+        pc: np.ndarray,
+        op: np.ndarray,
+        op_index: np.ndarray,
+        ret: np.ndarray,
+        extra: np.ndarray,
+        word_offsets: np.ndarray,
+        words: bytes,
+        tx_hash: str = None,
+    ):
+        self.to = to
+        self.pc = pc
+        self.op = op
+        self.op_index = op_index
+        self.ret = ret
+        self.extra = extra
+        self.word_offsets = word_offsets
+        self.words = words
+        self.tx_hash = tx_hash
+
+    def __len__(self):
+        return len(self.pc)
+
+    def __getitem__(self, key: str):
+        if key == "To":
+            return self.to
+        if key == "Ops":
+            return self.to_ops()
+        if key == "tx_hash":
+            return self.tx_hash
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value):
+        if key != "tx_hash":
+            raise KeyError(key)
+        self.tx_hash = value
+
+    def __contains__(self, key: str) -> bool:
+        return key in ("To", "Ops") or (key == "tx_hash" and self.tx_hash is not None)
+
+    @classmethod
+    def from_dict(cls, trace: dict) -> "BinaryTrace":
+        """Encode a trace as returned by debug_traceVandalTransaction"""
+        builder = BinaryTraceBuilder()
+        builder.extend(trace["Ops"] or [])
+        return builder.build(trace["To"], trace.get("tx_hash"))
+
+    def to_bytes(self) -> bytes:
+        to = (self.to or "").encode()
+        n, n_words = len(self), len(self.word_offsets) - 1
+
+        parts = [HEADER.pack(MAGIC, VERSION, n, n_words, len(to), len(self.words)), to]
+        offset = HEADER.size + len(to)
+
+        for array in self._columns():
+            aligned = _align(offset, array.itemsize)
+            parts.append(b"\0" * (aligned - offset))
+            parts.append(array.tobytes())
+            offset = aligned + array.nbytes
+
+        parts.append(self.words)
+
+        return b"".join(parts)
+
+    @classmethod
+    def from_buffer(cls, buffer, tx_hash: str = None) -> "BinaryTrace":
+        """Decode a trace from bytes or a memory map without copying the
+        columns"""
+        magic, version, n, n_words, to_len, words_len = HEADER.unpack_from(buffer, 0)
+
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a version {VERSION} binary trace")
+
+        offset = HEADER.size
+        to = bytes(buffer[offset : offset + to_len]).decode() or None
+        offset += to_len
+
+        columns = []
+        for dtype, count in (
+            (np.int64, n),
+            (np.uint32, n),
+            (np.int32, n),
+            (np.int32, n),
+            (np.uint32, n_words + 1),
+            (np.uint8, n),
+        ):
+            offset = _align(offset, np.dtype(dtype).itemsize)
+            columns.append(np.frombuffer(buffer, dtype=dtype, count=count, offset=offset))
+            offset += columns[-1].nbytes
+
+        op_index, pc, ret, extra, word_offsets, op = columns
+        words = bytes(buffer[offset : offset + words_len])
+
+        return cls(to, pc, op, op_index, ret, extra, word_offsets, words, tx_hash)
+
+    def _columns(self) -> list[np.ndarray]:
+        # widest first so every column is naturally aligned
+        return [
+            np.ascontiguousarray(self.op_index, dtype=np.int64),
+            np.ascontiguousarray(self.pc, dtype=np.uint32),
+            np.ascontiguousarray(self.ret, dtype=np.int32),
+            np.ascontiguousarray(self.extra, dtype=np.int32),
+            np.ascontiguousarray(self.word_offsets, dtype=np.uint32),
+            np.ascontiguousarray(self.op, dtype=np.uint8),
+        ]
+
+    def word_values(self) -> list[int]:
+        """Integer value of every distinct word"""
+        offsets = self.word_offsets.tolist()
+
+        return [
+            int.from_bytes(self.words[offsets[i] : offsets[i + 1]], "big")
+            for i in range(len(offsets) - 1)
+        ]
+
+    def rows(self) -> t.Iterator[t.Tuple[int, int, int, int, t.Optional[int]]]:
+        """
+        Yield (pc, op, op_index, value, extra) per op, decoded the same way
+        TACGraph.from_geth decodes a JSON trace: a missing ret is 0 and a
+        missing extra is None.
+        """
+        # NO_WORD indexes the trailing None
+        values = self.word_values() + [None]
+
+        for pc, op, op_index, ret, extra in zip(
+            self.pc.tolist(),
+            self.op.tolist(),
+            self.op_index.tolist(),
+            self.ret.tolist(),
+            self.extra.tolist(),
+        ):
+            yield pc, op, op_index, values[ret] if ret != NO_WORD else 0, values[extra]
+
+    def to_ops(self) -> t.List[dict]:
+        """Decode into the JSON trace "Ops" list"""
+        return [
+            {
+                "pc": pc,
+                "op": op,
+                "opIndex": op_index,
+                "ret": hex(value),
+                "extra": hex(extra) if extra is not None else "",
+            }
+            for pc, op, op_index, value, extra in self.rows()
+        ]
+
+
+class BinaryTraceBuilder:
+    """
+    Encodes ops into a BinaryTrace as they arrive, so the ops of a trace
+    never have to be held as dicts all at once (see tracestream).
+    """
+
+    def __init__(self):
+        self.pc = array("I")
+        self.op = array("B")
+        self.op_index = array("q")
+        self.ret = array("i")
+        self.extra = array("i")
+
+        # hex strings are only parsed once per distinct string, and a
+        # missing or empty word maps to NO_WORD
+        self.word_ids: dict[str, int] = {"": NO_WORD}
+        self.words: list[bytes] = []
+
+    def __len__(self):
+        return len(self.pc)
+
+    def _add_word(self, hex_value: str) -> int:
+        value = int(hex_value, 16)
+        self.word_ids[hex_value] = len(self.words)
+        self.words.append(value.to_bytes((value.bit_length() + 7) // 8, "big"))
+        return self.word_ids[hex_value]
+
+    def extend(self, ops: t.List[dict]):
+        """Append ops, as found in the "Ops" list of a JSON trace"""
+        word_ids = self.word_ids
+        add_word = self._add_word
+
+        self.pc.extend([o["pc"] for o in ops])
+        self.op.extend([o["op"] for o in ops])
+        self.op_index.extend([o["opIndex"] for o in ops])
+
+        for column, key in ((self.ret, "ret"), (self.extra, "extra")):
+            values = [o.get(key, "") for o in ops]
+            column.extend([
+                word_ids[v] if v in word_ids else add_word(v) for v in values
+            ])
+
+    def build(self, to: str, tx_hash: str = None) -> BinaryTrace:
+        word_offsets = np.zeros((len(self.words) + 1,), dtype=np.uint32)
+        np.cumsum([len(w) for w in self.words], out=word_offsets[1:])
+
+        # the columns share memory with the arrays, which are not touched
+        # again
+        return BinaryTrace(
+            to,
+            np.frombuffer(self.pc, dtype=np.uint32),
+            np.frombuffer(self.op, dtype=np.uint8),
+            np.frombuffer(self.op_index, dtype=np.int64),
+            np.frombuffer(self.ret, dtype=np.int32),
+            np.frombuffer(self.extra, dtype=np.int32),
+            word_offsets,
+            b"".join(self.words),
+            tx_hash,
+        )
@@ -0,0 +1,164 @@
+from pyanalyze.api.metaoploader import MetaOpLoader
+from pyanalyze.api.metaopview import MetaOpResults
+from pyanalyze.heuristics.heuristics import BaseHeuristic
+from pyanalyze.tracesummary import TraceSummary
+from pyanalyze.vandal.tracefile import BinaryTrace
+from pyanalyze.budget import Budget, BudgetExceeded
+from pyanalyze import metrics
+from logging import getLogger
+import signal
+
+logger = getLogger(__name__)
+
+# per-process heuristic instances and budget, set by init_worker
+_heuristics: list[BaseHeuristic] = []
+_budget: Budget = None
+
+
+@metrics.timed("analyze.total")
+def analyze(
+    tx: dict,
+    heuristics: list[BaseHeuristic],
+    budget: Budget = None,
+    shallow: bool = False,
+    defer: bool = False,
+) -> list[bool]:
+    """
+    Run every heuristic that may match tx. Returns which heuristics ran;
+    the others, and all of them if tx could not be loaded, have no
+    results.
+
+    With a budget, a trace over the op or variable limit is only analyzed
+    at call depth 1, as is every trace if shallow is set. Running out of
+    time or links raises BudgetExceeded if defer is set, so the caller can
+    rerun the transaction shallow later. Otherwise, and when shallow, the
+    heuristics cut short have no results, and a trace still over the
+    variable limit at depth 1 is skipped.
+
+    A heuristic that fails has no results, and the others still run.
+    """
+    for heuristic in heuristics:
+        heuristic.results = None
+
+    metrics.count("analyze.transactions")
+
+    # the time budget also covers decoding and the prefilter
+    meter = budget.meter() if budget is not None and budget.is_limited() else None
+
+    # decoded once for the prefilter and the loader
+    if not isinstance(tx, BinaryTrace):
+        with metrics.timer("analyze.decode"):
+            tx = BinaryTrace.from_dict(tx)
+
+    metrics.observe("analyze.trace_ops", len(tx), metrics.SIZE_BUCKETS)
+
+    with metrics.timer("analyze.prefilter"):
+        summary = TraceSummary.from_trace(tx)
+        ran = [heuristic.may_match(summary) for heuristic in heuristics]
+
+    for heuristic, may_match in zip(heuristics, ran):
+        if not may_match:
+            metrics.count(f"prefilter.skipped.{heuristic.name}")
+
+    if not any(ran):
+        metrics.count("prefilter.skipped_transactions")
+        return ran
+
+    # only the ops of heuristics that run are loaded
+    loader_ops = [
+        op
+        for heuristic, may_match in zip(heuristics, ran)
+        if may_match
+        for op in heuristic.REQUIRED_OPS
+    ]
+
+    if meter is not None and not shallow and budget.max_ops is not None and len(tx) > budget.max_ops:
+        shallow = _degrade(tx, "ops", budget.max_ops)
+
+    api = None
+    while api is None:
+        try:
+            # the heuristics only query MetaOps, so the TACGraph is skipped
+            with metrics.timer("analyze.load"):
+                api = MetaOpLoader.from_trace(tx, loader_ops, 1 if shallow else None, meter)
+        except OverflowError:
+            metrics.count("analyze.errors.overflow")
+            logger.error(f"Transaction {tx['tx_hash']} too large to analyze")
+            return ran
+        except BudgetExceeded as e:
+            if not shallow and e.resource == "variables":
+                shallow = _degrade(tx, e.resource, e.limit)
+                continue
+            if not shallow and defer:
+                raise
+
+            metrics.count("budget.skipped")
+            logger.warning(f"Skipping transaction {tx['tx_hash']}: {e}")
+            return ran
+
+    for heuristic, may_match in zip(heuristics, ran):
+        if may_match:
+            try:
+                with metrics.timer(f"heuristic.{heuristic.name}"):
+                    heuristic.analyze(api)
+            except BudgetExceeded as e:
+                heuristic.results = None
+                if not shallow and defer:
+                    raise
+
+                metrics.count(f"budget.aborted.{heuristic.name}")
+                logger.warning(f"{heuristic.name} cut short on {tx['tx_hash']}: {e}")
+            except Exception as e:
+                # the other heuristics still run and keep their results
+                heuristic.results = None
+                metrics.count(f"heuristic.errors.{heuristic.name}")
+                logger.error(f"{heuristic.name} failed on {tx['tx_hash']}: {e!r}")
+
+    return ran
+
+
+def _degrade(tx, resource: str, limit) -> bool:
+    metrics.count("budget.shallow")
+    logger.warning(
+        f"Transaction {tx['tx_hash']} is over the {resource} budget of {limit}, "
+        "only analyzing depth 1"
+    )
+    return True
+
+
+def init_worker(
+    heuristic_classes: list[type], metrics_enabled: bool = False, budget: Budget = None
+):
+    global _budget
+
+    # the parent handles Ctrl-C and shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    _budget = budget
+
+    if metrics_enabled:
+        metrics.enable()
+
+    for heuristic_cls in heuristic_classes:
+        _heuristics.append(heuristic_cls())
+
+
+def analyze_tx(
+    tx: dict, shallow: bool = False, defer: bool = False
+) -> tuple[str, list[tuple[int, MetaOpResults]], list[bool], dict, bool]:
+    """Analyze a trace in a worker process (see analyze). Only the results
+    of vulnerable heuristics are returned, keyed by heuristic position and
+    detached from the def-use graph so they pickle compactly, along with
+    which heuristics ran, the metrics recorded since the last transaction
+    (None if metrics are disabled) and whether the transaction ran out of
+    budget and should be deferred"""
+    try:
+        ran = analyze(tx, _heuristics, _budget, shallow, defer)
+    except BudgetExceeded:
+        return tx["tx_hash"], [], None, metrics.drain(), True
+
+    return tx["tx_hash"], [
+        (i, heuristic.results.detached())
+        for i, heuristic in enumerate(_heuristics)
+        if heuristic.is_vulnerable()
+    ], ran, metrics.drain(), False
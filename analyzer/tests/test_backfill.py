@@ -0,0 +1,116 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+from pyanalyze.bench.synthetic import synthetic_trace
+from pyanalyze.checkpoint import CheckpointStore
+from pyanalyze.heuristics.reentrancy import Reentrancy
+from pyanalyze.manager import VandalManager
+from pyanalyze.replay import ReplayIPCServer
+from pyanalyze import worker
+
+# a backfill that hangs fails the test instead of the run
+TIMEOUT = 120
+
+
+@pytest.fixture
+def chain(tmp_path):
+    """A replayed node with blocks 0-4 of synthetic traces, one block
+    without transactions. Also returns the transactions Reentrancy flags"""
+    traces = {}
+    blocks = {}
+    for number in range(5):
+        blocks[number] = []
+        for i in range(2 if number != 3 else 0):
+            trace = synthetic_trace("small", 10 * number + i)
+            traces[trace["tx_hash"]] = trace
+            blocks[number].append(trace["tx_hash"])
+
+    ipc_path = str(tmp_path / "replay.ipc")
+    server = ReplayIPCServer(ipc_path, traces, blocks=blocks)
+
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    asyncio.run_coroutine_threadsafe(server.start(), loop).result(10)
+
+    vulnerable = []
+    for tx_hash, trace in traces.items():
+        heuristic = Reentrancy()
+        worker.analyze(dict(trace), [heuristic])
+        if heuristic.is_vulnerable():
+            vulnerable.append(tx_hash)
+    assert vulnerable
+
+    yield ipc_path, traces, vulnerable
+
+    asyncio.run_coroutine_threadsafe(server.stop(), loop).result(10)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(10)
+
+
+def run_backfill(manager: VandalManager, *args):
+    thread = threading.Thread(target=manager.run_backfill, args=args)
+    thread.start()
+    thread.join(TIMEOUT)
+
+    if thread.is_alive():
+        manager.stop()
+        thread.join(TIMEOUT)
+        pytest.fail("Backfill did not finish")
+
+
+@pytest.mark.parametrize("block_traces", [False, True])
+@pytest.mark.parametrize("to_files", [False, True])
+def test_backfill_completes_shards(chain, tmp_path, capsys, to_files, block_traces):
+    ipc_path, traces, vulnerable = chain
+    output_dir = None
+    if to_files:
+        output_dir = str(tmp_path / "output")
+        os.makedirs(output_dir)
+
+    checkpoint = str(tmp_path / "backfill.db")
+    manager = VandalManager(
+        ipc_path,
+        output_dir=output_dir,
+        checkpoint=checkpoint,
+        block_traces=block_traces,
+    )
+    manager.register_heuristic(Reentrancy())
+
+    run_backfill(manager, 0, 4, 2, 2, "test")
+
+    store = CheckpointStore(checkpoint)
+    assert store.shard_progress(0, 5) == (3, 3)
+    assert store.transaction_counts(0, 5) == (len(traces), len(traces))
+    assert store.pending_transactions() == []
+    assert all(store.is_block_complete(n) for n in range(5))
+
+    if to_files:
+        assert sorted(os.listdir(output_dir)) == sorted(
+            f"reentrancy-{tx_hash}.json" for tx_hash in vulnerable
+        )
+    else:
+        out = capsys.readouterr().out
+        assert out.count("Found vulnerable") == len(vulnerable)
+        assert all(f"Found vulnerable: {tx_hash}" in out for tx_hash in vulnerable)
+
+
+def test_failed_exports_still_complete_shards(chain, tmp_path):
+    ipc_path, traces, _ = chain
+    checkpoint = str(tmp_path / "backfill.db")
+    manager = VandalManager(ipc_path, output_dir=None, checkpoint=checkpoint)
+    manager.register_heuristic(Reentrancy())
+
+    def export(tx_hash, heuristics=None):
+        raise OSError("disk full")
+
+    manager.export_func = export
+
+    run_backfill(manager, 0, 4, 2, 2, "test")
+
+    store = CheckpointStore(checkpoint)
+    assert store.shard_progress(0, 5) == (3, 3)
+    assert store.transaction_counts(0, 5) == (len(traces), len(traces))
@@ -0,0 +1,132 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from pyanalyze import checkpoint
+from pyanalyze.checkpoint import CheckpointStore
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A settable clock in place of time.time for the store"""
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(checkpoint, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "checkpoint.db")
+
+
+def test_lease_expiry(path, clock):
+    store = CheckpointStore(path)
+    store.add_shards([(0, 10), (10, 20)])
+
+    assert store.claim_shard("a", lease=60) == (0, 10)
+    # a's lease holds, so b gets the next shard and then nothing
+    assert store.claim_shard("b", lease=60) == (10, 20)
+    clock.now += 59
+    assert store.claim_shard("c", lease=60) is None
+
+    # a renews, b does not, so only b's shard is claimed again once the
+    # leases are up
+    store.renew_shard(0, "a")
+    clock.now += 2
+    assert store.claim_shard("c", lease=60) == (10, 20)
+    assert store.claim_shard("d", lease=60) is None
+
+    # renew_shard only renews the owner's own claim
+    store.renew_shard(10, "a")
+    clock.now += 59
+    assert store.claim_shard("d", lease=60) == (0, 10)
+    assert store.claim_shard("e", lease=60) is None
+    clock.now += 2
+    assert store.claim_shard("e", lease=60) == (10, 20)
+
+
+def test_completed_shards_are_not_claimed_again(path, clock):
+    store = CheckpointStore(path)
+    store.add_shards([(0, 10)])
+
+    start, _ = store.claim_shard("a", lease=60)
+    store.complete_shard(start)
+    clock.now += 3600
+
+    assert store.claim_shard("a", lease=60) is None
+    assert store.claim_shard("b", lease=60) is None
+    assert store.shard_progress() == (1, 1)
+
+
+def test_competing_owners_claim_disjoint_shards(path):
+    shards = [(i, i + 1) for i in range(40)]
+    CheckpointStore(path).add_shards(shards)
+
+    claims = {}
+    barrier = threading.Barrier(4)
+
+    def work(owner):
+        # separate connections, as in separate processes
+        store = CheckpointStore(path)
+        barrier.wait()
+        while (shard := store.claim_shard(owner)) is not None:
+            claims.setdefault(shard, []).append(owner)
+            store.complete_shard(shard[0])
+        store.close()
+
+    threads = [threading.Thread(target=work, args=(f"owner-{i}",)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(claims) == shards
+    assert all(len(owners) == 1 for owners in claims.values())
+
+
+def test_two_owners_one_shard(path, clock):
+    first = CheckpointStore(path)
+    second = CheckpointStore(path)
+    first.add_shards([(0, 10)])
+
+    assert first.claim_shard("a", lease=60) == (0, 10)
+    assert second.claim_shard("b", lease=60) is None
+    # the owner of a claim gets it back
+    assert second.claim_shard("a", lease=60) == (0, 10)
+
+
+def test_resume_after_crash(path, clock):
+    store = CheckpointStore(path)
+    store.add_shards([(0, 10), (10, 20)])
+    assert store.claim_shard("worker-0", lease=60) == (0, 10)
+
+    store.add_block(0, ["0xa", "0xb", "0xc"])
+    store.add_block(1, ["0xd"])
+    store.add_block(2, [])
+    store.complete_tx("0xa")
+    store.complete_tx("0xd", "dropped")
+    # not closed: every write is already committed
+
+    store = CheckpointStore(path)
+    assert store.next_block(0, 10) == 3
+    assert store.pending_transactions(0, 10) == ["0xb", "0xc"]
+    assert store.transaction_counts(0, 10) == (2, 4)
+    assert not store.is_block_complete(0)
+    assert store.is_block_complete(1) and store.is_block_complete(2)
+
+    # the restarted owner resumes its shard before its lease is up, others
+    # do not take it
+    assert store.claim_shard("worker-1", lease=60) == (10, 20)
+    assert store.claim_shard("worker-0", lease=60) == (0, 10)
+
+    # fetching the block again keeps its progress
+    store.add_block(0, ["0xa", "0xb", "0xc"])
+    assert store.pending_transactions(0, 10) == ["0xb", "0xc"]
+
+    store.complete_tx("0xb")
+    store.complete_tx("0xb")
+    assert not store.is_block_complete(0)
+    store.complete_tx("0xc", "failed")
+    assert store.is_block_complete(0)
+    assert store.pending_transactions() == []
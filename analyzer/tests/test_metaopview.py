@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+from pyanalyze.api.metaop import JUMPI, SLOAD, SSTORE
+from pyanalyze.api.metaoploader import MetaOpLoader
+from pyanalyze.api.metaopfilter import DiscreteFilters, Filters, OpFilter
+from pyanalyze.api.querycache import QueryCache
+from pyanalyze.bench.synthetic import synthetic_trace
+
+# not planned, so filtering with it discards ops one at a time
+EVEN_OP_INDEX = OpFilter(operator=lambda op_index, _: op_index % 2 == 0, attribute="op_index")
+
+
+@pytest.fixture
+def loader():
+    return MetaOpLoader.from_trace(synthetic_trace("small", 0), [SLOAD, JUMPI, SSTORE])
+
+
+def cached(loader, op_name, filters=None):
+    return loader.query_cache.get(("get_ops", op_name, QueryCache.filters_key(filters)))
+
+
+def state(view):
+    """Working set and links of view, copied"""
+    links = {
+        (op.op_index, other.op_name): [link.op_index for link in link.links]
+        for op, op_links in view.links._dict.items()
+        for other, link in op_links.items()
+    }
+    return view.working_set.copy(), links, view.current_link
+
+
+def assert_state(view, expected):
+    working_set, links, current_link = state(view)
+    assert np.array_equal(working_set, expected[0])
+    assert links == expected[1]
+    assert current_link is expected[2]
+
+
+@pytest.mark.parametrize(
+    "filters",
+    [DiscreteFilters.depth_gt(2), EVEN_OP_INDEX, [EVEN_OP_INDEX, DiscreteFilters.depth_ne(3)]],
+)
+def test_filter_leaves_base_and_siblings(loader, filters):
+    first = loader.get_ops("SLOAD")
+    second = loader.get_ops("SLOAD")
+    base = cached(loader, "SLOAD")
+    before = state(base)
+
+    first.filter(filters)
+    assert first.working_set.sum() < before[0].sum()
+
+    assert_state(base, before)
+    assert_state(second, before)
+    assert_state(loader.ops["SLOAD"], before)
+    assert_state(loader.get_ops("SLOAD"), before)
+
+    # and the other way around
+    narrowed = state(first)
+    second.filter(EVEN_OP_INDEX)
+    assert_state(first, narrowed)
+    assert_state(base, before)
+
+
+def test_filtered_get_ops_is_shared_but_not_written(loader):
+    filters = DiscreteFilters.depth_gt(2)
+    first = loader.get_ops("SLOAD", filters=filters)
+    base = cached(loader, "SLOAD", filters)
+    before = state(base)
+
+    second = loader.get_ops("SLOAD", filters=filters)
+    assert_state(second, before)
+
+    first.filter(EVEN_OP_INDEX)
+    assert_state(base, before)
+    assert_state(second, before)
+
+
+def test_link_leaves_base_and_siblings(loader):
+    jumpi = loader.get_ops("JUMPI")
+    first = loader.get_ops("SLOAD")
+    second = loader.get_ops("SLOAD")
+    base = cached(loader, "SLOAD")
+    before = state(base)
+
+    first.link(jumpi, filters=[Filters.CallIndexEQ, Filters.DepthEQ])
+    linked = state(first)
+    assert linked[1] and linked[0].sum() < before[0].sum()
+
+    assert_state(base, before)
+    assert_state(second, before)
+
+    # the same link from a sibling is restored from the cache, sharing the
+    # working set of the first, which neither may then write
+    second.link(jumpi, filters=[Filters.CallIndexEQ, Filters.DepthEQ])
+    assert np.array_equal(second.working_set, linked[0])
+
+    second.filter(EVEN_OP_INDEX)
+    assert_state(first, linked)
+    assert_state(base, before)
+
+    first.link(loader.get_ops("SSTORE"), filters=[Filters.OpIndexLT])
+    first.filter(DiscreteFilters.depth_gt(3))
+
+    third = loader.get_ops("SLOAD")
+    assert_state(third, before)
+    third.link(jumpi, filters=[Filters.CallIndexEQ, Filters.DepthEQ])
+    assert np.array_equal(third.working_set, linked[0])
+    assert state(third)[1] == linked[1]
@@ -0,0 +1,100 @@
+import random
+from collections import deque
+
+import pytest
+
+from pyanalyze.api.metavariable import MetaVariable
+from pyanalyze.api.reachability import ReachabilityIndex
+
+
+def random_dag(seed: int) -> list[MetaVariable]:
+    """Variables in definition order, as the loader builds them: each one
+    uses some earlier variables, so the def-use graph is acyclic"""
+    r = random.Random(seed)
+    variables = []
+
+    for i in range(r.randint(2, 40)):
+        k = min(len(variables), r.choice([0, 1, 1, 2, 2, 3]))
+        parents = r.sample(variables, k)
+        var = MetaVariable(f"V{i}", i, parents)
+        for parent in parents:
+            parent._children.append(var)
+        variables.append(var)
+
+    return variables
+
+
+def bfs(source: MetaVariable, edges: str) -> set[str]:
+    seen = {source.name}
+    queue = deque([source])
+
+    while queue:
+        for var in getattr(queue.popleft(), edges):
+            if var.name not in seen:
+                seen.add(var.name)
+                queue.append(var)
+
+    return seen
+
+
+SEEDS = range(200)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_reaches_matches_bfs(seed):
+    variables = random_dag(seed)
+    index = ReachabilityIndex(variables)
+
+    for u in variables:
+        descendants = bfs(u, "_children")
+        for v in variables:
+            assert index.reaches(u, v) == (v.name in descendants), (u.name, v.name)
+
+
+@pytest.mark.parametrize("seed", SEEDS[:50])
+def test_descendants_and_ancestors_match_bfs(seed):
+    variables = random_dag(seed)
+
+    for var in variables:
+        assert {v.name for v in var.descendants()} == bfs(var, "_children")
+        assert {v.name for v in var.ancestors()} == bfs(var, "_parents")
+
+
+def test_overlapping_labels_without_reachability():
+    """The random DAGs include pairs whose labels are contained in each
+    other for every traversal but are not reachable, which are only ruled
+    out by the pruned DFS"""
+    false_positives = 0
+
+    for seed in SEEDS:
+        variables = random_dag(seed)
+        index = ReachabilityIndex(variables)
+        index._build()
+
+        for u in variables:
+            descendants = bfs(u, "_children")
+            for v in variables:
+                if v.name not in descendants and index._may_reach(u._id, v._id):
+                    false_positives += 1
+                    assert not index.reaches(u, v)
+
+    assert false_positives > 0
+
+
+def test_diamond_siblings():
+    # a -> b, a -> c, b -> d, c -> d: b and c are not related either way
+    a = MetaVariable("a", 0, [])
+    b = MetaVariable("b", 1, [a])
+    c = MetaVariable("c", 2, [a])
+    d = MetaVariable("d", 3, [b, c])
+    for child, parents in ((b, [a]), (c, [a]), (d, [b, c])):
+        for parent in parents:
+            parent._children.append(child)
+
+    index = ReachabilityIndex([a, b, c, d])
+
+    assert index.reaches(a, d)
+    assert index.reaches(b, d) and index.reaches(c, d)
+    assert not index.reaches(b, c) and not index.reaches(c, b)
+    assert not index.reaches(d, a)
+    assert not index.reaches(a, None)
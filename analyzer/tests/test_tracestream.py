@@ -0,0 +1,149 @@
+import json
+
+import pytest
+
+from pyanalyze import tracestream
+from pyanalyze.tracestream import TraceStreamDecoder
+from pyanalyze.vandal.tracefile import BinaryTrace
+
+OPS = [
+    {"pc": 0, "op": 96, "opIndex": 0, "ret": "0x80"},
+    {"pc": 2, "op": 96, "opIndex": 1, "ret": "0x40"},
+    {"pc": 4, "op": 82, "opIndex": 2, "ret": ""},
+    {"pc": 5, "op": 127, "opIndex": 3, "ret": hex(2**255 + 12345)},
+    {"pc": 38, "op": 84, "opIndex": 4, "ret": "0x0"},
+    {"pc": 1234567, "op": 241, "opIndex": 5, "ret": "0x1", "extra": "0xdeadbeef"},
+]
+
+TRACE = {"To": "0x00000000000000000000000000000000000000AA", "Ops": OPS}
+OTHER = {"To": "0x00000000000000000000000000000000000000bb", "Ops": OPS[::-1]}
+
+
+@pytest.fixture(params=["orjson", "json"])
+def loads(request, monkeypatch):
+    """Decode ops with orjson when it is installed, and with json as when
+    it is not"""
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(tracestream, "_loads", json.loads)
+
+
+def encode(value, compact: bool) -> bytes:
+    separators = (",", ":") if compact else (", ", ": ")
+    return json.dumps(value, separators=separators).encode() + b"\n"
+
+
+def decoded(trace: BinaryTrace):
+    # the word table is numbered in the order the chunks arrive, so traces
+    # are compared by their decoded rows
+    return trace.to, list(trace.rows())
+
+
+def built(value):
+    """value with every trace replaced by its decoded rows, so it compares
+    equal to what the decoder returns"""
+    if isinstance(value, BinaryTrace):
+        return decoded(value)
+    if isinstance(value, list):
+        return [built(item) for item in value]
+    if isinstance(value, dict):
+        if isinstance(value.get("Ops"), list):
+            return decoded(BinaryTrace.from_dict(value))
+        return {key: built(item) for key, item in value.items()}
+    return value
+
+
+def split_everywhere(data: bytes, decode_traces: bool = True):
+    """Decode data split into two chunks at every offset, and one byte at
+    a time"""
+    for i in range(len(data) + 1):
+        decoder = TraceStreamDecoder(decode_traces)
+        yield decoder.feed(data[:i]) + decoder.feed(data[i:])
+
+    decoder = TraceStreamDecoder(decode_traces)
+    yield [r for i in range(len(data)) for r in decoder.feed(data[i : i + 1])]
+
+
+RESPONSES = {
+    "transaction": {"jsonrpc": "2.0", "id": 123456789, "result": TRACE},
+    "empty ops": {"jsonrpc": "2.0", "id": 7, "result": {"To": "0xaa", "Ops": []}},
+    "error": {"jsonrpc": "2.0", "id": 8, "error": {"code": -32000, "message": "no trace"}},
+    "block": {
+        "jsonrpc": "2.0",
+        "id": 9,
+        "result": [{"txHash": "0x01", "result": TRACE}, {"txHash": "0x02", "result": OTHER}],
+    },
+    "batch": [
+        {"jsonrpc": "2.0", "id": 10, "result": TRACE},
+        {"jsonrpc": "2.0", "id": 11, "error": {"code": -32000, "message": "no trace"}},
+        {"jsonrpc": "2.0", "id": 12, "result": OTHER},
+    ],
+}
+
+
+@pytest.mark.parametrize("compact", [True, False])
+@pytest.mark.parametrize("name", RESPONSES)
+def test_split_at_every_offset(name, compact, loads):
+    response = RESPONSES[name]
+    data = encode(response, compact)
+
+    for responses in split_everywhere(data):
+        assert [built(r) for r in responses] == [built(json.loads(data))]
+
+
+@pytest.mark.parametrize("name", RESPONSES)
+def test_split_at_every_offset_without_decoding(name):
+    data = encode(RESPONSES[name], compact=True)
+
+    for responses in split_everywhere(data, decode_traces=False):
+        assert responses == [json.loads(data)]
+
+
+def test_splits_inside_numbers_and_ops():
+    data = encode(RESPONSES["transaction"], compact=True)
+    ops_start = data.index(b'"Ops"')
+    ops_end = data.index(b"]", ops_start)
+
+    # offsets that fall inside the id, inside a pc and between ops
+    offsets = [
+        data.index(b"123456789") + 4,
+        data.index(b"1234567,") + 3,
+        data.index(b"},{", ops_start) + 1,
+        ops_start + 3,
+        ops_end,
+    ]
+    assert all(0 < i < len(data) for i in offsets)
+
+    for i in offsets:
+        decoder = TraceStreamDecoder()
+        assert decoder.feed(data[:i]) == []
+        [response] = decoder.feed(data[i:])
+        assert built(response) == built(json.loads(data))
+
+
+def test_several_responses_per_chunk(loads):
+    data = b"".join(encode(response, compact=True) for response in RESPONSES.values())
+    expected = [built(response) for response in RESPONSES.values()]
+
+    for responses in split_everywhere(data):
+        assert [built(r) for r in responses] == expected
+
+
+def test_built_trace_keeps_address():
+    [response] = TraceStreamDecoder().feed(encode(RESPONSES["transaction"], compact=True))
+
+    trace = response["result"]
+    assert isinstance(trace, BinaryTrace)
+    assert len(trace) == len(OPS)
+    assert decoded(trace) == decoded(BinaryTrace.from_dict(TRACE))
+
+
+def test_malformed_ops():
+    decoder = TraceStreamDecoder()
+
+    with pytest.raises(ValueError):
+        decoder.feed(
+            b'{"id": 1, "result": {"To": "0xaa", '
+            b'"Ops": [{"pc": 0, "op": 0, "opIndex": 0, "ret": ""}, 5]}}\n'
+        )